@@ -0,0 +1,96 @@
+# -*- coding: UTF-8 -*-
+u"""
+Время разбора ответа HeroBag:loadData разными библиотеками json. Кроме
+библиотек из client.jsoncodec замеряется прежний способ - Response.json()
+из requests.
+
+    $ python3 -m benchmarks.json_decode --output json_decode.json
+    $ python3 -m benchmarks.json_decode --payload recorded_herobag.json
+
+Без --payload используются синтетические ответы разного размера (см.
+benchmarks.payloads).
+"""
+import argparse
+import json
+import os
+import timeit
+
+from . import payloads
+
+SIZES = ((100, 20), (1000, 100), (5000, 300))
+
+
+def requests_decoder(content):
+    u"""
+    Прежний способ: requests декодирует байты в строку и разбирает ее
+    стандартным json
+    """
+    import requests
+    response = requests.Response()
+    response._content = content
+    response.encoding = 'utf-8'
+    response.headers['content-type'] = 'application/json;charset=UTF-8'
+    return response.json()
+
+
+def get_decoders():
+    from client import jsoncodec
+    decoders = [('requests', requests_decoder)]
+    for name in jsoncodec.BACKENDS:
+        try:
+            decoders.append(jsoncodec.get_decoder(name))
+        except RuntimeError:
+            pass
+    return decoders
+
+
+def get_payloads(paths):
+    if paths:
+        result = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                result.append((os.path.basename(path), f.read()))
+        return result
+    return [
+        ('{}f/{}m'.format(followers, missions),
+         payloads.hero_bag_response(followers=followers, missions=missions))
+        for followers, missions in SIZES
+    ]
+
+
+def measure(decoder, content, repeat):
+    timer = timeit.Timer(lambda: decoder(content))
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number))
+    return best / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--payload', action='append', default=[],
+                        help=u"файл с записанным ответом HeroBag:loadData")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help=u"файл для результатов в json")
+    args = parser.parse_args()
+
+    decoders = get_decoders()
+    results = []
+    print(u"{:<16} {:>10} {:<10} {:>10} {:>8}".format(
+        u"ответ", u"размер, КБ", u"библиотека", u"мс", u"ускорение"))
+    for label, content in get_payloads(args.payload):
+        baseline = None
+        for name, decoder in decoders:
+            seconds = measure(decoder, content, args.repeat)
+            baseline = baseline or seconds
+            results.append({'payload': label, 'size': len(content),
+                            'backend': name, 'seconds': seconds})
+            print(u"{:<16} {:>10.1f} {:<10} {:>10.3f} {:>8.2f}".format(
+                label, len(content) / 1024.0, name, seconds * 1000,
+                baseline / seconds))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+# -*- coding: UTF-8 -*-
+u"""
+Потребление памяти моделью игровых объектов: RSS и объем выделенной памяти
+(tracemalloc) на 10 000 объектов каждого типа. Каждый замер выполняется в
+отдельном процессе.
+
+    $ python3 -m benchmarks.memory --count 10000 --output memory.json
+
+Режимы:
+    legacy   - прежняя модель: обычные классы с __dict__, поля копируются
+    entities - объекты Mission/Follower/Progress со __slots__
+    managers - объекты в хранилищах вместе с индексами
+"""
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import tracemalloc
+
+from . import payloads
+
+MODES = ('legacy', 'entities', 'managers')
+KINDS = ('followers', 'missions', 'progresses')
+
+
+class LegacyFollower:
+    def __init__(self, **kwargs):
+        self.id = kwargs['id']
+        self.efficiency = kwargs['efficiency']
+        self.in_progress = kwargs['inProgress']
+        self.profession = kwargs['profession']
+
+
+class LegacyMission:
+    def __init__(self, **kwargs):
+        self.id = kwargs['id']
+        self.name = kwargs['name']
+        self.in_progress = kwargs['inProgress']
+        self.is_success = kwargs['isSuccess']
+        self.difficulty = kwargs['difficulty']
+        self.duration = kwargs['duration']
+        self.experience = kwargs['experience']
+        self.price = kwargs['price']
+        self._professions = kwargs['professions']
+        self.slot_count = kwargs['slotCount']
+        self.quality_name = kwargs['missionQualityName']
+        self.mission_type = kwargs['missionType']
+
+
+class LegacyProgress:
+    def __init__(self, **kwargs):
+        import datetime
+        self.id = kwargs['id']
+        self.finished = kwargs['finished']
+        self.start_time = datetime.datetime.fromtimestamp(
+            kwargs['startTime'] // 1000)
+        self.end_time = datetime.datetime.fromtimestamp(
+            kwargs['endTime'] // 1000)
+        self.type = kwargs['type']
+        self.mission_id = kwargs['fuseData']['missionId']
+
+
+def current_rss():
+    u"""
+    Текущий RSS процесса в байтах
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def build(mode, kind, items):
+    from client import gamedata
+    if mode == 'legacy':
+        cls = {'followers': LegacyFollower, 'missions': LegacyMission,
+               'progresses': LegacyProgress}[kind]
+        return [cls(**item) for item in items]
+    if mode == 'entities':
+        cls = {'followers': gamedata.Follower, 'missions': gamedata.Mission,
+               'progresses': gamedata.Progress}[kind]
+        return [cls.from_data(item) for item in items]
+    manager = {'followers': gamedata.FollowerManager,
+               'missions': gamedata.MissionManager,
+               'progresses': gamedata.ProgressManager}[kind]()
+    manager.update_many(items)
+    return manager
+
+
+def measure(mode, kind, count):
+    u"""
+    Замер в текущем процессе: объекты строятся из json по одному, чтобы
+    разбор ответа не влиял на RSS, в памяти остаются только сами объекты
+    """
+    import client.gamedata  # noqa: импорт не должен попасть в замер
+    data = payloads.hero_bag(
+        followers=count if kind == 'followers' else 0,
+        missions=count, busy=1.0 if kind == 'progresses' else 0.3)
+    bodies = [json.dumps(item) for item in data[kind]]
+    del data
+    gc.collect()
+    rss_before = current_rss()
+    tracemalloc.start()
+    result = build(mode, kind, (json.loads(body) for body in bodies))
+    gc.collect()
+    allocated, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'mode': mode,
+        'kind': kind,
+        'count': len(bodies),
+        'allocated': allocated,
+        'peak': peak,
+        'rss': current_rss() - rss_before,
+    }
+
+
+def run_isolated(mode, kind, count):
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'benchmarks.memory', '--measure', mode, kind,
+         '--count', str(count)],
+        cwd=payloads.ROOT)
+    return json.loads(output.decode('utf-8'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--output', help=u"файл для результатов в json")
+    parser.add_argument('--measure', nargs=2, metavar=('MODE', 'KIND'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure[0], args.measure[1],
+                                 args.count)))
+        return
+
+    results = []
+    print(u"{:<12} {:<10} {:>16} {:>16}".format(
+        u"тип", u"режим", u"RSS, КБ/10k", u"alloc, КБ/10k"))
+    for kind in KINDS:
+        for mode in MODES:
+            result = run_isolated(mode, kind, args.count)
+            scale = 10000.0 / max(result['count'], 1) / 1024
+            result['rss_per_10k_kb'] = round(result['rss'] * scale, 1)
+            result['allocated_per_10k_kb'] = round(
+                result['allocated'] * scale, 1)
+            results.append(result)
+            print(u"{:<12} {:<10} {:>16} {:>16}".format(
+                kind, mode, result['rss_per_10k_kb'],
+                result['allocated_per_10k_kb']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
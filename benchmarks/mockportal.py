@@ -0,0 +1,500 @@
+# -*- coding: UTF-8 -*-
+u"""
+Локальный сервер, имитирующий портал SkyForge и сервер аутентификации
+mail.ru, для нагрузочного тестирования клиента без обращения к боевым
+серверам.
+
+    $ python3 -m benchmarks.mockportal --port 8080 \\
+        --write-config mock.conf --accounts 300
+    $ python3 ./supervisor.py --config-file mock.conf
+
+Реализованы страница портала (выдает csrf_token), форма аутентификации,
+HeroBag:loadData и операции запуска миссии (fuse) и завершения прогресса
+(finishProgress). Состояние игры создается для каждого логина при первом
+входе (см. payloads.hero_bag) или загружается из файла --state; длительность
+миссий сокращается в --time-scale раз.
+
+Ошибки, которые сервер возвращает с заданной вероятностью: ответ 503,
+зависание запроса дольше таймаута клиента, некорректный JSON и истечение
+сессии (вместо данных возвращается страница входа). Счетчики запросов и
+ошибок доступны по адресу /stats.
+"""
+import argparse
+import collections
+import copy
+import gzip
+import http.cookies
+import http.server
+import json
+import random
+import secrets
+import threading
+import time
+import urllib.parse
+import zlib
+
+from . import payloads
+
+PORTAL_PAGE_PATH = '/skyforgenews'
+AUTH_PATH = '/cgi-bin/auth'
+HERO_BAG_PATH = '/cult/HeroBag:loadData'
+FUSE_PATH = '/cult/HeroBag:fuse'
+FINISH_PROGRESS_PATH = '/cult/HeroBag:finishProgress'
+STATS_PATH = '/stats'
+
+SESSION_COOKIE = 'sf_session'
+LOGIN_PAGE = (u"<html><body><form action=\"{}\">Вход</form></body>"
+              u"</html>").format(AUTH_PATH).encode('utf-8')
+BROKEN_JSON = b'{"spec": {"wallet": '
+# ответы меньше этого размера не сжимаются
+GZIP_MIN_SIZE = 1024
+# валюта, в которой начисляется награда за миссию
+REWARD_CURRENCY = '1'
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description=u"Локальный сервер портала SkyForge для тестов")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--followers', type=int, default=100,
+                        help=u"адептов в новом аккаунте")
+    parser.add_argument('--missions', type=int, default=30,
+                        help=u"миссий в новом аккаунте")
+    parser.add_argument('--busy', type=float, default=0.0,
+                        help=u"доля миссий, уже выполняющихся при создании")
+    parser.add_argument('--state', default=None,
+                        help=u"json с данными HeroBag (поле spec) для всех "
+                             u"аккаунтов вместо сгенерированных")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--password', default=None,
+                        help=u"пароль для всех аккаунтов, по умолчанию "
+                             u"принимается любой")
+    parser.add_argument('--time-scale', type=float, default=60.0,
+                        help=u"во сколько раз сократить длительность миссий")
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help=u"задержка ответа, секунд")
+    parser.add_argument('--jitter', type=float, default=0.05,
+                        help=u"случайная добавка к задержке, до секунд")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help=u"вероятность ответа 503")
+    parser.add_argument('--timeout-rate', type=float, default=0.0,
+                        help=u"вероятность зависания запроса")
+    parser.add_argument('--timeout-delay', type=float, default=30.0,
+                        help=u"длительность зависания, секунд")
+    parser.add_argument('--bad-json-rate', type=float, default=0.0,
+                        help=u"вероятность некорректного JSON в ответе")
+    parser.add_argument('--auth-expiry-rate', type=float, default=0.0,
+                        help=u"вероятность истечения сессии при запросе")
+    parser.add_argument('--session-ttl', type=float, default=None,
+                        help=u"время жизни сессии, секунд")
+    parser.add_argument('--no-gzip', dest='gzip', action='store_false',
+                        help=u"не сжимать ответы")
+    parser.add_argument('--write-config', default=None, metavar='PATH',
+                        help=u"записать конфиг клиента для этого сервера")
+    parser.add_argument('--accounts', type=int, default=1,
+                        help=u"количество аккаунтов в --write-config")
+    return parser
+
+
+class GameState:
+    u"""
+    Состояние игры одного аккаунта. Изменяется под блокировкой, так как
+    запросы аккаунта могут выполняться одновременно
+
+    :param data: данные HeroBag (поле spec)
+    :param time_scale: во сколько раз сократить длительность миссий
+    """
+    def __init__(self, data, time_scale=1.0):
+        self.wallet = dict(data.get('wallet', {}))
+        self.followers = {f['id']: f for f in data['followers']}
+        self.missions = {m['id']: m for m in data['missions']}
+        self.progresses = {p['id']: p for p in data['progresses']}
+        self.time_scale = time_scale
+        # адепты, занятые в прогрессах
+        self.progress_followers = {}
+        self.next_progress_id = max(self.progresses, default=0) + 1
+        self.lock = threading.Lock()
+
+    def snapshot(self, now_ms):
+        u"""
+        :return: dict данные в формате HeroBag
+        """
+        progresses = []
+        for progress in self.progresses.values():
+            progress = dict(progress)
+            progress['finished'] = progress['endTime'] <= now_ms
+            progresses.append(progress)
+        return {
+            'wallet': dict(self.wallet),
+            'followers': [dict(f) for f in self.followers.values()],
+            'missions': [dict(m) for m in self.missions.values()],
+            'progresses': progresses,
+        }
+
+    def fuse(self, mission_id, follower_ids, now_ms):
+        u"""
+        Запускает миссию. Как и клиент (см. assignment.GreedyPlanner),
+        сервер допускает команду не больше slotCount адептов
+
+        :return: None при успехе или причина отказа
+        """
+        mission = self.missions.get(mission_id)
+        if mission is None:
+            return 'MissionNotFound'
+        if mission['inProgress']:
+            return 'MissionInProgress'
+        if not follower_ids or len(follower_ids) > mission['slotCount']:
+            return 'WrongFollowersCount'
+        followers = [self.followers.get(i) for i in follower_ids]
+        if any(f is None or f['inProgress'] for f in followers):
+            return 'FollowerBusy'
+        price = mission['price']['currencies']
+        for currency in price:
+            if (self.wallet.get(str(currency['id']), 0) <
+                    currency['amount']):
+                return 'NotEnoughMoney'
+        for currency in price:
+            self.wallet[str(currency['id'])] -= currency['amount']
+        mission['inProgress'] = True
+        for follower in followers:
+            follower['inProgress'] = True
+        progress_id = self.next_progress_id
+        self.next_progress_id += 1
+        self.progresses[progress_id] = {
+            'id': progress_id,
+            'startTime': now_ms,
+            'endTime': now_ms + int(
+                mission['duration'] * 1000 / self.time_scale),
+            'type': 'FUSE',
+            'fuseData': {'missionId': mission_id},
+        }
+        self.progress_followers[progress_id] = follower_ids
+        return None
+
+    def finish_progress(self, progress_id, now_ms):
+        u"""
+        Завершает прогресс, освобождает адептов и начисляет награду
+
+        :return: None при успехе или причина отказа
+        """
+        progress = self.progresses.get(progress_id)
+        if progress is None:
+            return 'ProgressNotFound'
+        if progress['endTime'] > now_ms:
+            return 'ProgressNotFinished'
+        del self.progresses[progress_id]
+        for follower_id in self.progress_followers.pop(progress_id, []):
+            self.followers[follower_id]['inProgress'] = False
+        mission = self.missions.get(progress['fuseData']['missionId'])
+        if mission is not None:
+            mission['inProgress'] = False
+            if mission['isSuccess']:
+                self.wallet[REWARD_CURRENCY] = (
+                    self.wallet.get(REWARD_CURRENCY, 0) +
+                    mission['experience'])
+        return None
+
+
+class MockPortal:
+    u"""
+    Данные сервера: состояния аккаунтов, сессии и счетчики запросов
+    """
+    def __init__(self, options):
+        self.options = options
+        self.state_data = None
+        if options.state:
+            with open(options.state) as f:
+                self.state_data = json.load(f)
+        self.accounts = {}
+        # token -> (login, время окончания или None)
+        self.sessions = {}
+        self.stats = collections.Counter()
+        self.lock = threading.Lock()
+        self.rnd = random.Random(options.seed)
+        self.base_url = None
+
+    def get_state(self, login):
+        with self.lock:
+            state = self.accounts.get(login)
+            if state is None:
+                if self.state_data is not None:
+                    data = copy.deepcopy(self.state_data)
+                else:
+                    data = payloads.hero_bag(
+                        followers=self.options.followers,
+                        missions=self.options.missions,
+                        busy=self.options.busy,
+                        seed=self.options.seed ^ zlib.crc32(
+                            login.encode('utf-8')))
+                state = self.accounts[login] = GameState(
+                    data, self.options.time_scale)
+            return state
+
+    def create_session(self, login):
+        token = secrets.token_hex(16)
+        ttl = self.options.session_ttl
+        with self.lock:
+            self.sessions[token] = (login,
+                                    time.time() + ttl if ttl else None)
+        return token
+
+    def get_login(self, token):
+        u"""
+        :return: логин авторизованной сессии или None
+        """
+        with self.lock:
+            session = self.sessions.get(token)
+            if session is None:
+                return None
+            login, expires = session
+            if expires is not None and expires < time.time():
+                del self.sessions[token]
+                return None
+            return login
+
+    def expire_session(self, token):
+        with self.lock:
+            self.sessions.pop(token, None)
+
+    def roll(self, rate):
+        if not rate:
+            return False
+        with self.lock:
+            return self.rnd.random() < rate
+
+    def delay(self):
+        with self.lock:
+            return self.options.latency + self.rnd.uniform(
+                0, self.options.jitter)
+
+    def count(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.stats[key] += 1
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'requests': dict(self.stats),
+                'accounts': len(self.accounts),
+                'sessions': len(self.sessions),
+            }
+
+
+class PortalHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def portal(self):
+        return self.server.portal
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+    def handle_request(self):
+        try:
+            self.dispatch()
+        except (BrokenPipeError, ConnectionResetError):
+            # клиент закрыл соединение, например, по таймауту
+            self.close_connection = True
+
+    def dispatch(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        if self.command == 'POST':
+            length = int(self.headers.get('Content-Length') or 0)
+            params.update(urllib.parse.parse_qs(
+                self.rfile.read(length).decode('utf-8')))
+        if url.path == STATS_PATH:
+            return self.send_json(self.portal.get_stats())
+        self.portal.count(url.path)
+        if self.inject_errors(url.path):
+            return
+        if url.path == PORTAL_PAGE_PATH:
+            return self.portal_page()
+        if url.path == AUTH_PATH and self.command == 'POST':
+            return self.authenticate(params)
+        if url.path in (HERO_BAG_PATH, FUSE_PATH, FINISH_PROGRESS_PATH):
+            return self.api(url.path, params)
+        self.send_body(404, b'Not found', 'text/plain')
+
+    def inject_errors(self, path):
+        u"""
+        Задержка ответа и случайные ошибки сервера
+
+        :return: True, если запрос уже обработан
+        """
+        portal = self.portal
+        time.sleep(portal.delay())
+        if portal.roll(portal.options.timeout_rate):
+            portal.count('injected:timeout')
+            time.sleep(portal.options.timeout_delay)
+            self.close_connection = True
+            return True
+        if portal.roll(portal.options.error_rate):
+            portal.count('injected:503')
+            self.send_body(503, b'Service Unavailable', 'text/plain')
+            return True
+        if path != AUTH_PATH and portal.roll(portal.options.bad_json_rate):
+            portal.count('injected:bad_json')
+            self.send_body(200, BROKEN_JSON, 'application/json')
+            return True
+        return False
+
+    def cookies(self):
+        cookie = http.cookies.SimpleCookie(self.headers.get('Cookie', ''))
+        return {name: morsel.value for name, morsel in cookie.items()}
+
+    def portal_page(self):
+        csrf_token = self.cookies().get('csrf_token') or secrets.token_hex(8)
+        self.send_body(200, LOGIN_PAGE, 'text/html', [
+            ('Set-Cookie', 'csrf_token={}; Path=/'.format(csrf_token))])
+
+    def authenticate(self, params):
+        def get(name):
+            return params.get(name, [''])[0]
+
+        page = get('Page') or self.portal.base_url + PORTAL_PAGE_PATH
+        password = self.portal.options.password
+        if not get('Login') or (password and get('Password') != password):
+            self.portal.count('auth:fail')
+            location = page + ('&' if '?' in page else '?') + 'fail=1'
+            return self.send_body(302, b'', 'text/html',
+                                  [('Location', location)])
+        token = self.portal.create_session(get('Login'))
+        self.send_body(302, b'', 'text/html', [
+            ('Location', page),
+            ('Set-Cookie', '{}={}; Path=/'.format(SESSION_COOKIE, token))])
+
+    def api(self, path, params):
+        cookies = self.cookies()
+        token = cookies.get(SESSION_COOKIE)
+        login = self.portal.get_login(token) if token else None
+        if login is not None and self.portal.roll(
+                self.portal.options.auth_expiry_rate):
+            self.portal.count('injected:auth_expiry')
+            self.portal.expire_session(token)
+            login = None
+        csrf_token = params.get('csrf_token', [None])[0]
+        if login is None or csrf_token != cookies.get('csrf_token'):
+            self.portal.count('auth:required')
+            return self.send_body(200, LOGIN_PAGE, 'text/html')
+
+        state = self.portal.get_state(login)
+        now_ms = int(time.time() * 1000)
+        with state.lock:
+            if path == HERO_BAG_PATH:
+                spec = state.snapshot(now_ms)
+                spec['finishProgressOperationLink'] = \
+                    self.portal.base_url + FINISH_PROGRESS_PATH
+                spec['fuseOperationLink'] = self.portal.base_url + FUSE_PATH
+                return self.send_json({'spec': spec})
+            try:
+                if path == FUSE_PATH:
+                    cause = state.fuse(
+                        int(params['questId'][0]),
+                        [int(i) for i in params.get('followerId', [])],
+                        now_ms)
+                else:
+                    cause = state.finish_progress(
+                        int(params['progressId'][0]), now_ms)
+            except (KeyError, ValueError):
+                return self.send_body(400, b'Bad request', 'text/plain')
+            update = state.snapshot(now_ms)
+        self.portal.count('{}:{}'.format(path, cause or 'Success'))
+        self.send_json({'spec': {
+            'operationResult': {'status': 'Fail' if cause else 'Success',
+                                'actionFailCause': cause or 'None'},
+            'updateData': update,
+        }})
+
+    def send_json(self, data):
+        self.send_body(200, json.dumps(data).encode('utf-8'),
+                       'application/json')
+
+    def send_body(self, status, body, content_type, headers=()):
+        extra = list(headers)
+        if (self.portal.options.gzip and len(body) >= GZIP_MIN_SIZE and
+                'gzip' in self.headers.get('Accept-Encoding', '')):
+            body = gzip.compress(body, compresslevel=1)
+            extra.append(('Content-Encoding', 'gzip'))
+        self.send_response(status)
+        self.send_header('Content-Type',
+                         '{}; charset=utf-8'.format(content_type))
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in extra:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def create_server(options):
+    u"""
+    :param options: параметры из get_parser
+    :return: ThreadingHTTPServer, данные сервера - в атрибуте portal
+    """
+    server = http.server.ThreadingHTTPServer(
+        (options.host, options.port), PortalHandler)
+    server.daemon_threads = True
+    server.portal = MockPortal(options)
+    server.portal.base_url = 'http://{}:{}'.format(*server.server_address)
+    return server
+
+
+def write_config(path, base_url, accounts, password=None):
+    u"""
+    Записывает конфиг клиента с accounts аккаунтами для работы с сервером
+    base_url. Ограничения частоты запросов отключены
+    """
+    lines = [
+        '[Auth]',
+        'Page={}{}'.format(base_url, PORTAL_PAGE_PATH),
+        'Login=user0',
+        'Domain=mail.ru',
+        'Password={}'.format(password or 'password'),
+        '',
+        '[Server]',
+        'Portal={}'.format(base_url),
+        'Auth={}{}'.format(base_url, AUTH_PATH),
+        '',
+        '[RateLimit]',
+        'Account=0',
+        'Global=0',
+        '',
+    ]
+    if accounts > 1:
+        for i in range(accounts):
+            lines.extend(['[Account user{}]'.format(i),
+                          'Login=user{}'.format(i), ''])
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines))
+
+
+def main():
+    options = get_parser().parse_args()
+    server = create_server(options)
+    base_url = server.portal.base_url
+    if options.write_config:
+        write_config(options.write_config, base_url, options.accounts,
+                     options.password)
+        print(u"Конфиг клиента записан в {}".format(options.write_config))
+    print(u"Сервер запущен на {}".format(base_url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.portal.get_stats(), indent=2,
+                         ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# -*- coding: UTF-8 -*-
+u"""
+Генератор синтетических данных HeroBag:loadData для бенчмарков
+"""
+import json
+import os
+import random
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+EXAMPLE_CONFIG = os.path.join(ROOT, 'docs', 'sfpy.conf.example')
+
+QUALITY_NAMES = [u"Добыча ресурсов", u"Вторжение", u"Развитие культа",
+                 u"Боевое задание"]
+PROFESSIONS = 8
+
+
+def example_config():
+    u"""
+    Настройки из шаблона конфига в docs, которых достаточно бенчмаркам
+
+    :return: client.settings.Config
+    """
+    from client.settings import Config
+    return Config.from_file(EXAMPLE_CONFIG)
+
+
+def follower(rnd, id_, busy=False):
+    profession = rnd.randint(1, PROFESSIONS)
+    return {
+        'id': id_,
+        'name': u"Адепт {}".format(id_),
+        'efficiency': rnd.randint(1, 1000),
+        'inProgress': busy,
+        'level': rnd.randint(1, 30),
+        'profession': {'id': profession,
+                       'name': u"Профессия {}".format(profession)},
+        'portrait': '/images/followers/{}.png'.format(id_ % 50),
+    }
+
+
+def mission(rnd, id_, in_progress=False):
+    paid = rnd.random() < 0.2
+    slots = rnd.randint(1, 5)
+    return {
+        'id': id_,
+        'name': u"Миссия {}".format(id_),
+        'description': u"Описание миссии {}".format(id_) * 3,
+        'inProgress': in_progress,
+        'isSuccess': rnd.random() < 0.8,
+        'difficulty': rnd.randint(1, 5),
+        'duration': rnd.choice([600, 1800, 3600, 7200, 14400]),
+        'experience': rnd.randint(10, 500) * slots,
+        'price': {
+            'currencies': [{'id': 1, 'amount': rnd.randint(10, 100)}]
+            if paid else [],
+            'resources': [],
+        },
+        'professions': [{'id': rnd.randint(1, PROFESSIONS)}
+                        for _ in range(rnd.randint(1, 2))],
+        'slotCount': slots,
+        'missionQualityName': rnd.choice(QUALITY_NAMES),
+        'missionType': 'Case' if rnd.random() < 0.05 else 'Normal',
+    }
+
+
+def progress(rnd, id_, mission_id, now_ms, finished=False):
+    start = now_ms - rnd.randint(0, 3600) * 1000
+    return {
+        'id': id_,
+        'finished': finished,
+        'startTime': start,
+        'endTime': start + rnd.choice([600, 1800, 3600, 7200]) * 1000,
+        'type': 'FUSE',
+        'fuseData': {'missionId': mission_id},
+    }
+
+
+def hero_bag(followers=1000, missions=100, busy=0.3, seed=0):
+    u"""
+    Возвращает данные HeroBag: followers адептов, missions миссий, доля
+    busy из них уже выполняется
+
+    :return: dict (содержимое поля 'spec')
+    """
+    rnd = random.Random(seed)
+    now_ms = int(time.time() * 1000)
+    mission_list = [mission(rnd, 100000 + i, rnd.random() < busy)
+                    for i in range(missions)]
+    progresses = [
+        progress(rnd, 200000 + i, m['id'], now_ms, rnd.random() < 0.3)
+        for i, m in enumerate(mission_list) if m['inProgress']
+    ]
+    return {
+        'wallet': {'1': 10 ** 6},
+        'followers': [follower(rnd, i, rnd.random() < busy)
+                      for i in range(followers)],
+        'missions': mission_list,
+        'progresses': progresses,
+        'finishProgressOperationLink': '/cult/HeroBag:finishProgress',
+        'fuseOperationLink': '/cult/HeroBag:fuse',
+    }
+
+
+def hero_bag_response(**kwargs):
+    u"""
+    Возвращает тело ответа HeroBag:loadData в байтах
+    """
+    return json.dumps({'spec': hero_bag(**kwargs)}).encode('utf-8')
@@ -0,0 +1,322 @@
+# -*- coding: UTF-8 -*-
+u"""
+Время хода Game при большом количестве адептов и миссий. Ход выполняется
+полностью: update_state и process_state с обоими планировщиками, запросы к
+API заменены заглушкой, которая изменяет состояние так же, как сервер (см.
+benchmarks.mockportal.GameState). Между ходами время заглушки переводится
+вперед, и все прогрессы завершаются; часы Game идут по времени заглушки,
+поэтому ход, как и у клиента, может начаться без загрузки состояния (см.
+client.gamedata.StateProjector).
+
+    $ python3 -m benchmarks.planning --output planning.json
+    $ python3 -m benchmarks.planning --large --turns 1 --repeat 1
+    $ python3 -m benchmarks.planning --compare planning.json
+
+Для каждого хода выводится общее время, время без учета заглушки API,
+время фаз хода (см. client.profiling) и количество запросов к API, в том
+числе отклоненных заглушкой (например, start_mission:FollowerBusy). Объем
+выделенной памяти замеряется отдельным проходом с tracemalloc. Каждый
+размер замеряется в отдельном процессе. Результаты в json содержат
+коммит, на котором выполнен замер; --compare сравнивает с результатами
+из файла.
+"""
+import argparse
+import collections
+import gc
+import json
+import logging
+import platform
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+
+from . import payloads
+from .mockportal import GameState
+
+SIZES = ((1000, 100), (10000, 1000))
+# замер на 100 000 адептов занимает десятки минут, выполняется с --large
+LARGE_SIZES = ((100000, 10000),)
+PLANNERS = ('assignment', 'greedy', 'lookahead')
+
+
+class StubGameState(GameState):
+    u"""
+    Состояние заглушки API. Данные отдаются без копирования, клиент их не
+    изменяет
+    """
+    def snapshot(self, now_ms):
+        progresses = []
+        for progress in self.progresses.values():
+            progress['finished'] = progress['endTime'] <= now_ms
+            progresses.append(progress)
+        return {
+            'wallet': dict(self.wallet),
+            'followers': list(self.followers.values()),
+            'missions': list(self.missions.values()),
+            'progresses': progresses,
+        }
+
+
+def create_game(planner, data):
+    u"""
+    :return: client.gamedata.Game с заглушкой API
+    """
+    from client.assignment import get_planner
+    from client.gameapi import APIManager
+    from client.gamedata import Game
+
+    class StubAPIManager(APIManager):
+        u"""
+        Заглушка API: операции выполняются над StubGameState, учитываются
+        количество запросов и время работы заглушки
+        """
+        def __init__(self, logger=None):
+            super().__init__(logger)
+            self.state = StubGameState(data)
+            self.now_ms = int(time.time() * 1000)
+            self.calls = collections.Counter()
+            self.seconds = 0.0
+
+        def _call(self, name, func, *args):
+            start = time.perf_counter()
+            with self.state.lock:
+                self.calls[name] += 1
+                result = func(*args)
+            self.seconds += time.perf_counter() - start
+            return result
+
+        def get_game_data(self):
+            return self._call('hero_bag', self.state.snapshot, self.now_ms)
+
+        def start(self, session):
+            self.started = True
+            return self.get_game_data()
+
+        def _operation(self, name, func, *args):
+            cause = func(*args)
+            if cause:
+                self.calls[name + ':' + cause] += 1
+            return (self.STATUS_GAME_ERROR if cause else
+                    self.STATUS_SUCCESS), {
+                'operationResult': {
+                    'status': 'Fail' if cause else 'Success',
+                    'actionFailCause': cause or 'None'},
+                'updateData': self.state.snapshot(self.now_ms),
+            }
+
+        def start_mission(self, mission, followers):
+            return self._call(
+                'start_mission', self._operation, 'start_mission',
+                self.state.fuse, mission.id, [f.id for f in followers],
+                self.now_ms)
+
+        def finish_progress(self, progress):
+            return self._call(
+                'finish_progress', self._operation, 'finish_progress',
+                self.state.finish_progress, progress.id, self.now_ms)
+
+        def finish_all(self):
+            u"""
+            Переводит время вперед, чтобы все прогрессы завершились
+            """
+            self.now_ms = max([p['endTime'] for p in
+                               self.state.progresses.values()] +
+                              [self.now_ms]) + 1
+
+    class StubGame(Game):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.clock = lambda: self.api.now_ms / 1000.0
+
+        def create_api(self):
+            return StubAPIManager(self.logger)
+
+    return StubGame(planner=get_planner(planner))
+
+
+def run_turns(planner, followers, missions, turns, seed):
+    u"""
+    Выполняет turns ходов
+
+    :return: list of dicts, результаты ходов
+    """
+    from client.profiling import TurnProfile
+    game = create_game(planner, payloads.hero_bag(
+        followers=followers, missions=missions, busy=0.0, seed=seed))
+    results = []
+    for turn in range(turns):
+        api = game.api
+        calls, api_seconds = api.calls.copy(), api.seconds
+        game.profile = TurnProfile(None, 'benchmark')
+        start = time.perf_counter()
+        if turn == 0:
+            game.start(None)
+        else:
+            game.turn()
+        seconds = time.perf_counter() - start
+        api_seconds = api.seconds - api_seconds
+        results.append({
+            'turn': turn,
+            'seconds': seconds,
+            'client_seconds': seconds - api_seconds,
+            'api_calls': dict(api.calls - calls),
+            'counters': dict(game.profile.counters),
+            'phases': {name: total for name, (total, _) in
+                       game.profile.phases.items()},
+        })
+        api.finish_all()
+    return results
+
+
+def measure_functions(followers, missions, seed):
+    u"""
+    Время отдельных функций выбора миссий и адептов на загруженном
+    состоянии
+    """
+    from client.gamedata import FollowerManager, MissionManager
+    data = payloads.hero_bag(followers=followers, missions=missions,
+                             busy=0.3, seed=seed)
+    follower_manager = FollowerManager()
+    follower_manager.update_many(data['followers'])
+    mission_manager = MissionManager()
+    mission_manager.update_many(data['missions'])
+    functions = {
+        'FollowerManager.get_efficient':
+            lambda: follower_manager.get_efficient(),
+        'FollowerManager.get_efficient(count=5, free=True)':
+            lambda: follower_manager.get_efficient(count=5, free=True),
+        'MissionManager.mining_missions':
+            lambda: mission_manager.mining_missions(),
+        'MissionManager.update_many':
+            lambda: mission_manager.update_many(data['missions']),
+        'FollowerManager.update_many':
+            lambda: follower_manager.update_many(data['followers']),
+    }
+    result = {}
+    for name, func in functions.items():
+        timer = timeit.Timer(func)
+        number, _ = timer.autorange()
+        result[name] = min(timer.repeat(repeat=3, number=number)) / number
+    return result
+
+
+def measure(planner, followers, missions, turns, seed, repeat):
+    u"""
+    Замер в текущем процессе: ходы без tracemalloc repeat раз (для
+    каждого хода берется самый быстрый повтор), затем те же ходы с
+    tracemalloc для подсчета выделенной памяти
+    """
+    import client.gamedata  # noqa: импорт не должен попасть в замер
+    # вывод лога не замеряется, отказы сервера учитываются в api_calls
+    logging.disable(logging.CRITICAL)
+    gc.collect()
+    result = {
+        'planner': planner,
+        'followers': followers,
+        'missions': missions,
+        'turns': [min(runs, key=lambda r: r['client_seconds'])
+                  for runs in zip(*[
+                      run_turns(planner, followers, missions, turns, seed)
+                      for _ in range(repeat)])],
+        'functions': measure_functions(followers, missions, seed),
+    }
+    gc.collect()
+    tracemalloc.start()
+    run_turns(planner, followers, missions, turns, seed)
+    allocated, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result['allocated'] = allocated
+    result['peak'] = peak
+    return result
+
+
+def run_isolated(planner, followers, missions, turns, seed, repeat):
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'benchmarks.planning', '--measure', planner,
+         str(followers), str(missions), '--turns', str(turns),
+         '--seed', str(seed), '--repeat', str(repeat)],
+        cwd=payloads.ROOT)
+    return json.loads(output.decode('utf-8'))
+
+
+def get_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=payloads.ROOT,
+            stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _key(result):
+    return result['planner'], result['followers'], result['missions']
+
+
+def print_result(result, baseline=None):
+    for turn in result['turns']:
+        line = u"{:<11} {:>7} {:>6} {:>3} {:>10.3f} {:>10.3f} {:>7} " \
+               u"{:>7}".format(
+                   result['planner'], result['followers'],
+                   result['missions'], turn['turn'], turn['seconds'],
+                   turn['client_seconds'],
+                   turn['api_calls'].get('start_mission', 0),
+                   turn['api_calls'].get('finish_progress', 0))
+        if baseline is not None and turn['turn'] < len(baseline['turns']):
+            old = baseline['turns'][turn['turn']]['client_seconds']
+            line += u" {:>8.2f}x".format(old / turn['client_seconds'])
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size', nargs=2, type=int, action='append',
+                        metavar=('FOLLOWERS', 'MISSIONS'),
+                        help=u"количество адептов и миссий, можно указать "
+                             u"несколько раз")
+    parser.add_argument('--large', action='store_true',
+                        help=u"добавить замеры на 100 000 адептов")
+    parser.add_argument('--planner', action='append', choices=PLANNERS)
+    parser.add_argument('--turns', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help=u"повторов замера времени")
+    parser.add_argument('--output', help=u"файл для результатов в json")
+    parser.add_argument('--compare', help=u"файл с прежними результатами")
+    parser.add_argument('--measure', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        planner, followers, missions = args.measure
+        print(json.dumps(measure(planner, int(followers), int(missions),
+                                 args.turns, args.seed, args.repeat)))
+        return
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {_key(r): r for r in json.load(f)['results']}
+    results = []
+    print(u"{:<11} {:>7} {:>6} {:>3} {:>10} {:>10} {:>7} {:>7}{}".format(
+        u"стратегия", u"адептов", u"миссий", u"ход", u"время, с",
+        u"клиент, с", u"запуск", u"заверш",
+        u" {:>9}".format(u"ускорение") if baseline else ''))
+    sizes = list(args.size or SIZES)
+    if args.large:
+        sizes.extend(LARGE_SIZES)
+    for followers, missions in sizes:
+        for planner in args.planner or PLANNERS:
+            result = run_isolated(planner, followers, missions, args.turns,
+                                  args.seed, args.repeat)
+            results.append(result)
+            print_result(result, baseline.get(_key(result)))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'revision': get_revision(),
+                       'python': platform.python_version(),
+                       'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
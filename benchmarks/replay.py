@@ -0,0 +1,153 @@
+# -*- coding: UTF-8 -*-
+u"""
+Ходы Game на записанном трафике портала (см. client.recording). Запись
+воспроизводится через Session с ReplayAdapter, поэтому работают те же
+разбор ответов, обновление состояния и планирование, что и с сервером.
+
+    $ python3 -m benchmarks.replay record.gz
+    $ python3 -m benchmarks.replay record.gz --planner greedy --speed 1
+
+Сначала замеряется разбор всех ответов HeroBag из записи каждой
+библиотекой json (МБ/с), затем выполняются ходы, пока не закончатся
+записанные ответы. Для каждого хода выводятся время, количество запросов
+и время фаз (см. client.profiling); ход, прерванный концом записи, не
+учитывается. Записанные ошибки сети повторяются по политике повторов
+клиента, ожидание перед повтором входит во время хода. Запросы клиента
+сопоставляются с записью по пути url и порядку, поэтому при другой
+стратегии ответы на запуск миссий могут не соответствовать запросам.
+"""
+import argparse
+import collections
+import json
+import logging
+import time
+
+from . import payloads
+from .json_decode import get_decoders, measure
+
+PLANNERS = ('assignment', 'greedy')
+
+
+def select_records(records, account=None):
+    u"""
+    :param account: хеш аккаунта из записи, по умолчанию - аккаунт первой
+        записи
+    """
+    if not records:
+        return []
+    account = account or records[0]['account']
+    return [r for r in records if r['account'] == account]
+
+
+def measure_parsing(records, repeat):
+    u"""
+    :return: dict библиотека -> МБ/с на ответах HeroBag из записи
+    """
+    from client.gameapi import APIManager
+    bodies = [r['body'].encode('utf-8') for r in records
+              if r['endpoint'] == APIManager.ENDPOINT_HERO_BAG and
+              'body' in r]
+    size = sum(len(body) for body in bodies)
+    result = collections.OrderedDict()
+    if not bodies:
+        return result
+    for name, decoder in get_decoders():
+        seconds = sum(measure(decoder, body, repeat) for body in bodies)
+        result[name] = size / seconds / 1024.0 / 1024.0
+    return result
+
+
+def run_turns(records, planner, speed):
+    u"""
+    Выполняет ходы, пока не закончатся записанные ответы
+
+    :return: list of dicts, результаты ходов
+    """
+    from client.assignment import get_planner
+    from client.auth import Session
+    from client.gamedata import Game
+    from client.profiling import TurnProfile
+    from client.recording import REDACTED, ReplayAdapter, ReplayFinished
+
+    config = payloads.example_config()
+    session = Session(config.accounts[0], config=config)
+    adapter = ReplayAdapter(records, speed)
+    session.session.mount('https://', adapter)
+    session.session.mount('http://', adapter)
+    session.cookies = {'csrf_token': REDACTED}
+    game = Game(planner=get_planner(planner), sync_interval=0)
+    results = []
+    turn = 0
+    while True:
+        game.profile = TurnProfile(None, 'replay')
+        start = time.perf_counter()
+        try:
+            if turn == 0:
+                game.start(session)
+            else:
+                game.turn()
+        except ReplayFinished:
+            return results
+        results.append({
+            'turn': turn,
+            'seconds': time.perf_counter() - start,
+            'requests': session.transport_stats.pop()['requests'],
+            'counters': dict(game.profile.counters),
+            'phases': {name: total for name, (total, _) in
+                       game.profile.phases.items()},
+        })
+        turn += 1
+
+
+def main():
+    from client.recording import read_records
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('recording', help=u"журнал запросов")
+    parser.add_argument('--account',
+                        help=u"хеш аккаунта в записи, по умолчанию - "
+                             u"аккаунт первого запроса")
+    parser.add_argument('--planner', choices=PLANNERS, default='assignment')
+    parser.add_argument('--speed', type=float, default=0,
+                        help=u"ускорение относительно записанных "
+                             u"интервалов, 0 - без ожидания")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help=u"повторов замера разбора json")
+    parser.add_argument('--output', help=u"файл для результатов в json")
+    args = parser.parse_args()
+
+    records = select_records(list(read_records(args.recording)),
+                             args.account)
+    endpoints = collections.Counter(r['endpoint'] for r in records)
+    print(u"Запросов в записи: {} ({})".format(len(records), ', '.join(
+        u"{} {}".format(name, count) for name, count in endpoints.items())))
+
+    parsing = measure_parsing(records, args.repeat)
+    for name, speed in parsing.items():
+        print(u"Разбор HeroBag, {:<8} {:>8.1f} МБ/с".format(name, speed))
+
+    # вывод лога не замеряется
+    logging.disable(logging.CRITICAL)
+    turns = run_turns(records, args.planner, args.speed)
+    logging.disable(logging.NOTSET)
+    print(u"{:>4} {:>10} {:>8} {:>12} {:>12}".format(
+        u"ход", u"время, с", u"запросов", u"состояние, с",
+        u"планир., с"))
+    for turn in turns:
+        phases = turn['phases']
+        print(u"{:>4} {:>10.3f} {:>8} {:>12.3f} {:>12.3f}".format(
+            turn['turn'], turn['seconds'], turn['requests'],
+            phases.get('update_state', 0),
+            phases.get('plan_missions', 0) +
+            phases.get('plan_progresses', 0)))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'recording': args.recording,
+                       'planner': args.planner,
+                       'requests': len(records),
+                       'parsing': parsing,
+                       'turns': turns}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
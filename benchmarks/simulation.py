@@ -0,0 +1,322 @@
+# -*- coding: UTF-8 -*-
+u"""
+Симулятор культа для сравнения стратегий планирования без сервера. Ходы
+выполняет тот же Game (обновление состояния, iter_actions, планировщики),
+запросы к API заменены симуляцией, время - виртуальными часами: между
+ходами часы переводятся на задержку, которую выбрал Scheduler клиента,
+поэтому недели игры моделируются за секунды.
+
+    $ python3 -m benchmarks.simulation --days 14
+    $ python3 -m benchmarks.simulation --strategy assignment \\
+        --strategy greedy --strategy assignment:mining,cult,invasion,case
+
+Стратегия задается как <планировщик>[:<категории миссий по приоритету>]
+[@<правила оценки миссий>] (см. параметры Planner и MissionPriority секции
+[Game] и client.scoring), например
+assignment@experience_per_hour=1,duration=-20. Стратегии
+моделируются параллельно в отдельных процессах (--jobs), на одинаковом
+начальном состоянии и с одним начальным значением генератора случайных
+чисел (--seed).
+
+Модель: миссии после завершения снова доступны; миссия, которую сервер
+показывает успешной (isSuccess), успешна с вероятностью --success-chance,
+остальные - с вероятностью --risky-chance; за успешную миссию начисляется
+опыт и столько же валюты награды (см. mockportal.GameState). Адепт занят
+от запуска миссии до завершения прогресса клиентом.
+
+Результаты: опыт в час, средняя занятость адептов (по времени), доход по
+валютам в час за вычетом стоимости миссий, запущенные и успешные миссии
+по категориям, запросы и отказы симуляции. Отказ означает, что клиент
+отправил запрос, который сервер не принял бы (например, команду больше
+slotCount), и результаты такой стратегии недостоверны: они выводятся с
+предупреждением, а симулятор завершается с кодом 1.
+"""
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+from client.assignment import PLANNERS, get_planner
+from client.gameapi import APIManager
+from client.gamedata import Game, Mission
+from client.scheduler import Scheduler
+from client.scoring import ScoringEngine, ScoringRules
+from client.settings import get_mission_priority
+
+from . import payloads
+from .mockportal import REWARD_CURRENCY
+from .planning import StubGameState
+
+DEFAULT_STRATEGIES = ('assignment', 'greedy')
+
+
+def parse_strategy(spec):
+    u"""
+    :param spec: <планировщик>[:<категории через запятую>][@<признак>=<вес>
+        через запятую]
+    :return: tuple (планировщик, порядок категорий или None,
+        ScoringEngine или None)
+    """
+    base, _, rules = spec.partition('@')
+    planner, _, priority = base.partition(':')
+    if planner not in PLANNERS:
+        raise argparse.ArgumentTypeError(
+            u"Неизвестная стратегия: {}".format(planner))
+    try:
+        scoring = None
+        if rules:
+            scoring = ScoringEngine(ScoringRules(
+                rule.split('=', 1) for rule in rules.split(',')))
+        return planner, get_mission_priority(priority), scoring
+    except (RuntimeError, ValueError) as e:
+        raise argparse.ArgumentTypeError(
+            u"Неверная стратегия {}: {}".format(spec, e))
+
+
+class SimulatedState(StubGameState):
+    u"""
+    Состояние симуляции: исход миссии определяется при завершении
+    прогресса, учитываются опыт, расходы и миссии по категориям
+
+    :param rnd: random.Random для исходов миссий
+    """
+    def __init__(self, data, rnd, success_chance, risky_chance):
+        super().__init__(data)
+        self.rnd = rnd
+        self.success_chance = success_chance
+        self.risky_chance = risky_chance
+        self.experience = 0
+        self.spent = collections.Counter()
+        self.started = collections.Counter()
+        self.succeeded = collections.Counter()
+
+    def fuse(self, mission_id, follower_ids, now_ms):
+        cause = super().fuse(mission_id, follower_ids, now_ms)
+        if cause is None:
+            mission = self.missions[mission_id]
+            for currency in mission['price']['currencies']:
+                self.spent[str(currency['id'])] += currency['amount']
+            self.started[self.category(mission)] += 1
+        return cause
+
+    def finish_progress(self, progress_id, now_ms):
+        progress = self.progresses.get(progress_id)
+        mission = progress and self.missions.get(
+            progress['fuseData']['missionId'])
+        if mission is None or progress['endTime'] > now_ms:
+            return super().finish_progress(progress_id, now_ms)
+        # исход случайный, сервер показывает только ожидаемый результат
+        expected = mission['isSuccess']
+        mission['isSuccess'] = self.rnd.random() < (
+            self.success_chance if expected else self.risky_chance)
+        try:
+            cause = super().finish_progress(progress_id, now_ms)
+            if mission['isSuccess']:
+                self.experience += mission['experience']
+                self.succeeded[self.category(mission)] += 1
+        finally:
+            mission['isSuccess'] = expected
+        return cause
+
+    @staticmethod
+    def category(data):
+        mission = Mission.from_data(data)
+        return mission.category()
+
+    def busy_followers(self):
+        return sum(1 for f in self.followers.values() if f['inProgress'])
+
+
+class SimulatedAPIManager(APIManager):
+    u"""
+    API симуляции: операции выполняются над SimulatedState в момент
+    виртуального времени now_ms
+    """
+    def __init__(self, state, now_ms, logger=None):
+        super().__init__(logger)
+        self.state = state
+        self.now_ms = now_ms
+        self.calls = collections.Counter()
+
+    def start(self, session):
+        self.started = True
+        return self.get_game_data()
+
+    def get_game_data(self):
+        self.calls['hero_bag'] += 1
+        return self.state.snapshot(self.now_ms)
+
+    def _operation(self, name, cause):
+        self.calls[name] += 1
+        if cause:
+            self.calls[name + ':' + cause] += 1
+        return (self.STATUS_GAME_ERROR if cause else
+                self.STATUS_SUCCESS), {
+            'operationResult': {
+                'status': 'Fail' if cause else 'Success',
+                'actionFailCause': cause or 'None'},
+            'updateData': self.state.snapshot(self.now_ms),
+        }
+
+    def start_mission(self, mission, followers):
+        return self._operation('start_mission', self.state.fuse(
+            mission.id, [f.id for f in followers], self.now_ms))
+
+    def finish_progress(self, progress):
+        return self._operation('finish_progress', self.state.finish_progress(
+            progress.id, self.now_ms))
+
+
+class SimulatedGame(Game):
+    u"""
+    Game с API симуляции. Завершение прогрессов выполняется
+    последовательно, чтобы порядок ответов не зависел от потоков
+    """
+    def __init__(self, api, planner, mission_priority, scoring):
+        self._api = api
+        super().__init__(planner=planner, mission_priority=mission_priority,
+                         scoring=scoring)
+        self.clock = lambda: api.now_ms / 1000.0
+
+    def create_api(self):
+        return self._api
+
+    def execute_batch(self, actions):
+        self.profile.count('actions', len(actions))
+        if len(actions) == 1:
+            return self.execute_action(actions[0])
+        return self._handle_batch_results(
+            [self.api.finish_progress(a.target) for a in actions])
+
+
+def simulate(spec, options):
+    u"""
+    Моделирует одну стратегию в течение options.days дней
+
+    :return: dict результаты
+    """
+    logging.disable(logging.CRITICAL)
+    planner, priority, scoring = parse_strategy(spec)
+    # Scheduler выбирает задержку через модуль random
+    random.seed(options.seed)
+    data = payloads.hero_bag(followers=options.followers,
+                             missions=options.missions, busy=0.0,
+                             seed=options.seed)
+    data['wallet'] = {REWARD_CURRENCY: options.wallet}
+    state = SimulatedState(data, random.Random(options.seed),
+                           options.success_chance, options.risky_chance)
+    start_ms = int(time.time() * 1000)
+    api = SimulatedAPIManager(state, start_ms)
+    game = SimulatedGame(api, get_planner(planner), priority, scoring)
+    scheduler = Scheduler()
+    end_ms = start_ms + int(options.days * 86400 * 1000)
+    wallet = dict(state.wallet)
+    busy_ms = 0
+    turns = 0
+    started = time.perf_counter()
+    game.start(None)
+    while api.now_ms < end_ms:
+        scheduler.update(game.progress_manager.get_end_times())
+        now = datetime.datetime.fromtimestamp(api.now_ms / 1000.0)
+        delay_ms = min(scheduler.next_delay(now) * 1000,
+                       end_ms - api.now_ms)
+        busy_ms += state.busy_followers() * delay_ms
+        api.now_ms += delay_ms
+        game.turn()
+        turns += 1
+    seconds = time.perf_counter() - started
+    hours = (api.now_ms - start_ms) / 3600000.0
+    return {
+        'strategy': spec,
+        'planner': planner,
+        'mission_priority': list(game.mission_priority),
+        'days': options.days,
+        'turns': turns,
+        'seconds': seconds,
+        'speedup': hours * 3600 / seconds,
+        'experience_per_hour': state.experience / hours,
+        'utilisation': busy_ms / (len(state.followers) *
+                                  (api.now_ms - start_ms)),
+        'income_per_hour': {
+            currency: (state.wallet.get(currency, 0) -
+                       wallet.get(currency, 0)) / hours
+            for currency in set(state.wallet) | set(wallet)},
+        'spent': dict(state.spent),
+        'started': dict(state.started),
+        'succeeded': dict(state.succeeded),
+        'api_calls': dict(api.calls),
+        'rejected': sum(count for name, count in api.calls.items()
+                        if ':' in name),
+    }
+
+
+def print_results(results):
+    print(u"{:<40} {:>6} {:>9} {:>9} {:>10} {:>8} {:>8} {:>7}".format(
+        u"стратегия", u"ходов", u"опыт/ч", u"занятость", u"доход/ч",
+        u"миссий", u"успешно", u"отказов"))
+    for r in results:
+        print(u"{:<40} {:>6} {:>9.1f} {:>9.1%} {:>10.1f} {:>8} {:>8} "
+              u"{:>7}".format(
+                  r['strategy'], r['turns'], r['experience_per_hour'],
+                  r['utilisation'],
+                  r['income_per_hour'].get(REWARD_CURRENCY, 0),
+                  sum(r['started'].values()), sum(r['succeeded'].values()),
+                  r['rejected']))
+    for r in results:
+        print(u"{}: {:.1f} с, в {:.0f} раз быстрее реального "
+              u"времени".format(r['strategy'], r['seconds'], r['speedup']))
+    for r in results:
+        if r['rejected']:
+            print(u"ВНИМАНИЕ: {}: сервер отклонил запросы ({}), результаты "
+                  u"недостоверны".format(r['strategy'], ', '.join(
+                      u"{} {}".format(name, count) for name, count in
+                      sorted(r['api_calls'].items()) if ':' in name)),
+                  file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--strategy', action='append', type=str,
+                        help=u"стратегия, можно указать несколько раз")
+    parser.add_argument('--days', type=float, default=7)
+    parser.add_argument('--followers', type=int, default=300)
+    parser.add_argument('--missions', type=int, default=60)
+    parser.add_argument('--wallet', type=int, default=1000,
+                        help=u"начальное количество валюты")
+    parser.add_argument('--success-chance', type=float, default=0.95,
+                        help=u"вероятность успеха миссии с isSuccess")
+    parser.add_argument('--risky-chance', type=float, default=0.3,
+                        help=u"вероятность успеха остальных миссий")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help=u"количество процессов")
+    parser.add_argument('--output', help=u"файл для результатов в json")
+    options = parser.parse_args()
+
+    strategies = options.strategy or list(DEFAULT_STRATEGIES)
+    for spec in strategies:
+        try:
+            parse_strategy(spec)
+        except argparse.ArgumentTypeError as e:
+            parser.error(str(e))
+    with concurrent.futures.ProcessPoolExecutor(
+            max(1, min(options.jobs or 1, len(strategies)))) as executor:
+        results = list(executor.map(
+            simulate, strategies, [options] * len(strategies)))
+    print_results(results)
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump({'options': vars(options), 'results': results}, f,
+                      indent=2)
+    if any(r['rejected'] for r in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,461 @@
+# -*- coding: UTF-8 -*-
+import heapq
+
+from .settings import ASSIGNMENT_PROFESSION_BONUS, \
+    ASSIGNMENT_CANDIDATE_FACTOR, LOOKAHEAD_HORIZON_MINUTES, \
+    LOOKAHEAD_MAX_RELEASES, LOOKAHEAD_MIN_GAIN, get_config
+
+
+class MinCostFlow:
+    u"""
+    Поток минимальной стоимости: алгоритм последовательных кратчайших путей
+    с потенциалами (Дейкстра). Стоимости ребер должны быть неотрицательными
+    целыми числами.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.graph = [[] for _ in range(size)]
+        # ребра хранятся списками [to, capacity, cost, index of reverse edge]
+        self.edges = []
+
+    def add_edge(self, source, target, capacity, cost):
+        u"""
+        Добавляет ребро и возвращает его номер, по которому после расчета
+        можно узнать величину потока через ребро (см. flow_on)
+        """
+        index = len(self.edges)
+        self.edges.append([target, capacity, cost, index + 1])
+        self.edges.append([source, 0, -cost, index])
+        self.graph[source].append(index)
+        self.graph[target].append(index + 1)
+        return index
+
+    def flow_on(self, index):
+        return self.edges[index + 1][1]
+
+    def run(self, source, sink, max_flow):
+        u"""
+        Пропускает до max_flow единиц потока минимальной стоимости
+
+        :return: tuple (flow, cost)
+        """
+        edges, graph, size = self.edges, self.graph, self.size
+        potential = [0] * size
+        flow = cost = 0
+        infinity = float('inf')
+        while flow < max_flow:
+            distance = [infinity] * size
+            previous = [-1] * size
+            done = [False] * size
+            distance[source] = 0
+            queue = [(0, source)]
+            while queue:
+                d, node = heapq.heappop(queue)
+                if done[node]:
+                    continue
+                done[node] = True
+                node_potential = potential[node]
+                for index in graph[node]:
+                    target, capacity, edge_cost, _ = edges[index]
+                    if capacity <= 0 or done[target]:
+                        continue
+                    nd = d + edge_cost + node_potential - potential[target]
+                    if nd < distance[target]:
+                        distance[target] = nd
+                        previous[target] = index
+                        heapq.heappush(queue, (nd, target))
+            if distance[sink] == infinity:
+                break
+            for node in range(size):
+                if distance[node] < infinity:
+                    potential[node] += distance[node]
+
+            push = max_flow - flow
+            node = sink
+            while node != source:
+                edge = edges[previous[node]]
+                push = min(push, edge[1])
+                node = edges[edge[3]][0]
+            node = sink
+            while node != source:
+                edge = edges[previous[node]]
+                edge[1] -= push
+                edges[edge[3]][1] += push
+                cost += push * edge[2]
+                node = edges[edge[3]][0]
+            flow += push
+        return flow, cost
+
+
+class Planner:
+    u"""
+    Базовый класс стратегии распределения свободных адептов по миссиям.
+    Стратегия только составляет план, запросы к API выполняет Game.
+    """
+    # стратегии нужны адепты, которые скоро освободятся (см.
+    # Game.get_releases)
+    needs_releases = False
+
+    @classmethod
+    def from_config(cls, config):
+        u"""
+        :param config: settings.Config
+        """
+        return cls()
+
+    def plan(self, missions, follower_manager, resources, releases=()):
+        u"""
+        :param missions: доступные миссии в порядке приоритета
+        :param follower_manager: FollowerManager
+        :param resources: Resources
+        :param releases: list of tuples (секунд до освобождения, list of
+            Follower) по возрастанию времени, если needs_releases
+        :return: list of tuples (mission, followers)
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def select_missions(missions, free_count, resources):
+        u"""
+        Отбирает миссии в порядке приоритета, пока хватает свободных адептов
+        и ресурсов. Ресурсы для ивентовых миссий не проверяются.
+
+        :return: list of missions
+        """
+        budget = resources.copy()
+        selected = []
+        for mission in missions:
+            if mission.slot_count > free_count:
+                continue
+            if not mission.is_case():
+                if not budget.is_enough_for_mission(mission):
+                    continue
+                budget.spend(mission)
+            selected.append(mission)
+            free_count -= mission.slot_count
+        return selected
+
+
+class GreedyPlanner(Planner):
+    u"""
+    Жадная стратегия: миссии обрабатываются по очереди, на миссию
+    назначаются свободные адепты подходящих профессий (не больше, чем
+    мест в миссии), недостающие места заполняются самыми эффективными из
+    свободных. На ивентовые миссии назначаются наименее эффективные адепты.
+    """
+    def plan(self, missions, follower_manager, resources, releases=()):
+        budget = resources.copy()
+        free_count = len(follower_manager.free_followers())
+        used = []
+        result = []
+        for mission in missions:
+            if mission.slot_count > free_count:
+                continue
+            if mission.is_case():
+                followers = self._select_case(mission, follower_manager, used)
+            elif not budget.is_enough_for_mission(mission):
+                continue
+            else:
+                followers = self._select(mission, follower_manager, used)
+                budget.spend(mission)
+            used.extend(followers)
+            free_count -= len(followers)
+            result.append((mission, followers))
+        return result
+
+    @staticmethod
+    def _select(mission, follower_manager, used):
+        used_ids = {f.id for f in used}
+        matched_followers = [
+            f for f in follower_manager.get_for_profession(
+                mission.get_profession_ids(), free=True)
+            if f.id not in used_ids][:mission.slot_count]
+        if len(matched_followers) < mission.slot_count:
+            additional_followers = follower_manager.get_efficient(
+                mission.slot_count - len(matched_followers), free=True,
+                exclude=used + matched_followers
+            )
+            matched_followers = matched_followers + additional_followers
+        return matched_followers
+
+    @staticmethod
+    def _select_case(mission, follower_manager, used):
+        used_ids = {f.id for f in used}
+        followers = follower_manager.get_least_efficient(
+            mission.slot_count + len(used_ids))
+        followers = [f for f in followers if f.id not in used_ids]
+        return followers[-mission.slot_count:]
+
+
+class AssignmentPlanner(Planner):
+    u"""
+    Стратегия с глобальным распределением адептов за один проход. Сначала
+    отбираются миссии в порядке приоритета (см. Planner.select_missions),
+    затем адепты распределяются по всем отобранным миссиям сразу через
+    поток минимальной стоимости, максимизируя суммарную ценность:
+
+        ценность = опыт на адепта * (эффективность / максимальная
+                   эффективность + бонус за подходящую профессию)
+
+    Так сильные адепты достаются миссиям с большим опытом, а не первой
+    попавшейся. На ивентовые миссии по-прежнему назначаются наименее
+    эффективные адепты.
+
+    Для каждой миссии рассматриваются только slot_count * candidate_factor
+    лучших кандидатов (общих и с подходящей профессией), поэтому граф
+    остается небольшим и для тысяч адептов. Если после расчета потока
+    миссии не хватило кандидатов, места заполняются жадно.
+    """
+    # множитель для перевода ценности в целочисленную стоимость ребер
+    COST_SCALE = 10 ** 6
+
+    def __init__(self, profession_bonus=ASSIGNMENT_PROFESSION_BONUS,
+                 candidate_factor=ASSIGNMENT_CANDIDATE_FACTOR):
+        self.profession_bonus = profession_bonus
+        self.candidate_factor = candidate_factor
+
+    def mission_weights(self, mission):
+        u"""
+        Возвращает коэффициенты ценности адепта для миссии: при
+        нормированной эффективности и при совпадении профессии
+
+        :return: tuple (efficiency weight, profession weight)
+        """
+        if mission.is_case():
+            return -1.0, 0.0
+        per_slot = mission.experience / max(mission.slot_count, 1)
+        return per_slot, per_slot * self.profession_bonus
+
+    def plan(self, missions, follower_manager, resources, releases=()):
+        free = follower_manager.free_followers()
+        selected = self.select_missions(missions, len(free), resources)
+        if not selected:
+            return []
+        return self.assign(selected, follower_manager)
+
+    def assign(self, missions, follower_manager):
+        u"""
+        Распределяет свободных адептов по миссиям
+
+        :return: list of tuples (mission, followers)
+        """
+        free = follower_manager.free_followers()
+        if not free:
+            return []
+        max_efficiency = max(f.efficiency for f in free.values()) or 1
+        limits = [m.slot_count * self.candidate_factor for m in missions]
+        weights = [self.mission_weights(m) for m in missions]
+        top_limit = max([l for l, w in zip(limits, weights) if w[0] >= 0],
+                        default=0)
+        bottom_limit = max([l for l, w in zip(limits, weights) if w[0] < 0],
+                           default=0)
+        top = follower_manager.get_efficient(top_limit, free=True)
+        bottom = follower_manager.get_least_efficient(bottom_limit)[::-1]
+
+        candidates = []
+        for mission, limit, (efficiency_weight, profession_weight) in zip(
+                missions, limits, weights):
+            generic = top if efficiency_weight >= 0 else bottom
+            mission_candidates = {f.id: f for f in generic[:limit]}
+            if profession_weight:
+                matched = follower_manager.get_for_profession(
+                    mission.get_profession_ids(), free=True)
+                for f in heapq.nlargest(limit, matched,
+                                        key=lambda f: f.efficiency):
+                    mission_candidates[f.id] = f
+            candidates.append(mission_candidates)
+
+        follower_nodes = {}
+        for mission_candidates in candidates:
+            for follower_id in mission_candidates:
+                follower_nodes.setdefault(follower_id, len(follower_nodes))
+        source, sink = 0, 1
+        mission_offset = 2 + len(follower_nodes)
+        network = MinCostFlow(mission_offset + len(missions))
+        for follower_id, node in follower_nodes.items():
+            network.add_edge(source, 2 + node, 1, 0)
+
+        values = []
+        for mission_index, mission in enumerate(missions):
+            efficiency_weight, profession_weight = weights[mission_index]
+            professions = set(mission.get_profession_ids())
+            for follower in candidates[mission_index].values():
+                value = efficiency_weight * follower.efficiency / \
+                    max_efficiency
+                if follower.profession_id in professions:
+                    value += profession_weight
+                values.append((mission_index, follower, value))
+            network.add_edge(mission_offset + mission_index, sink,
+                             mission.slot_count, 0)
+        # стоимость ребер должна быть неотрицательной: ценность вычитается
+        # из общей константы, что не меняет оптимального распределения при
+        # фиксированном количестве назначений
+        offset = max([v for _, _, v in values], default=0)
+        edges = [
+            (mission_index, follower, network.add_edge(
+                2 + follower_nodes[follower.id],
+                mission_offset + mission_index, 1,
+                int(round((offset - value) * self.COST_SCALE))))
+            for mission_index, follower, value in values
+        ]
+        network.run(source, sink, sum(m.slot_count for m in missions))
+
+        assigned = [[] for _ in missions]
+        used_ids = set()
+        for mission_index, follower, edge in edges:
+            if network.flow_on(edge):
+                assigned[mission_index].append(follower)
+                used_ids.add(follower.id)
+        self._fill(missions, assigned, used_ids, follower_manager)
+        return list(zip(missions, assigned))
+
+    @staticmethod
+    def _fill(missions, assigned, used_ids, follower_manager):
+        u"""
+        Жадно заполняет места, оставшиеся свободными после расчета потока
+        """
+        for mission, followers in zip(missions, assigned):
+            missing = mission.slot_count - len(followers)
+            if missing <= 0:
+                continue
+            exclude = [follower_manager.get(i) for i in used_ids]
+            if mission.is_case():
+                extra = [f for f in follower_manager.get_least_efficient(
+                    missing + len(used_ids)) if f.id not in used_ids]
+                extra = extra[-missing:]
+            else:
+                extra = follower_manager.get_efficient(
+                    missing, free=True, exclude=exclude)
+            followers.extend(extra)
+            used_ids.update(f.id for f in extra)
+
+
+class LookaheadPlanner(AssignmentPlanner):
+    u"""
+    Стратегия с учетом адептов, которые освободятся в пределах горизонта
+    планирования. План составляется как в AssignmentPlanner, затем для
+    каждой миссии плана оценивается, не выгоднее ли подождать более
+    сильных адептов, чьи миссии скоро закончатся. Сравнивается ценность
+    (см. AssignmentPlanner) в единицу времени, в течение которого места
+    миссии заняты или удерживаются:
+
+        сейчас:           ценность текущей команды / длительность
+        через t секунд:   ценность лучшей команды из текущей и
+                          освободившихся к этому времени адептов /
+                          (длительность + t)
+
+    Миссия откладывается, если ожидание выгоднее больше чем на min_gain.
+    Ожидаемые адепты закрепляются за отложенной миссией и не учитываются
+    для следующих. Если отложена хотя бы одна миссия, план составляется
+    заново без отложенных миссий, и освободившиеся места и ресурсы
+    достаются другим. Клиент просыпается к окончанию ближайшего прогресса
+    (см. Scheduler), и отложенная миссия запускается с освободившимися
+    адептами на следующем ходу.
+
+    Дополнительная работа по сравнению с AssignmentPlanner - не больше
+    max_releases моментов освобождения на миссию плана и, если есть
+    отложенные миссии, одно повторное распределение.
+    """
+    needs_releases = True
+
+    def __init__(self, horizon=LOOKAHEAD_HORIZON_MINUTES * 60,
+                 max_releases=LOOKAHEAD_MAX_RELEASES,
+                 min_gain=LOOKAHEAD_MIN_GAIN, **kwargs):
+        u"""
+        :param horizon: горизонт планирования, секунд
+        :param max_releases: количество ближайших моментов освобождения
+            адептов, которые рассматриваются
+        :param min_gain: минимальный относительный выигрыш от ожидания
+        """
+        super().__init__(**kwargs)
+        self.horizon = horizon
+        self.max_releases = max_releases
+        self.min_gain = min_gain
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(horizon=config.lookahead_horizon * 60)
+
+    def plan(self, missions, follower_manager, resources, releases=()):
+        result = super().plan(missions, follower_manager, resources)
+        releases = [(delay, followers) for delay, followers in releases
+                    if 0 < delay <= self.horizon][:self.max_releases]
+        if not result or not releases:
+            return result
+        held = self.select_held(result, follower_manager, releases)
+        if not held:
+            return result
+        return super().plan([m for m in missions if m.id not in held],
+                            follower_manager, resources)
+
+    def select_held(self, result, follower_manager, releases):
+        u"""
+        Выбирает миссии плана, которые выгоднее отложить до освобождения
+        адептов
+
+        :param result: план AssignmentPlanner
+        :return: set of mission ids
+        """
+        max_efficiency = max(
+            [f.efficiency for f in follower_manager.free_followers().values()]
+            + [f.efficiency for _, followers in releases
+               for f in followers]) or 1
+        claimed = set()
+        held = set()
+        for mission, team in result:
+            efficiency_weight, profession_weight = \
+                self.mission_weights(mission)
+            if efficiency_weight < 0 or not team:
+                continue
+            professions = set(mission.get_profession_ids())
+            weights = (efficiency_weight / max_efficiency, profession_weight)
+            duration = max(mission.duration, 1)
+            candidates = [self._value(f, weights, professions) for f in team]
+            best_rate = sum(v for v, _ in candidates) / duration
+            waiting = None
+            for delay, followers in releases:
+                candidates.extend(self._value(f, weights, professions)
+                                  for f in followers if f.id not in claimed)
+                best = heapq.nlargest(mission.slot_count, candidates)
+                rate = sum(v for v, _ in best) / (duration + delay)
+                if rate > best_rate * (1 + self.min_gain):
+                    best_rate, waiting = rate, best
+            if waiting is not None:
+                held.add(mission.id)
+                claimed.update(i for _, i in waiting)
+        return held
+
+    @staticmethod
+    def _value(follower, weights, professions):
+        u"""
+        :return: tuple (ценность адепта для миссии, id адепта)
+        """
+        value = weights[0] * follower.efficiency
+        if follower.profession_id in professions:
+            value += weights[1]
+        return value, follower.id
+
+
+PLANNERS = {
+    'greedy': GreedyPlanner,
+    'assignment': AssignmentPlanner,
+    'lookahead': LookaheadPlanner,
+}
+
+
+def get_planner(name=None, config=None):
+    u"""
+    Возвращает стратегию распределения адептов по имени из настроек
+
+    :param config: settings.Config для параметров стратегии, по умолчанию
+        используются значения по умолчанию (или настройки, если не задано
+        имя)
+    """
+    if name is None:
+        config = config or get_config()
+        name = config.planner
+    if name not in PLANNERS:
+        raise RuntimeError(u"Неизвестная стратегия: {}".format(name))
+    if config is None:
+        return PLANNERS[name]()
+    return PLANNERS[name].from_config(config)
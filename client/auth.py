@@ -1,100 +1,317 @@
 # -*- coding: UTF-8 -*-
+import asyncio
+import functools
 import logging
 import time
 import sys
+import urllib.parse
 
-import requests
-from fake_useragent import UserAgent
 from requests.exceptions import RequestException, Timeout, ConnectionError
 
-from .settings import LOGGER_NAME, AUTH_RETRY_DELAY_SECONDS, PAGE, DOMAIN, \
-    USERNAME, PASSWORD, USER_AGENT, CHECK_URL
+from .metrics import RETRIES, record_attempt
+from .ratelimit import PRIORITY_NORMAL
+from .recording import get_recorder, get_recording
+from .retry import API_POLICY, AUTH_POLICY
+from .settings import LOGGER_NAME, PORTAL_PAGE_PATH, MISSIONS_PAGE_PATH, \
+    HERO_BAG_PATH, get_config
+from .transport import TransportStats, create_http_session
+from .useragents import get_user_agent
 
 
-SF_PORTAL_URL = 'https://portal.sf.mail.ru/skyforgenews'
-AUTH_URL = 'https://auth.mail.ru/cgi-bin/auth'
+class AuthError(Exception):
+    pass
 
 
 class Session:
     XHR_HEADERS = {
         'Accept': 'application/json',
         'X-Requested-With': 'XMLHttpRequest',
-        'Host': 'portal.sf.mail.ru',
-        'Referer': 'https://portal.sf.mail.ru/cult/missions',
-        'User-Agent': USER_AGENT or UserAgent().random
     }
 
-    def __init__(self):
+    def __init__(self, account=None, logger=None, rate_limiter=None,
+                 config=None):
+        u"""
+        :param account: settings.Account, по умолчанию - первый аккаунт из
+            настроек
+        :param rate_limiter: ratelimit.RateLimiter для запросов к API
+        :param config: settings.Config, по умолчанию - настройки процесса
+        """
+        config = config or get_config()
+        self.account = account or config.accounts[0]
+        self.portal_url = config.portal_url
+        self.auth_url = config.auth_url
+        self.hero_bag_url = self.portal_url + HERO_BAG_PATH
+        self.rate_limiter = rate_limiter
         self.cookies = {}
-        self.logger = logging.getLogger(LOGGER_NAME)
-        self.session = requests.Session()
+        self.logger = logger or logging.getLogger(LOGGER_NAME)
+        self.transport_stats = TransportStats()
+        self.session = create_http_session(
+            self.transport_stats, config.http_pool_connections,
+            config.http_pool_maxsize)
+        self.timeout = config.http_timeout
+        self.recorder = get_recorder(config, self.logger)
+        recording = get_recording(config, self.logger)
+        if recording is not None:
+            recording.mount(self.session, self.account)
+        self.headers = dict(self.XHR_HEADERS)
+        self.headers['Host'] = urllib.parse.urlsplit(self.portal_url).netloc
+        self.headers['Referer'] = self.portal_url + MISSIONS_PAGE_PATH
+        self.headers['User-Agent'] = (self.account.user_agent or
+                                      get_user_agent(self.account.login))
 
     def start(self):
-        success = False
-        while not success:
+        retry = AUTH_POLICY.begin()
+        while True:
+            delay = retry.wait_time()
+            if delay:
+                time.sleep(delay)
+                continue
             try:
                 self.authenticate()
-                success = True
             except RequestException as e:
+                delay = retry.failure(e)
                 self.logger.error(
-                    u"Ошибка аутентификации: {}, повторный запрос через {} "
-                    u"секунд".format(e, AUTH_RETRY_DELAY_SECONDS))
-                time.sleep(AUTH_RETRY_DELAY_SECONDS)
+                    u"Ошибка аутентификации: {}, повторный запрос через "
+                    u"{:.0f} секунд".format(e, delay))
+                time.sleep(delay)
+            except AuthError:
+                self.logger.critical(u"Ошибка аутентификации на сервере")
+                sys.exit(1)
+            else:
+                retry.success()
+                return
 
     def reset(self):
+        u"""
+        Сбрасывает авторизацию. Пул соединений сохраняется, чтобы повторная
+        аутентификация не открывала новые TLS-соединения
+        """
         self.cookies = {}
-        self.session = requests.Session()
+        self.session.cookies.clear()
 
     def get_cookies(self):
         return self.cookies
 
+    def dump_state(self):
+        u"""
+        Возвращает состояние авторизованной сессии (cookies портала и
+        cookies requests), по которому ее можно восстановить в другом
+        процессе без повторной аутентификации
+
+        :return: dict
+        """
+        return {
+            'cookies': dict(self.cookies),
+            'jar': [{'name': c.name, 'value': c.value, 'domain': c.domain,
+                     'path': c.path, 'secure': c.secure,
+                     'expires': c.expires}
+                    for c in self.session.cookies],
+        }
+
+    def load_state(self, state):
+        self.cookies = dict(state['cookies'])
+        for cookie in state['jar']:
+            self.session.cookies.set(
+                cookie['name'], cookie['value'], domain=cookie['domain'],
+                path=cookie['path'], secure=cookie['secure'],
+                expires=cookie['expires'])
+
     @property
     def csrf_token(self):
         return self.cookies['csrf_token']
 
     def authenticate(self):
         self.logger.info(u"Авторизируемся на сервере mail.ru")
-        response = self.session.get(SF_PORTAL_URL)
+        response = self.session.get(self.portal_url + PORTAL_PAGE_PATH,
+                                    timeout=self.timeout)
         for cookie in response.cookies:
             self.cookies[cookie.name] = cookie.value
         self.logger.debug("Установленные cookies: {}".format(self.cookies))
         self.logger.info(u"Отправляем данные для аутентификации")
         auth_data = {
-            'Page': PAGE,
-            'Login': USERNAME,
-            'Domain': DOMAIN,
-            'Password': PASSWORD,
+            'Page': self.account.page,
+            'Login': self.account.login,
+            'Domain': self.account.domain,
+            'Password': self.account.password,
             'saveauth': 0
         }
-        r = self.session.post(AUTH_URL, data=auth_data)
+        r = self.session.post(self.auth_url, data=auth_data,
+                              timeout=self.timeout)
         if 'fail=1' in r.url:
-            logging.critical(u"Ошибка аутентификации на сервере")
-            sys.exit(1)
+            raise AuthError(r.url)
+
+    def get(self, url, policy=API_POLICY, priority=PRIORITY_NORMAL,
+            endpoint='other', **kwargs):
+        u"""
+        GET-запрос к API с повторами по политике policy (см. retry.py) и
+        ограничением частоты запросов
+
+        :param priority: приоритет запроса для ограничителя (см. ratelimit.py)
+        :param endpoint: имя операции для метрик (см. metrics.py)
+        :raise RetryError: запрос не выполнен за время, отведенное политикой
+        """
+        steps = self._iter_get(url, policy, priority, endpoint, kwargs)
+        result = None
+        while True:
+            try:
+                step = steps.send(result)
+            except StopIteration as e:
+                return e.value
+            if callable(step):
+                result = step()
+            else:
+                time.sleep(step)
+                result = None
+
+    def _iter_get(self, url, policy, priority, endpoint, kwargs):
+        u"""
+        Шаги GET-запроса с повторами, общие для Session и AsyncSession.
+        Генератор выдает паузы в секундах и блокирующие функции без
+        аргументов, результат функции передается через send. Возвращает
+        ответ сервера (StopIteration.value)
+        """
+        retry = policy.begin()
+        while True:
+            delay = retry.wait_time()
+            if delay:
+                self._log_wait(delay)
+                yield delay
+                continue
+            delay = yield functools.partial(self.rate_limit_delay, priority)
+            if delay:
+                yield delay
+            started = time.monotonic()
+            response, error = yield functools.partial(
+                self._attempt, url, kwargs)
+            self._record(endpoint, url, kwargs.get('params'),
+                         time.monotonic() - started, response, error)
+            delay = retry.check(response, error)
+            if delay is None:
+                return response
+            RETRIES.inc(endpoint=endpoint)
+            self._log_retry(delay, response)
+            yield delay
+
+    def _attempt(self, url, kwargs):
+        u"""
+        :return: tuple (response или None, ошибка сети или None)
+        """
+        try:
+            return self.request(url, **kwargs), None
+        except (Timeout, ConnectionError) as e:
+            return None, e
+
+    def _record(self, endpoint, url, params, elapsed, response, error):
+        u"""
+        Учитывает попытку запроса в метриках и, если включено, в журнале
+        запросов
+        """
+        record_attempt(endpoint, elapsed, response)
+        if self.recorder is not None:
+            self.recorder.record(
+                self.account, endpoint, url, params, elapsed, response,
+                error, secrets=[self.cookies.get('csrf_token')])
 
-    def get(self, url, **kwargs):
-        params = kwargs.get('params', {})
-        params.update({'csrf_token': self.csrf_token})
+    def rate_limit_delay(self, priority):
+        u"""
+        :return: сколько секунд подождать перед запросом из-за ограничения
+            частоты запросов
+        """
+        if self.rate_limiter is None:
+            return 0
+        delay = self.rate_limiter.reserve(priority)
+        if delay > 1:
+            self.logger.debug(u"Ограничение частоты запросов, ожидание "
+                              u"{:.1f} секунд".format(delay))
+        return delay
+
+    def _log_wait(self, delay):
+        self.logger.warning(u"Сервер недоступен, запросы приостановлены на "
+                            u"{:.0f} секунд".format(delay))
+
+    def _log_retry(self, delay, response):
+        if response is not None:
+            self.logger.error(u"Сервер вернул ответ со статусом {}, "
+                              u"повторный запрос через {:.1f} секунд".format(
+                                  response.status_code, delay))
+        else:
+            self.logger.info(u"Повторный запрос через {:.1f} секунд".format(
+                delay))
+
+    def request(self, url, **kwargs):
+        u"""
+        Выполняет одну попытку GET-запроса к API с токеном текущей сессии.
+        Ошибки сети логируются и пробрасываются дальше, повторные запросы
+        выполняет вызывающий код
+        """
+        params = dict(kwargs.get('params') or {})
+        params['csrf_token'] = self.csrf_token
         kwargs['params'] = params
-        success = False
-        while not success:
+        try:
+            return self.session.get(
+                url, headers=self.headers, timeout=self.timeout, **kwargs)
+        except Timeout as e:
+            self.logger.error(
+                u"Ошибка обращение к серверу, время ожидания истекло: "
+                u"{}".format(e))
+            raise
+        except ConnectionError as e:
+            self.logger.error(u"Сервер недоступен: {}".format(e))
+            raise
+
+
+class AsyncSession(Session):
+    u"""
+    Асинхронная сессия для работы нескольких аккаунтов в одном event loop.
+    Блокирующие запросы requests выполняются в пуле потоков executor, у
+    каждой сессии свои cookies и csrf_token, ожидание между повторными
+    запросами не блокирует остальные аккаунты.
+    """
+    def __init__(self, account, executor, logger=None, rate_limiter=None,
+                 config=None):
+        super().__init__(account, logger, rate_limiter, config)
+        self.executor = executor
+
+    def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs))
+
+    async def start(self):
+        retry = AUTH_POLICY.begin()
+        while True:
+            delay = retry.wait_time()
+            if delay:
+                await asyncio.sleep(delay)
+                continue
             try:
-                result = self.session.get(
-                    url, headers=self.XHR_HEADERS, timeout=10, **kwargs)
-                success = True
-                return result
-            except Timeout as e:
+                await self._run(self.authenticate)
+            except RequestException as e:
+                delay = retry.failure(e)
                 self.logger.error(
-                    u"Ошибка обращение к серверу, время ожидания истекло: "
-                    u"{}".format(e))
-                time.sleep(30)
-            except ConnectionError as e:
-                self.logger.error(u"Сервер недоступен: {}".format(e))
-                time.sleep(30)
-
-    @staticmethod
-    def healthchecks_request():
-        if CHECK_URL:
+                    u"Ошибка аутентификации: {}, повторный запрос через "
+                    u"{:.0f} секунд".format(e, delay))
+                await asyncio.sleep(delay)
+            else:
+                retry.success()
+                return
+
+    async def get(self, url, policy=API_POLICY, priority=PRIORITY_NORMAL,
+                  endpoint='other', **kwargs):
+        u"""
+        См. Session.get. Запросы и резервирование в ограничителе (общий
+        бакет блокирует файл через flock) выполняются в пуле потоков, а не
+        в event loop
+        """
+        steps = self._iter_get(url, policy, priority, endpoint, kwargs)
+        result = None
+        while True:
             try:
-                requests.get(CHECK_URL)
-            except RequestException:
-                pass
+                step = steps.send(result)
+            except StopIteration as e:
+                return e.value
+            if callable(step):
+                result = await self._run(step)
+            else:
+                await asyncio.sleep(step)
+                result = None
@@ -1,14 +1,19 @@
 # -*- coding: UTF-8 -*-
+import asyncio
 import logging
 import time
 import sys
 
-from .settings import LOGGER_NAME, HERO_BAG_URL
+from .jsoncodec import decode_response, is_json_content_type
+from .metrics import MISSIONS_STARTED, PROGRESSES_FINISHED
+from .ratelimit import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from .retry import HERO_BAG_POLICY, AUTH_POLICY, RetryError
+from .settings import LOGGER_NAME
 
 
 class ApiURLS:
-    def __init__(self):
-        self.logger = logging.getLogger(LOGGER_NAME)
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger(LOGGER_NAME)
         self.FINISH_PROGRESS_URL = ''
         self.START_MISSION_URL = ''
         self._empty = True
@@ -30,16 +35,38 @@ class ApiURLS:
             self.START_MISSION_URL = data['fuseOperationLink']
             self._empty = False
 
+    def dump(self):
+        u"""
+        :return: dict ссылок на операции в формате ответа сервера или None,
+            если ссылки еще не получены
+        """
+        if self._empty:
+            return None
+        return {'finishProgressOperationLink': self.FINISH_PROGRESS_URL,
+                'fuseOperationLink': self.START_MISSION_URL}
+
+    def load(self, links):
+        u"""
+        Восстанавливает сохраненные ссылки (см. dump)
+        """
+        if links and self._data_valid(links):
+            self.set(links)
+
 
 class APIManager:
+    # имена операций в метриках
+    ENDPOINT_HERO_BAG = 'heroBag'
+    ENDPOINT_START_MISSION = 'fuse'
+    ENDPOINT_FINISH_PROGRESS = 'finishProgress'
+
     STATUS_SUCCESS = 0
     STATUS_ERROR = 1
     STATUS_ACTION_NOT_AVAILABLE = 2
     STATUS_GAME_ERROR = 3
 
-    def __init__(self):
-        self.logger = logging.getLogger(LOGGER_NAME)
-        self.urls = ApiURLS()
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger(LOGGER_NAME)
+        self.urls = ApiURLS(self.logger)
         self.session = None
         self.started = False
 
@@ -60,8 +87,10 @@ class APIManager:
             'questId': mission.id,
         }
         self.logger.debug(u"Отправляем данные {}".format(params))
-        result = self.session.get(self.urls.START_MISSION_URL, params=params)
-        return self._process_api_response(result)
+        return self._execute(
+            dict(url=self.urls.START_MISSION_URL, priority=PRIORITY_NORMAL,
+                 endpoint=self.ENDPOINT_START_MISSION, params=params),
+            MISSIONS_STARTED, category=mission.category())
 
     def finish_progress(self, progress):
         u"""
@@ -70,14 +99,38 @@ class APIManager:
         :param progress: Progress obj
         """
         data = {'progressId': progress.id}
-        result = self.session.get(self.urls.FINISH_PROGRESS_URL, params=data)
-        return self._process_api_response(result)
+        return self._execute(
+            dict(url=self.urls.FINISH_PROGRESS_URL, priority=PRIORITY_HIGH,
+                 endpoint=self.ENDPOINT_FINISH_PROGRESS, params=data),
+            PROGRESSES_FINISHED)
+
+    def _execute(self, request, counter, **labels):
+        u"""
+        Выполняет операцию над игровыми объектами
+
+        :param request: dict аргументов session.get
+        :param counter: метрика успешных операций, labels - ее метки
+        :return: tuple (status, spec или описание ошибки)
+        """
+        try:
+            result = self.session.get(**request)
+        except RetryError as e:
+            return self.STATUS_ERROR, str(e)
+        return self._operation_result(result, counter, labels)
+
+    def _operation_result(self, result, counter, labels):
+        status, spec = self._process_api_response(result)
+        if status == self.STATUS_SUCCESS:
+            counter.inc(**labels)
+        return status, spec
 
     def _process_api_response(self, response_data):
         try:
-            json_data = response_data.json()
+            json_data = decode_response(response_data)
         except ValueError:
             return self.STATUS_ERROR, u"Сервер не вернул корректного JSON"
+        if not isinstance(json_data, dict):
+            return self.STATUS_ERROR, u"Сервер не вернул корректного JSON"
         if json_data.get('spec'):
             if json_data['spec']['operationResult']['status'] == 'Success':
                 return self.STATUS_SUCCESS, json_data['spec']
@@ -87,31 +140,92 @@ class APIManager:
                                   u"'spec': {}".format(json_data.keys())
 
     def _get_hero_bag(self):
-        self.logger.info(u"Пробуем получить данные HeroBag")
-        response_success = False
-        while not response_success:
-            r = self.session.get(HERO_BAG_URL)
-            if r.status_code == 200:
-                response_success = True
-            else:
-                self.logger.error(
-                    u"Сервер вернул ответ со статусом {}, "
-                    u"повторный запрос через 5 минут".format(r.status_code))
-                time.sleep(300)
+        u"""
+        Загружает данные HeroBag. Ошибки сети и ответы с ошибкой
+        повторяются по политике HERO_BAG_POLICY; при ошибке авторизации
+        сессия создается заново, повторные ошибки авторизации подряд
+        выполняются с задержкой по политике AUTH_POLICY
+        """
+        relogin = None
+        while True:
+            self.logger.info(u"Пробуем получить данные HeroBag")
+            data = self._hero_bag_data(
+                self.session.get(**self._hero_bag_request()))
+            if data is not None:
+                return data
+            relogin, delay = self._relogin_delay(relogin)
+            if delay:
+                time.sleep(delay)
+            self.session.reset()
+            self.session.start()
 
-        self.session.healthchecks_request()
+    def _hero_bag_request(self):
+        return dict(url=self.session.hero_bag_url, policy=HERO_BAG_POLICY,
+                    priority=PRIORITY_LOW, endpoint=self.ENDPOINT_HERO_BAG)
 
+    def _hero_bag_data(self, r):
+        u"""
+        :return: данные HeroBag или None, если нужно заново создать сессию
+        """
         response = ApiResponse(r)
         if response.is_valid():
             return response.data
-
         self.logger.error(response.description)
         if response.status == ApiResponse.STATUS_AUTH_ERROR:
-            self.session.reset()
-            self.session.start()
-            return self._get_hero_bag()
+            return None
         return response.data
 
+    @staticmethod
+    def _relogin_delay(relogin):
+        u"""
+        Первая повторная аутентификация выполняется сразу, следующие подряд
+        - с задержкой по политике AUTH_POLICY
+
+        :return: tuple (состояние повторов, задержка в секундах)
+        """
+        if relogin is None:
+            return AUTH_POLICY.begin(), 0
+        return relogin, relogin.failure()
+
+
+class AsyncAPIManager(APIManager):
+    u"""
+    Асинхронная версия APIManager, работает с AsyncSession. Запросы
+    формируются и ответы обрабатываются общим кодом APIManager;
+    start_mission и finish_progress возвращают корутину _execute
+    """
+    async def start(self, session):
+        self.session = session
+        self.started = True
+        return await self.get_game_data()
+
+    async def get_game_data(self):
+        assert self.started is True
+        data = await self._get_hero_bag()
+        self.urls.set(data)
+        return data
+
+    async def _execute(self, request, counter, **labels):
+        try:
+            result = await self.session.get(**request)
+        except RetryError as e:
+            return self.STATUS_ERROR, str(e)
+        return self._operation_result(result, counter, labels)
+
+    async def _get_hero_bag(self):
+        relogin = None
+        while True:
+            self.logger.info(u"Пробуем получить данные HeroBag")
+            data = self._hero_bag_data(
+                await self.session.get(**self._hero_bag_request()))
+            if data is not None:
+                return data
+            relogin, delay = self._relogin_delay(relogin)
+            if delay:
+                await asyncio.sleep(delay)
+            self.session.reset()
+            await self.session.start()
+
 
 class ApiResponse:
     STATUS_SUCCESS = 1
@@ -135,14 +249,14 @@ class ApiResponse:
         self.check_response()
 
     def check_response(self):
-        if self.response.headers.get('content-type') == 'application/json;charset=UTF-8':
+        if is_json_content_type(self.response.headers.get('content-type')):
             try:
-                data = self.response.json()
+                data = decode_response(self.response)
                 self.data = data['spec']
                 self.status = self.STATUS_SUCCESS
             except ValueError:
                 self.status = self.STATUS_JSON_ERROR
-            except KeyError:
+            except (KeyError, TypeError):
                 self.status = self.STATUS_DATA_ERROR
         else:
             self.status = self.STATUS_AUTH_ERROR
@@ -1,17 +1,87 @@
 # -*- coding: UTF-8 -*-
+import asyncio
+import collections
+import concurrent.futures
 import datetime
+import heapq
 import logging
-
-from .settings import LOGGER_NAME
-from .gameapi import APIManager
+import sys
+import time
+import types
+
+from .settings import LOGGER_NAME, MAX_PROCESS_PASSES, MAX_ACTIONS_PER_TURN, \
+    FINISH_PROGRESS_CONCURRENCY, MISSION_PRIORITY, STATE_SYNC_INTERVAL_SECONDS
+from .gameapi import APIManager, AsyncAPIManager
+from .assignment import GreedyPlanner
+from .profiling import NULL_PROFILE
+
+
+def _select(items, ids=None):
+    u"""
+    Возвращает объекты из словаря items, при указании ids - только объекты с
+    этими id
+    """
+    if ids is None:
+        return items.values()
+    return [items[i] for i in ids if i in items]
+
+
+def merge_updates(updates):
+    u"""
+    Объединяет данные updateData из ответов на одновременные запросы
+    завершения прогрессов. Каждый ответ содержит полное состояние на момент
+    его обработки сервером, порядок обработки неизвестен. Завершение
+    прогресса только удаляет прогресс, освобождает адептов и пополняет
+    кошелек, поэтому объект, которого нет хотя бы в одном ответе, считается
+    удаленным, для остальных берется версия из ответа с наименьшим
+    количеством прогрессов (обработанного сервером последним, порядок
+    получения ответов с ним не связан), а суммы в кошельке - максимальные.
+
+    :param updates: list of dicts в порядке получения ответов
+    :return: dict
+    """
+    if len(updates) == 1:
+        return updates[0]
+    # при равном количестве прогрессов - последний полученный
+    latest = min(reversed(updates),
+                 key=lambda update: len(update.get('progresses', [])))
+    merged = dict(latest)
+    for key, value in merged.items():
+        if not isinstance(value, list) or not all(
+                isinstance(item, dict) and 'id' in item for item in value):
+            continue
+        present = [{item['id'] for item in update.get(key, [])}
+                   for update in updates]
+        common = set.intersection(*present)
+        merged[key] = [item for item in value if item['id'] in common]
+    wallet = {}
+    for update in updates:
+        for currency_id, amount in update.get('wallet', {}).items():
+            wallet[currency_id] = max(amount, wallet.get(currency_id, amount))
+    if wallet:
+        merged['wallet'] = wallet
+    return merged
 
 
 class Resources:
     def __init__(self):
         self.wallet = {}
+        self.increased = False
 
     def add(self, data):
-        self.wallet = data.get('wallet', {})
+        wallet = data.get('wallet', {})
+        if any(amount > self.wallet.get(currency_id, 0)
+               for currency_id, amount in wallet.items()):
+            self.increased = True
+        self.wallet = wallet
+
+    def pop_increased(self):
+        u"""
+        Возвращает и сбрасывает признак пополнения кошелька с момента
+        предыдущего вызова
+        """
+        increased, self.increased = self.increased, False
+        return increased
 
     def is_enough_for_mission(self, mission):
         for currency_data in mission.price['currencies']:
@@ -20,19 +90,92 @@ class Resources:
                 return False
         return True
 
+    def spend(self, mission):
+        u"""
+        Списывает из кошелька стоимость миссии
+        """
+        for currency_data in mission.price['currencies']:
+            currency_id = str(currency_data['id'])
+            self.wallet[currency_id] = \
+                self.wallet.get(currency_id, 0) - currency_data['amount']
+
+    def copy(self):
+        resources = Resources()
+        resources.wallet = dict(self.wallet)
+        return resources
+
+
+class Entity:
+    u"""
+    Базовый класс игровых объектов с __slots__. FIELDS задает соответствие
+    полей json атрибутам объекта, остальные поля ответа сервера не
+    сохраняются. Вложенные структуры (цена, профессии миссии) хранятся как
+    есть и разбираются только при обращении, время прогресса хранится в
+    миллисекундах и переводится в datetime только при обращении.
+    """
+    __slots__ = ()
+    FIELDS = ()
 
-class Progress:
+    def __init__(self, **kwargs):
+        self._load(kwargs)
+
+    @classmethod
+    def from_data(cls, data):
+        u"""
+        Создает объект по словарю с данными сервера
+        """
+        entity = cls.__new__(cls)
+        entity._load(data)
+        return entity
+
+    def _load(self, data):
+        for key, attr in self.FIELDS:
+            setattr(self, attr, data[key])
+
+    def matches(self, data):
+        u"""
+        Проверяет, совпадает ли объект с данными сервера. Используется при
+        инкрементальном обновлении вместо хранения исходных словарей
+        """
+        for key, attr in self.FIELDS:
+            if getattr(self, attr) != data[key]:
+                return False
+        return True
+
+
+class Progress(Entity):
     TYPE_MISSION = "FUSE"
     TYPE_UPGRADE = "UPGRADE"
 
-    def __init__(self, **kwargs):
-        self.id = kwargs['id']
-        self.finished = kwargs['finished']
-        self.start_time = self.time_from_ms(kwargs['startTime'])
-        self.end_time = self.time_from_ms(kwargs['endTime'])
-        self.type = kwargs['type']
-        if self.is_mission():
-            self.mission_id = kwargs['fuseData']['missionId']
+    FIELDS = (('id', 'id'), ('finished', 'finished'), ('type', 'type'),
+              ('startTime', 'start_ms'), ('endTime', 'end_ms'))
+    __slots__ = tuple(attr for _, attr in FIELDS) + ('mission_id',)
+
+    def _load(self, data):
+        self.id = data['id']
+        self.finished = data['finished']
+        self.type = sys.intern(data['type'])
+        self.start_ms = data['startTime']
+        self.end_ms = data['endTime']
+        # из fuseData нужен только id миссии, сам словарь не сохраняется
+        fuse_data = data.get('fuseData') or {}
+        self.mission_id = fuse_data.get('missionId')
+
+    def matches(self, data):
+        fuse_data = data.get('fuseData') or {}
+        return (self.finished == data['finished'] and
+                self.end_ms == data['endTime'] and
+                self.start_ms == data['startTime'] and
+                self.type == data['type'] and
+                self.mission_id == fuse_data.get('missionId'))
+
+    @property
+    def start_time(self):
+        return self.time_from_ms(self.start_ms)
+
+    @property
+    def end_time(self):
+        return self.time_from_ms(self.end_ms)
 
     @staticmethod
     def time_from_ms(ms):
@@ -56,20 +199,50 @@ class Progress:
         return self.type == self.TYPE_MISSION
 
 
-class Mission:
-    def __init__(self, **kwargs):
-        self.id = kwargs['id']
-        self.name = kwargs['name']
-        self.in_progress = kwargs['inProgress']
-        self.is_success = kwargs['isSuccess']
-        self.difficulty = kwargs['difficulty']
-        self.duration = kwargs['duration']
-        self.experience = kwargs['experience']
-        self.price = kwargs['price']
-        self._professions = kwargs['professions']
-        self.slot_count = kwargs['slotCount']
-        self.quality_name = kwargs['missionQualityName']
-        self.mission_type = kwargs['missionType']
+class Mission(Entity):
+    FIELDS = (('id', 'id'), ('name', 'name'), ('inProgress', 'in_progress'),
+              ('isSuccess', 'is_success'), ('difficulty', 'difficulty'),
+              ('duration', 'duration'), ('experience', 'experience'),
+              ('price', 'price'), ('professions', '_professions'),
+              ('slotCount', 'slot_count'),
+              ('missionQualityName', 'quality_name'),
+              ('missionType', 'mission_type'))
+    __slots__ = tuple(attr for _, attr in FIELDS) + ('_category',)
+
+    # у большинства миссий цена пустая, такие миссии используют общий
+    # неизменяемый объект
+    EMPTY_PRICE = types.MappingProxyType({'currencies': (), 'resources': ()})
+
+    def _load(self, data):
+        self.id = data['id']
+        # строки повторяются у множества миссий и хранятся в одном экземпляре
+        self.name = sys.intern(data['name'])
+        self.in_progress = data['inProgress']
+        self.is_success = data['isSuccess']
+        self.difficulty = data['difficulty']
+        self.duration = data['duration']
+        self.experience = data['experience']
+        price = data['price']
+        self.price = (price if price['currencies'] or price['resources']
+                      else self.EMPTY_PRICE)
+        self._professions = data['professions']
+        self.slot_count = data['slotCount']
+        self.quality_name = sys.intern(data['missionQualityName'])
+        self.mission_type = sys.intern(data['missionType'])
+        # тип определяется сравнением строк, поэтому вычисляется один раз
+        self._category = self._get_category()
+
+    def matches(self, data):
+        price = data['price']
+        if self.price is self.EMPTY_PRICE:
+            if price['currencies'] or price['resources']:
+                return False
+        elif self.price != price:
+            return False
+        for key, attr in self.FIELDS:
+            if key != 'price' and getattr(self, attr) != data[key]:
+                return False
+        return True
 
     def is_free(self):
         return not (self.price['currencies'] or self.price['resources'])
@@ -95,124 +268,284 @@ class Mission:
     def is_case(self):
         return self.mission_type == "Case"
 
+    def category(self):
+        u"""
+        :return: тип миссии для метрик и оценки миссий: case, mining,
+            battle, cult, invasion или other
+        """
+        return self._category
+
+    def _get_category(self):
+        if self.is_case():
+            return 'case'
+        if self.is_mining():
+            return 'mining'
+        if self.is_battle():
+            return 'battle'
+        if self.is_cult():
+            return 'cult'
+        if self.is_invasion():
+            return 'invasion'
+        return 'other'
+
     def result(self):
         if self.is_success:
             return u"успех"
         return u"неудача"
 
 
-class Follower:
-    def __init__(self, **kwargs):
-        self.id = kwargs['id']
-        self.efficiency = kwargs['efficiency']
-        self.in_progress = kwargs['inProgress']
-        self.profession = kwargs['profession']
+class Follower(Entity):
+    FIELDS = (('id', 'id'), ('efficiency', 'efficiency'),
+              ('inProgress', 'in_progress'))
+    __slots__ = tuple(attr for _, attr in FIELDS) + ('profession_id',)
+
+    def _load(self, data):
+        self.id = data['id']
+        self.efficiency = data['efficiency']
+        self.in_progress = data['inProgress']
+        self.profession_id = data['profession']['id']
+
+    def matches(self, data):
+        return (self.in_progress == data['inProgress'] and
+                self.efficiency == data['efficiency'] and
+                self.profession_id == data['profession']['id'])
+
+    @property
+    def profession(self):
+        return {'id': self.profession_id}
 
     def is_available(self):
         return not self.in_progress
 
-    @property
-    def profession_id(self):
-        return self.profession['id']
 
+class EntityManager:
+    u"""
+    Базовый класс хранилищ игровых объектов. Поддерживает инкрементальное
+    обновление: объекты пересоздаются только при изменении их данных (см.
+    Entity.matches), а id добавленных и измененных объектов накапливаются в
+    dirty до вызова pop_changes
+    """
+    entity_class = None
 
-class ProgressManager:
-    def __init__(self):
-        self.progresses = {}
-        self.logger = logging.getLogger(LOGGER_NAME)
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger(LOGGER_NAME)
+        self.dirty = set()
 
-    def add_progress(self, data):
-        p = Progress(**data)
-        self.progresses[p.id] = p
-        self.logger.debug(u"Добавляем прогресс id {}".format(p.id))
-        return p
+    def _get_items(self):
+        raise NotImplementedError
 
-    def remove_progress(self, progress):
-        del self.progresses[progress.id]
+    def _set(self, entity):
+        self._get_items()[entity.id] = entity
 
-    def add_many(self, data, clear=True):
-        self.logger.info(u"Добавляем информацию по прогрессам")
-        if clear:
-            self.clear()
-        for progress_data in data:
-            self.add_progress(progress_data)
+    def _delete(self, id_):
+        del self._get_items()[id_]
 
-    def clear(self):
+    def update_many(self, data):
+        u"""
+        Применяет полный список объектов одного типа: новые и изменившиеся
+        объекты создаются заново, не изменившиеся остаются как есть, объекты,
+        которых нет в списке, удаляются
+
+        :param data: list of dicts
+        """
+        items = self._get_items()
+        from_data = self.entity_class.from_data
+        seen = set()
+        for item_data in data:
+            id_ = item_data['id']
+            seen.add(id_)
+            entity = items.get(id_)
+            if entity is not None and entity.matches(item_data):
+                continue
+            self._set(from_data(item_data))
+            self.dirty.add(id_)
+        if len(seen) < len(items):
+            for id_ in [i for i in items if i not in seen]:
+                self._delete(id_)
+                self.dirty.discard(id_)
+
+    def get(self, id_):
+        return self._get_items().get(id_)
+
+    def iter_actual(self, entities):
+        u"""
+        Перебирает объекты, подставляя их актуальные версии: за время
+        перебора объекты могут быть обновлены или удалены после ответа сервера
+        """
+        items = self._get_items()
+        for entity in entities:
+            actual = items.get(entity.id)
+            if actual is not None:
+                yield actual
+
+    def pop_changes(self):
+        u"""
+        Возвращает и сбрасывает накопленные изменения
+
+        :return: set of changed ids
+        """
+        changes, self.dirty = self.dirty, set()
+        return changes
+
+
+class ProgressManager(EntityManager):
+    entity_class = Progress
+
+    def __init__(self, logger=None):
         self.progresses = {}
+        super().__init__(logger)
+
+    def _get_items(self):
+        return self.progresses
 
-    def get_mission_progress_list(self):
-        return [p for p in self.progresses.values() if p.is_mission()]
+    def get_mission_progress_list(self, ids=None):
+        u"""
+        Возвращает прогрессы по миссиям
 
+        :param ids: ограничить поиск указанными id прогрессов
+        :return: list
+        """
+        return [p for p in _select(self.progresses, ids) if p.is_mission()]
 
-class MissionManager:
-    def __init__(self):
-        self.missions = {}
-        self.logger = logging.getLogger(LOGGER_NAME)
+    def get_end_times(self):
+        u"""
+        Возвращает время окончания всех незавершенных прогрессов
+
+        :return: list of datetime
+        """
+        return [p.end_time for p in self.progresses.values()
+                if not p.is_finished()]
 
-    def add_mission(self, data):
-        mission = Mission(**data)
-        self.missions[mission.id] = mission
-        self.logger.debug(u"Добавляем миссию id {}".format(mission.id))
 
-    def add_many(self, data, clear=True):
-        if clear:
-            self.clear()
-        self.logger.info(u"Добавляем миссии: {}".format(len(data)))
-        for mission_data in data:
-            self.add_mission(mission_data)
+class MissionManager(EntityManager):
+    entity_class = Mission
 
-    def clear(self):
+    def __init__(self, logger=None):
         self.missions = {}
+        super().__init__(logger)
 
-    def mining_missions(self):
+    def _get_items(self):
+        return self.missions
+
+    def mining_missions(self, ids=None):
         u"""
         Возвращает список с миссиями, доступными для выполнения и не требующими
         ресурсов. Список отсортирован по возрастанию длинтельности миссии и
         количества адептов, необходимых для её выполнения
 
+        :param ids: ограничить поиск указанными id миссий
         :return: List of missions
         """
-        missions = [m for m in self.missions.values() if m.is_mining() and
+        missions = [m for m in _select(self.missions, ids) if m.is_mining() and
                     m.is_available()]
         return sorted(missions, key=lambda m: (m.duration, m.slot_count))
 
-    def invasion_missions(self):
-        missions = [m for m in self.missions.values() if m.is_invasion() and
-                    m.is_available()]
+    def invasion_missions(self, ids=None):
+        missions = [m for m in _select(self.missions, ids)
+                    if m.is_invasion() and m.is_available()]
         return sorted(missions, key=lambda m: (m.duration, m.slot_count))
 
-    def case_missions(self):
-        return [m for m in self.missions.values() if m.is_case() and
+    def case_missions(self, ids=None):
+        return [m for m in _select(self.missions, ids) if m.is_case() and
                 m.is_available()]
 
-    def cult_missions(self):
-        return [m for m in self.missions.values() if m.is_cult() and
+    def cult_missions(self, ids=None):
+        return [m for m in _select(self.missions, ids) if m.is_cult() and
                 m.is_available()]
 
-    def get(self, id_):
-        return self.missions.get(id_)
 
+class FollowerManager(EntityManager):
+    u"""
+    Хранилище адептов с индексами: словарь свободных адептов, свободные
+    адепты по профессиям и кучи свободных адептов, упорядоченные по
+    эффективности. Из куч записи удаляются лениво: запись считается
+    устаревшей, если адепт занят, удален или его эффективность изменилась.
+    """
+    entity_class = Follower
 
-class FollowerManager:
-    def __init__(self):
+    def __init__(self, logger=None):
         self.followers = {}
-        self.logger = logging.getLogger(LOGGER_NAME)
+        super().__init__(logger)
+        self._free = {}
+        self._by_profession = {}
+        self._free_by_profession = {}
+        self._free_heap = []
+        self._order = {}
+        self._next_order = 0
+
+    def _get_items(self):
+        return self.followers
+
+    def _set(self, entity):
+        old = self.followers.get(entity.id)
+        if old is not None:
+            self._unindex(old)
+        super()._set(entity)
+        self._index(entity)
+
+    def _delete(self, id_):
+        self._unindex(self.followers[id_])
+        self._order.pop(id_, None)
+        super()._delete(id_)
+
+    def _index(self, follower):
+        if follower.id not in self._order:
+            self._order[follower.id] = self._next_order
+            self._next_order += 1
+        self._by_profession.setdefault(
+            follower.profession_id, {})[follower.id] = follower
+        if follower.is_available():
+            self._add_free(follower)
+
+    def _unindex(self, follower):
+        self._by_profession.get(follower.profession_id, {}).pop(
+            follower.id, None)
+        self._remove_free(follower)
+
+    def _add_free(self, follower):
+        self._free[follower.id] = follower
+        self._free_by_profession.setdefault(
+            follower.profession_id, {})[follower.id] = follower
+        heapq.heappush(self._free_heap, self._heap_entry(follower))
+        if len(self._free_heap) > 2 * len(self._free) + 64:
+            self._free_heap = [self._heap_entry(f)
+                               for f in self._free.values()]
+            heapq.heapify(self._free_heap)
+
+    def _remove_free(self, follower):
+        self._free.pop(follower.id, None)
+        self._free_by_profession.get(follower.profession_id, {}).pop(
+            follower.id, None)
+
+    def _heap_entry(self, follower):
+        return -follower.efficiency, self._order[follower.id], follower.id
+
+    def reserve(self, followers):
+        u"""
+        Помечает адептов занятыми, например, сразу после запуска миссии, не
+        дожидаясь данных от сервера
 
-    def add_follower(self, data):
-        follower = Follower(**data)
-        self.followers[follower.id] = follower
+        :param followers: list of Follower
+        """
+        for follower in followers:
+            follower.in_progress = True
+            self._remove_free(follower)
 
-    def add_many(self, data, clear=True):
-        if data and clear:
-            self.clear()
-        for follower in data:
-            self.add_follower(follower)
+    def free_followers(self):
+        u"""
+        Возвращает свободных адептов. Словарь поддерживается хранилищем и не
+        должен изменяться вызывающим кодом
 
-    def clear(self):
-        self.followers = {}
+        :return: dict {id: Follower}
+        """
+        return self._free
 
-    def free_followers(self):
-        return {k: f for k, f in self.followers.items() if f.is_available()}
+    def free_profession_counts(self):
+        u"""
+        :return: dict {profession id: количество свободных адептов}
+        """
+        return {profession_id: len(followers) for profession_id, followers
+                in self._free_by_profession.items() if followers}
 
     def get_for_profession(self, profession, free=False):
         u"""
@@ -221,15 +554,18 @@ class FollowerManager:
         :param profession: int, profession id
         :return: list
         """
-        if free:
-            followers = self.free_followers().values()
-        else:
-            followers = self.followers.values()
         if isinstance(profession, (list, tuple)):
-            return [f for f in followers if f.profession_id in profession]
-        if isinstance(profession, int):
-            return [f for f in followers if f.profession_id == profession]
-        raise ValueError(u"Profession must be an int or list or tuple")
+            professions = set(profession)
+        elif isinstance(profession, int):
+            professions = [profession]
+        else:
+            raise ValueError(u"Profession must be an int or list or tuple")
+        index = self._free_by_profession if free else self._by_profession
+        followers = [f for p in professions
+                     for f in index.get(p, {}).values()]
+        if len(professions) > 1:
+            followers.sort(key=lambda f: self._order[f.id])
+        return followers
 
     def get_efficient(self, count=None, free=False, exclude=None):
         u"""
@@ -241,143 +577,535 @@ class FollowerManager:
         :param exclude: followers list to exclude from result
         :return: list
         """
-        if free:
-            followers = self.free_followers().values()
-        else:
-            followers = self.followers.values()
+        exclude_ids = {f.id for f in exclude or []}
+        if free and count is not None:
+            return self._pop_efficient(count, exclude_ids)
 
-        if exclude:
-            followers = [f for f in followers if f not in exclude]
-        fs = sorted(followers, key=lambda k: k.efficiency, reverse=True)
+        followers = self._free.values() if free else self.followers.values()
+        fs = sorted((f for f in followers if f.id not in exclude_ids),
+                    key=lambda k: k.efficiency, reverse=True)
         return fs[0:count]
 
+    def get_least_efficient(self, count):
+        u"""
+        Возвращает count наименее эффективных свободных адептов, в порядке
+        убывания эффективности
+        """
+        followers = heapq.nsmallest(
+            count, self._free.values(),
+            key=lambda f: (f.efficiency, -self._order[f.id]))
+        return followers[::-1]
+
+    def _pop_efficient(self, count, exclude_ids):
+        u"""
+        Выбирает из кучи count самых эффективных свободных адептов, не
+        входящих в exclude_ids. Просмотренные актуальные записи возвращаются
+        в кучу, устаревшие удаляются.
+        """
+        heap = self._free_heap
+        result, kept, seen = [], [], set()
+        while heap and len(result) < count:
+            entry = heapq.heappop(heap)
+            neg_efficiency, _, id_ = entry
+            follower = self._free.get(id_)
+            if (follower is None or id_ in seen or
+                    follower.efficiency != -neg_efficiency):
+                continue
+            seen.add(id_)
+            kept.append(entry)
+            if id_ not in exclude_ids:
+                result.append(follower)
+        for entry in kept:
+            heapq.heappush(heap, entry)
+        return result
+
+
+class StateProjector:
+    u"""
+    Прогноз состояния между загрузками HeroBag. Успешный ответ на действие
+    содержит полное состояние (updateData), поэтому после него локальное
+    состояние совпадает с серверным и дальше меняется предсказуемо:
+    прогрессы завершаются по времени окончания. Ход после такого ответа
+    начинается без запроса HeroBag, если к нему закончились прогрессы: они
+    помечаются завершенными локально, а ответы на их завершение снова
+    приносят полное состояние. Ход по интервалу опроса (см. Scheduler), к
+    которому ничего не закончилось, загружает состояние. Если прогноз не
+    совпал с сервером, запрос отклоняется, и следующий ход загружает
+    состояние.
+
+    Состояние загружается, если полных данных от сервера не было дольше
+    sync_interval секунд (новые миссии, действия через web-интерфейс), на
+    последний запрос действия не получен ответ с полным состоянием,
+    последние данные собраны из нескольких ответов (см. merge_updates) или
+    локальное состояние противоречиво: занятые миссии или адепты без
+    прогрессов, которые их освободят (см. is_consistent).
+
+    :param sync_interval: секунд, 0 - загружать состояние каждый ход
+    """
+    def __init__(self, sync_interval=STATE_SYNC_INTERVAL_SECONDS,
+                 logger=None):
+        self.sync_interval = sync_interval
+        self.logger = logger or logging.getLogger(LOGGER_NAME)
+        self.synced_at = None
+
+    def synced(self, now):
+        u"""
+        Получено полное состояние от сервера
+
+        :param now: unix time
+        """
+        self.synced_at = now
+
+    def invalidate(self):
+        u"""
+        Локальное состояние не подтверждено сервером, например, отправлен
+        запрос действия
+        """
+        self.synced_at = None
+
+    def needs_sync(self, now):
+        return (not self.sync_interval or self.synced_at is None or
+                now - self.synced_at >= self.sync_interval)
+
+    @staticmethod
+    def is_consistent(progress_manager, mission_manager, follower_manager):
+        u"""
+        Проверяет, что каждую занятую миссию освободит ее прогресс, а
+        занятых адептов не больше, чем мест в выполняемых миссиях и
+        прогрессов других типов
+
+        :return: bool
+        """
+        progresses = progress_manager.progresses.values()
+        mission_ids = {p.mission_id for p in progresses if p.is_mission()}
+        slots = len(progresses) - len(mission_ids)
+        for mission in mission_manager.missions.values():
+            if mission.id in mission_ids:
+                slots += mission.slot_count
+            elif mission.in_progress:
+                return False
+        busy = (len(follower_manager.followers) -
+                len(follower_manager.free_followers()))
+        return busy <= slots
+
+    def project(self, progress_manager, now):
+        u"""
+        Помечает завершенными прогрессы, время окончания которых наступило
+
+        :return: list of Progress
+        """
+        now_ms = now * 1000
+        finished = [p for p in progress_manager.progresses.values()
+                    if not p.finished and p.end_ms <= now_ms]
+        for progress in finished:
+            progress.finished = True
+        return finished
+
+
+class Action:
+    u"""
+    Действие, запланированное на текущий ход: завершение прогресса или
+    запуск миссии с указанными адептами
+    """
+    FINISH_PROGRESS = 'finish_progress'
+    START_MISSION = 'start_mission'
+
+    def __init__(self, type_, target, followers=None):
+        self.type = type_
+        self.target = target
+        self.followers = followers or []
+
 
 class Game:
-    def __init__(self):
-        self.logger = logging.getLogger(LOGGER_NAME)
-        self.progress_manager = ProgressManager()
-        self.mission_manager = MissionManager()
-        self.follower_manager = FollowerManager()
+    def __init__(self, logger=None, planner=None, mission_priority=None,
+                 scoring=None, sync_interval=STATE_SYNC_INTERVAL_SECONDS):
+        u"""
+        :param planner: стратегия распределения адептов (см. assignment.py),
+            по умолчанию GreedyPlanner; клиент передает стратегию из
+            настроек
+        :param mission_priority: порядок категорий миссий, по умолчанию
+            MISSION_PRIORITY
+        :param scoring: scoring.ScoringEngine, если задан, миссии
+            обрабатываются по убыванию оценки
+        :param sync_interval: секунд, как часто загружать состояние, если
+            его можно спрогнозировать (см. StateProjector)
+        """
+        self.logger = logger or logging.getLogger(LOGGER_NAME)
+        self.planner = planner or GreedyPlanner()
+        self.mission_priority = tuple(mission_priority or MISSION_PRIORITY)
+        self.scoring = scoring
+        self.progress_manager = ProgressManager(self.logger)
+        self.mission_manager = MissionManager(self.logger)
+        self.follower_manager = FollowerManager(self.logger)
         self.resources = Resources()
-        self.api = APIManager()
-        self.data_has_changed = False
+        # адепты, отправленные клиентом на миссии: {mission id: list of
+        # follower ids}, сервер этого не сообщает (см. get_releases)
+        self.mission_followers = {}
+        # часы для расчета времени до окончания прогрессов, unix time
+        self.clock = time.time
+        self.projector = StateProjector(sync_interval, self.logger)
+        self.api = self.create_api()
+        # профиль текущего хода, задается клиентом (см. profiling.py)
+        self.profile = NULL_PROFILE
+
+    def create_api(self):
+        return APIManager(self.logger)
 
     def start(self, session):
-        start_data = self.api.start(session)
+        with self.profile.phase('hero_bag'):
+            start_data = self.api.start(session)
         self.update_state(start_data)
         self.process_state()
 
     def turn(self):
-        data = self.api.get_game_data()
-        self.update_state(data)
+        if not self.project_state():
+            with self.profile.phase('hero_bag'):
+                data = self.api.get_game_data()
+            self.update_state(data)
         self.process_state()
 
+    def project_state(self):
+        u"""
+        Прогнозирует состояние к началу хода вместо загрузки HeroBag, если
+        это возможно (см. StateProjector)
+
+        :return: True, если состояние спрогнозировано
+        """
+        now = self.clock()
+        if self.projector.needs_sync(now):
+            return False
+        if not self.projector.is_consistent(
+                self.progress_manager, self.mission_manager,
+                self.follower_manager):
+            self.logger.warning(u"Локальное состояние противоречиво: занятые "
+                                u"миссии или адепты без прогрессов, "
+                                u"загружаем состояние")
+            self.projector.invalidate()
+            return False
+        finished = self.projector.project(self.progress_manager, now)
+        if not finished:
+            # ход по интервалу опроса, а не по окончанию прогресса: нужны
+            # новые миссии и изменения на сервере
+            return False
+        self.profile.count('projected')
+        self.logger.info(u"Состояние не загружается, завершенных по времени "
+                         u"прогрессов: {}".format(len(finished)))
+        return True
+
     def update_state(self, data):
-        self.resources.add(data)
-        self.progress_manager.add_many(data.get('progresses', []))
-        self.mission_manager.add_many(data.get('missions', []))
-        self.follower_manager.add_many(data.get('followers', []))
+        u"""
+        Применяет данные сервера к локальному состоянию. Объекты обновляются
+        инкрементально, изменения накапливаются в менеджерах до следующего
+        прохода обработки (см. get_changes)
+        """
+        with self.profile.phase('update_state'):
+            self.resources.add(data)
+            self.progress_manager.update_many(data.get('progresses', []))
+            self.mission_manager.update_many(data.get('missions', []))
+            followers = data.get('followers', [])
+            if followers:
+                self.follower_manager.update_many(followers)
+            if 'followers' in data:
+                self.projector.synced(self.clock())
+
+    def get_changes(self, full=True):
+        u"""
+        Возвращает id прогрессов и миссий, которые нужно рассмотреть на
+        очередном проходе обработки, и сбрасывает накопленные изменения.
+        None означает, что нужно рассмотреть все объекты: это первый проход
+        хода, освободились адепты или пополнился кошелек.
+
+        :param full: первый проход, рассматриваются все объекты
+        :return: tuple (progress ids or None, mission ids or None)
+        """
+        progress_ids = self.progress_manager.pop_changes()
+        mission_ids = self.mission_manager.pop_changes()
+        follower_ids = self.follower_manager.pop_changes()
+        resources_increased = self.resources.pop_increased()
+        if full:
+            return None, None
+        followers = self.follower_manager.followers
+        followers_freed = any(followers[i].is_available()
+                              for i in follower_ids)
+        if followers_freed or resources_increased:
+            mission_ids = None
+        return progress_ids, mission_ids
+
+    def get_pass_data(self, full=True):
+        u"""
+        Собирает прогрессы и доступные миссии для очередного прохода
+        обработки. Миссии упорядочены по приоритету категорий
+        (mission_priority), по умолчанию: ивентовые, добыча ресурсов,
+        вторжения, развитие культа, или по оценке scoring
+
+        :return: tuple (progresses, missions)
+        """
+        progress_ids, mission_ids = self.get_changes(full)
+        missions = []
+        for category in self.mission_priority:
+            getter = getattr(self.mission_manager, category + '_missions')
+            with self.profile.phase('missions.' + category):
+                missions += getter(mission_ids)
+        if self.scoring is not None:
+            with self.profile.phase('missions.score'):
+                missions = self.scoring.sort(missions, self.follower_manager)
+        with self.profile.phase('progresses'):
+            progresses = self.progress_manager.get_mission_progress_list(
+                progress_ids)
+        return progresses, missions
 
     def process_state(self):
-        self.process_progresses(
-            self.progress_manager.get_mission_progress_list())
-        case_missions = self.mission_manager.case_missions()
-        if case_missions:
-            self.process_case_missions(case_missions)
-        mining_missions = self.mission_manager.mining_missions()
-        if mining_missions:
-            self.process_missions(mining_missions)
-        invasion_missions = self.mission_manager.invasion_missions()
-        if invasion_missions:
-            self.process_missions(invasion_missions)
-        cult_missions = self.mission_manager.cult_missions()
-        if cult_missions:
-            self.process_missions(cult_missions)
-        if self.data_has_changed:
+        u"""
+        Выполняет действия, которые выдает планировщик iter_actions
+        """
+        actions = self.iter_actions()
+        try:
+            batch = next(actions)
+            while True:
+                # до ответа с полным состоянием прогноз невозможен
+                self.projector.invalidate()
+                batch = actions.send(self.execute_batch(batch))
+        except StopIteration:
+            pass
+
+    def iter_actions(self):
+        u"""
+        Планировщик хода. Генератор выдает списки действий и получает через
+        send результат их выполнения (True, если состояние изменилось).
+
+        На каждом проходе сначала одним пакетом завершаются все готовые
+        прогрессы: запросы независимы и выполняются одновременно (см.
+        execute_batch). Затем по актуальному состоянию один раз составляется
+        план запуска миссий, миссии запускаются по одной. Результаты
+        успешных действий сразу применяются к локальному состоянию, поэтому
+        следующие действия в очереди только проверяются на актуальность.
+        Повторный проход рассматривает лишь изменившиеся объекты (см.
+        get_changes). Количество проходов и действий за ход ограничено
+        MAX_PROCESS_PASSES и MAX_ACTIONS_PER_TURN.
+        """
+        actions_left = MAX_ACTIONS_PER_TURN
+        full = True
+        for _ in range(MAX_PROCESS_PASSES):
+            self.profile.count('passes')
+            progresses, missions = self.get_pass_data(full)
+            changed = False
+            with self.profile.phase('plan_progresses'):
+                batch = [a for a in map(self.check_action,
+                                        self.plan_progresses(progresses))
+                         if a is not None]
+            truncated = len(batch) > actions_left
+            if truncated:
+                batch = batch[:actions_left]
+            if batch:
+                actions_left -= len(batch)
+                changed = (yield batch) or changed
+            if truncated:
+                self.logger.warning(
+                    u"Достигнут лимит действий за ход: {}".format(
+                        MAX_ACTIONS_PER_TURN))
+                return
+            with self.profile.phase('plan_missions'):
+                queue = collections.deque(self.plan_missions(missions))
+            while queue:
+                action = self.check_action(queue.popleft())
+                if action is None:
+                    continue
+                if actions_left <= 0:
+                    self.logger.warning(
+                        u"Достигнут лимит действий за ход: {}".format(
+                            MAX_ACTIONS_PER_TURN))
+                    return
+                actions_left -= 1
+                changed = (yield [action]) or changed
+            if not changed:
+                return
             self.logger.info(u"Данные изменились, обрабатываем повторно")
-            self.data_has_changed = False
-            self.process_state()
+            full = False
+        self.logger.warning(u"Достигнут лимит проходов обработки: {}".format(
+            MAX_PROCESS_PASSES))
 
-    def process_progresses(self, progresses):
+    def plan_progresses(self, progresses):
         u"""
-        Проверяет состояние текущих прогресов, если есть завершенные -
-        отправляет запрос к API.
+        Проверяет состояние текущих прогресов и возвращает действия для
+        завершения готовых
 
         :param progresses: Список прогрессов
+        :return: list of Action
         """
+        actions = []
         for p in progresses:
-            if self.data_has_changed:
-                break
             mission = self.mission_manager.get(p.mission_id)
             self.logger.info(u"Проверяем состояние прогресса {} по "
                              u"миссии \"{}\"".format(p.id, mission.name))
             if p.is_finished():
-                self.logger.info(
-                    u"Прогресс {} завершен, отправляем запрос".format(p.id))
-                status, result = self.api.finish_progress(p)
-                self._handle_call_result(status, result)
+                actions.append(Action(Action.FINISH_PROGRESS, p))
             else:
                 self.logger.info(
                     u"До окончания прогресса {} еще {}, результат - {}".format(
                         p.id, p.time_elapsed_verbose(), mission.result()))
+        return actions
 
-    def process_missions(self, missions):
-        self.logger.info(u"Доступно миссий {}: {}".format(
-            missions[0].quality_name, len(missions)))
-        for mission in missions:
-            if self.data_has_changed:
-                break
-            status, result = self.process_mission(mission)
-            self._handle_call_result(status, result)
+    def plan_missions(self, missions):
+        u"""
+        Составляет план запуска миссий выбранной стратегией
 
-    def process_mission(self, mission):
-        self.logger.info(u"Пробуем запустить миссию {}".format(mission.id))
-        followers = self.follower_manager.free_followers()
-        if mission.slot_count > len(followers):
-            return self.api.STATUS_ACTION_NOT_AVAILABLE, \
-                   u"Недостаточно последователей"
-
-        if not self.resources.is_enough_for_mission(mission):
-            return self.api.STATUS_ACTION_NOT_AVAILABLE, \
-                   u"Недостаточно ресурсов"
-
-        matched_followers = self.follower_manager.get_for_profession(
-            mission.get_profession_ids(), free=True)
-        if len(matched_followers) < mission.slot_count:
-            additional_followers = self.follower_manager.get_efficient(
-                mission.slot_count - len(matched_followers), free=True,
-                exclude=matched_followers
-            )
-
-            matched_followers = matched_followers + additional_followers
-        return self.api.start_mission(mission, matched_followers)
-
-    def process_case_missions(self, missions):
-        self.logger.info(u"Доступно ивентовых миссий: {}".format(len(missions)))
-        for mission in missions:
-            if self.data_has_changed:
-                break
-            status, result = self.process_case_mission(mission)
-            self._handle_call_result(status, result)
-
-    def process_case_mission(self, mission):
+        :return: list of Action
+        """
+        missions = [m for m in self.mission_manager.iter_actual(missions)
+                    if m.is_available()]
+        if not missions:
+            return []
+        self.logger.info(u"Доступно миссий: {}".format(len(missions)))
+        releases = (self.get_releases() if self.planner.needs_releases
+                    else ())
+        return [Action(Action.START_MISSION, mission, followers)
+                for mission, followers in self.planner.plan(
+                    missions, self.follower_manager, self.resources,
+                    releases)]
+
+    def get_releases(self):
+        u"""
+        Возвращает адептов, которые освободятся по окончании текущих
+        миссий. Адепты известны только для миссий, запущенных этим
+        клиентом после старта
+
+        :return: list of tuples (секунд до окончания прогресса, list of
+            Follower) по возрастанию времени
+        """
+        now_ms = self.clock() * 1000
+        actual = {}
+        releases = []
+        for progress in self.progress_manager.get_mission_progress_list():
+            follower_ids = self.mission_followers.get(progress.mission_id)
+            if follower_ids is None:
+                continue
+            actual[progress.mission_id] = follower_ids
+            if progress.is_finished():
+                continue
+            followers = [f for f in map(self.follower_manager.get,
+                                        follower_ids)
+                         if f is not None and not f.is_available()]
+            if followers:
+                releases.append(((progress.end_ms - now_ms) / 1000.0,
+                                 followers))
+        # миссии без прогресса завершены
+        self.mission_followers = actual
+        releases.sort(key=lambda item: item[0])
+        return releases
+
+    def check_action(self, action):
+        u"""
+        Проверяет, что запланированное действие еще возможно: после ответов
+        сервера на предыдущие запросы прогресс, миссия или адепты могли
+        измениться
+
+        :return: Action с актуальными объектами или None
+        """
+        if action.type == Action.FINISH_PROGRESS:
+            progress = self.progress_manager.get(action.target.id)
+            if progress is None or not progress.is_finished():
+                return None
+            return Action(action.type, progress)
+
+        mission = self.mission_manager.get(action.target.id)
+        if mission is None or not mission.is_available():
+            return None
+        followers = list(self.follower_manager.iter_actual(action.followers))
+        if (len(followers) != len(action.followers) or
+                not all(f.is_available() for f in followers)):
+            self.logger.info(u"Адепты для миссии {} уже заняты".format(
+                mission.id))
+            return None
+        return Action(action.type, mission, followers)
+
+    def execute_batch(self, actions):
+        u"""
+        Выполняет пакет действий. Несколько действий (завершение прогрессов)
+        выполняются одновременно, не более FINISH_PROGRESS_CONCURRENCY
+        запросов сразу, а их результаты применяются одним обновлением
+        состояния (см. merge_updates)
+
+        :return: True, если состояние изменилось
+        """
+        self.profile.count('actions', len(actions))
+        if len(actions) == 1:
+            return self.execute_action(actions[0])
+        self.logger.info(u"Завершаем прогрессы: {}".format(
+            ', '.join(str(a.target.id) for a in actions)))
+        workers = min(len(actions), FINISH_PROGRESS_CONCURRENCY)
+        with self.profile.phase('api.finish_batch'):
+            with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+                futures = [executor.submit(self.api.finish_progress, a.target)
+                           for a in actions]
+                results = [f.result() for f in
+                           concurrent.futures.as_completed(futures)]
+        return self._handle_batch_results(results)
+
+    def execute_action(self, action):
+        u"""
+        Выполняет действие через API и применяет результат
+
+        :return: True, если запрос выполнен успешно
+        """
+        if action.type == Action.FINISH_PROGRESS:
+            self.logger.info(u"Прогресс {} завершен, отправляем запрос".format(
+                action.target.id))
+            with self.profile.phase('api.finish_progress'):
+                status, result = self.api.finish_progress(action.target)
+        else:
+            with self.profile.phase('api.start_mission'):
+                status, result = self.start_mission(
+                    action.target, action.followers)
+        return self._handle_call_result(status, result)
+
+    def start_mission(self, mission, followers):
         self.logger.info(u"Пробуем запустить миссию {}".format(mission.id))
-        followers = self.follower_manager.free_followers()
-        if mission.slot_count > len(followers):
-            return self.api.STATUS_ACTION_NOT_AVAILABLE, \
-                   u"Недостаточно последователей"
+        status, result = self.api.start_mission(mission, followers)
+        if status == self.api.STATUS_SUCCESS:
+            self.project_start(mission, followers)
+        return status, result
 
-        followers = self.follower_manager.get_efficient(free=True)
+    def project_start(self, mission, followers):
+        u"""
+        Применяет ожидаемый результат запуска миссии до обработки
+        updateData: адепты заняты, стоимость списана, миссия выполняется
+        """
+        self.follower_manager.reserve(followers)
+        self.mission_followers[mission.id] = [f.id for f in followers]
+        self.resources.spend(mission)
+        mission.in_progress = True
 
-        return self.api.start_mission(mission, followers[-mission.slot_count:])
+    def _handle_batch_results(self, results):
+        u"""
+        :param results: list of tuples (status, result) в порядке получения
+            ответов
+        """
+        updates = [result['updateData'] for status, result in results
+                   if self._log_call_result(status, result)]
+        if not updates:
+            return False
+        self.update_state(merge_updates(updates))
+        if len(updates) > 1:
+            # состояние собрано из нескольких ответов и не считается
+            # полученным от сервера
+            self.projector.invalidate()
+        return True
 
     def _handle_call_result(self, status, result):
+        if not self._log_call_result(status, result):
+            return False
+        self.update_state(result['updateData'])
+        return True
+
+    def _log_call_result(self, status, result):
+        u"""
+        :return: True, если запрос выполнен успешно
+        """
         if status == self.api.STATUS_SUCCESS:
             self.logger.info(u"Успешный запрос, сервер вернул \"{}\"".format(
                 result['operationResult']['actionFailCause']
             ))
-            self.update_state(result['updateData'])
-            self.data_has_changed = True
+            return True
         elif status == self.api.STATUS_ACTION_NOT_AVAILABLE:
             self.logger.info(result)
         elif status == self.api.STATUS_GAME_ERROR:
@@ -386,3 +1114,73 @@ class Game:
             ))
         else:
             self.logger.critical(result)
+        return False
+
+
+class AsyncGame(Game):
+    u"""
+    Асинхронная версия Game: логика выбора миссий и адептов общая, запросы
+    к API выполняются через AsyncAPIManager
+    """
+    def create_api(self):
+        return AsyncAPIManager(self.logger)
+
+    async def start(self, session):
+        with self.profile.phase('hero_bag'):
+            start_data = await self.api.start(session)
+        self.update_state(start_data)
+        await self.process_state()
+
+    async def turn(self):
+        if not self.project_state():
+            with self.profile.phase('hero_bag'):
+                data = await self.api.get_game_data()
+            self.update_state(data)
+        await self.process_state()
+
+    async def process_state(self):
+        actions = self.iter_actions()
+        try:
+            batch = next(actions)
+            while True:
+                self.projector.invalidate()
+                batch = actions.send(await self.execute_batch(batch))
+        except StopIteration:
+            pass
+
+    async def execute_batch(self, actions):
+        self.profile.count('actions', len(actions))
+        if len(actions) == 1:
+            return await self.execute_action(actions[0])
+        self.logger.info(u"Завершаем прогрессы: {}".format(
+            ', '.join(str(a.target.id) for a in actions)))
+        semaphore = asyncio.Semaphore(FINISH_PROGRESS_CONCURRENCY)
+
+        async def finish(action):
+            async with semaphore:
+                return await self.api.finish_progress(action.target)
+
+        with self.profile.phase('api.finish_batch'):
+            results = [await f for f in asyncio.as_completed(
+                [finish(a) for a in actions])]
+        return self._handle_batch_results(results)
+
+    async def execute_action(self, action):
+        if action.type == Action.FINISH_PROGRESS:
+            self.logger.info(u"Прогресс {} завершен, отправляем запрос".format(
+                action.target.id))
+            with self.profile.phase('api.finish_progress'):
+                status, result = await self.api.finish_progress(
+                    action.target)
+        else:
+            with self.profile.phase('api.start_mission'):
+                status, result = await self.start_mission(
+                    action.target, action.followers)
+        return self._handle_call_result(status, result)
+
+    async def start_mission(self, mission, followers):
+        self.logger.info(u"Пробуем запустить миссию {}".format(mission.id))
+        status, result = await self.api.start_mission(mission, followers)
+        if status == self.api.STATUS_SUCCESS:
+            self.project_start(mission, followers)
+        return status, result
@@ -0,0 +1,206 @@
+# -*- coding: UTF-8 -*-
+u"""
+Фоновая отправка сигналов о работе клиента: начало хода, успешное
+завершение или ошибка и длительность хода. События помещаются в
+ограниченную очередь и отправляются отдельным потоком, поэтому медленный или
+недоступный сервис мониторинга не задерживает обработку хода; если очередь
+заполнена, новые события отбрасываются.
+
+Получатели:
+    Check_URL (healthchecks.io) - ping об успешном ходе, /start и /fail;
+                                  у каждого аккаунта может быть свой url,
+                                  остальные аккаунты используют общий
+    Heartbeat=file:///path      - события в файл, json по строке на событие
+    Heartbeat=unix:///path      - события в unix datagram socket
+"""
+import json
+import logging
+import queue
+import socket
+import threading
+import time
+
+import requests
+from requests.exceptions import RequestException
+
+from .metrics import TURN_DURATION, TURNS
+from .settings import LOGGER_NAME, HEARTBEAT_QUEUE_SIZE, \
+    HEALTHCHECK_TIMEOUT_SECONDS
+
+
+class HealthchecksSink:
+    u"""
+    Отправляет события в check healthchecks.io. Если check общий для
+    нескольких аккаунтов, успешный ход одного из них не скрывает ошибку
+    другого: пока последний ход какого-либо аккаунта завершился ошибкой,
+    вместо успешного ping отправляется /fail
+    """
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+        self.failed = set()
+
+    def send(self, event):
+        url = self.url
+        if event['event'] == Heartbeat.START:
+            url += '/start'
+        elif event['event'] == Heartbeat.FAIL:
+            self.failed.add(event['account'])
+            url += '/fail'
+        else:
+            self.failed.discard(event['account'])
+            if self.failed:
+                event = dict(event, failed=sorted(self.failed))
+                url += '/fail'
+        self.session.post(url, data=json.dumps(event).encode('utf-8'),
+                          timeout=HEALTHCHECK_TIMEOUT_SECONDS)
+
+
+class FileSink:
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, event):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(event) + '\n')
+
+
+class UnixSocketSink:
+    def __init__(self, path):
+        self.path = path
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    def send(self, event):
+        self.socket.sendto(json.dumps(event).encode('utf-8'), self.path)
+
+
+def create_sink(spec):
+    u"""
+    :param spec: file:///path, unix:///path или url healthchecks
+    """
+    if spec.startswith('file://'):
+        return FileSink(spec[len('file://'):])
+    if spec.startswith('unix://'):
+        return UnixSocketSink(spec[len('unix://'):])
+    return HealthchecksSink(spec)
+
+
+class Heartbeat:
+    START = 'start'
+    SUCCESS = 'success'
+    FAIL = 'fail'
+
+    def __init__(self, sinks, checks=None, queue_size=HEARTBEAT_QUEUE_SIZE,
+                 logger=None):
+        u"""
+        :param sinks: получатели всех событий
+        :param checks: dict имя аккаунта -> HealthchecksSink, ключ None -
+            check для остальных аккаунтов
+        """
+        self.sinks = list(sinks)
+        self.checks = dict(checks or {})
+        self.logger = logger or logging.getLogger(LOGGER_NAME)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, logger=None):
+        u"""
+        :param config: settings.Config
+        """
+        urls = {account.name: account.check_url
+                for account in config.accounts if account.check_url}
+        if config.check_url:
+            urls[None] = config.check_url
+        sinks = {url: HealthchecksSink(url) for url in set(urls.values())}
+        checks = {name: sinks[url] for name, url in urls.items()}
+        return cls([create_sink(config.heartbeat)] if config.heartbeat
+                   else [], checks, logger=logger)
+
+    def send(self, event, account=None, **data):
+        u"""
+        Ставит событие в очередь отправки, никогда не блокирует
+
+        :param event: START, SUCCESS или FAIL
+        :param account: имя аккаунта
+        :param data: дополнительные поля (duration, error)
+        """
+        if not self.sinks and not self.checks:
+            return
+        self._ensure_thread()
+        data.update(event=event, account=account, time=time.time())
+        try:
+            self.queue.put_nowait(data)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='sf-heartbeat', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            event = self.queue.get()
+            if event is None:
+                return
+            check = self.checks.get(event['account'], self.checks.get(None))
+            for sink in self.sinks + ([check] if check else []):
+                try:
+                    sink.send(event)
+                except (RequestException, OSError) as e:
+                    self.logger.warning(
+                        u"Не удалось отправить heartbeat: {}".format(e))
+
+    def close(self, timeout=None):
+        u"""
+        Отправляет оставшиеся события и останавливает поток
+        """
+        if self._thread is None:
+            return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+
+class TurnReporter:
+    u"""
+    Отправляет в Heartbeat события хода одного аккаунта и его длительность,
+    длительность и результат хода учитываются в метриках
+    """
+    def __init__(self, heartbeat, account):
+        self.heartbeat = heartbeat
+        self.account = account
+        self.started = None
+
+    def start(self):
+        self.started = time.monotonic()
+        self.heartbeat.send(Heartbeat.START, self.account)
+
+    def success(self):
+        duration = self._duration()
+        self._record(Heartbeat.SUCCESS, duration)
+        self.heartbeat.send(Heartbeat.SUCCESS, self.account,
+                            duration=duration)
+
+    def fail(self, error):
+        duration = self._duration()
+        self._record(Heartbeat.FAIL, duration)
+        self.heartbeat.send(Heartbeat.FAIL, self.account,
+                            duration=duration, error=repr(error))
+
+    def _record(self, result, duration):
+        TURNS.inc(account=self.account, result=result)
+        if duration is not None:
+            TURN_DURATION.observe(duration, account=self.account)
+
+    def _duration(self):
+        if self.started is None:
+            return None
+        return round(time.monotonic() - self.started, 3)
@@ -0,0 +1,66 @@
+# -*- coding: UTF-8 -*-
+u"""
+Разбор json-ответов сервера. Используется самая быстрая из установленных
+библиотек: orjson, ujson или стандартный модуль json. Все они принимают байты
+и при ошибке разбора выбрасывают ValueError (или его наследника).
+"""
+import importlib
+import json
+
+BACKENDS = ('orjson', 'ujson', 'json')
+
+
+def _load_backend(name):
+    u"""
+    :return: функция loads библиотеки или None, если библиотека не установлена
+    """
+    if name == 'json':
+        return json.loads
+    try:
+        module = importlib.import_module(name)
+    except ImportError:
+        return None
+    return module.loads
+
+
+def get_decoder(name=None):
+    u"""
+    Возвращает функцию разбора json
+
+    :param name: имя библиотеки из BACKENDS, по умолчанию - первая доступная
+    :return: tuple (имя библиотеки, функция loads)
+    """
+    if name is not None:
+        if name not in BACKENDS:
+            raise RuntimeError(u"Неизвестная библиотека json: {}".format(name))
+        decoder = _load_backend(name)
+        if decoder is None:
+            raise RuntimeError(u"Библиотека {} не установлена".format(name))
+        return name, decoder
+    for name in BACKENDS:
+        decoder = _load_backend(name)
+        if decoder is not None:
+            return name, decoder
+
+BACKEND, loads = get_decoder()
+
+
+def is_json_content_type(content_type):
+    u"""
+    Проверяет заголовок Content-Type без учета регистра, пробелов и
+    параметров (charset и т.п.)
+    """
+    if not content_type:
+        return False
+    media_type = content_type.split(';', 1)[0].strip().lower()
+    return media_type == 'application/json' or media_type.endswith('+json')
+
+
+def decode_response(response):
+    u"""
+    Разбирает тело ответа requests.Response. Разбор выполняется один раз из
+    исходных байт, без промежуточного декодирования в строку.
+
+    :raise ValueError: ответ не содержит корректного json
+    """
+    return loads(response.content)
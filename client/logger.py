@@ -6,6 +6,9 @@ import colorlog
 
 def configure_logger(name):
     logger = logging.getLogger(name)
+    if logger.handlers:
+        # логгер уже настроен, например, унаследован рабочим процессом
+        return logger
     logger.setLevel(logging.DEBUG)
 
     # create console handler and set level to debug
@@ -34,3 +37,15 @@ def configure_logger(name):
     logger.addHandler(ch)
     logger.propagate = False
     return logger
+
+
+def get_logger(name, account_name=None):
+    u"""
+    Возвращает логгер клиента. Для именованного аккаунта используется
+    дочерний логгер, чтобы в сообщениях было видно, к какому аккаунту
+    они относятся
+    """
+    logger = logging.getLogger(name)
+    if account_name:
+        return logger.getChild(account_name)
+    return logger
@@ -0,0 +1,279 @@
+# -*- coding: UTF-8 -*-
+u"""
+Метрики клиента в текстовом формате Prometheus. Метрики процесса хранятся в
+общем реестре REGISTRY и доступны по http (только с localhost) и/или
+записываются в файл после каждого хода, см. секцию [Metrics] конфига.
+"""
+import bisect
+import http.server
+import logging
+import os
+import tempfile
+import threading
+
+from .settings import LOGGER_NAME, METRICS_LATENCY_BUCKETS, \
+    METRICS_DURATION_BUCKETS
+from .transport import response_size
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Metric:
+    u"""
+    Базовый класс метрики с метками. Значения хранятся по кортежу значений
+    меток в порядке labels.
+    """
+    type_name = None
+
+    def __init__(self, name, description, labels=(), registry=None):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+        (REGISTRY if registry is None else registry).register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description),
+                 '# TYPE {} {}'.format(self.name, self.type_name)]
+        with self._lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return ['{}{} {}'.format(self.name, _format_labels(self.labels, key),
+                                 _format_value(value))]
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, description, labels=(), registry=None,
+                 buckets=METRICS_LATENCY_BUCKETS):
+        super().__init__(name, description, labels, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            data = self.values.get(key)
+            if data is None:
+                # количество по каждому интервалу, сумма, общее количество
+                data = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                data[0][index] += 1
+            data[1] += value
+            data[2] += 1
+
+    def _render_value(self, key, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            lines.append('{}_bucket{} {}'.format(
+                self.name, _format_labels(self.labels, key,
+                                          ('le', _format_value(bound))),
+                cumulative))
+        lines.append('{}_bucket{} {}'.format(
+            self.name, _format_labels(self.labels, key, ('le', '+Inf')),
+            count))
+        labels = _format_labels(self.labels, key)
+        lines.append('{}_sum{} {}'.format(self.name, labels, round(total, 6)))
+        lines.append('{}_count{} {}'.format(self.name, labels, count))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        u"""
+        :return: метрики в текстовом формате Prometheus
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = Histogram(
+    'sfpy_request_duration_seconds',
+    u"Длительность запроса к API (одна попытка)", ['endpoint'])
+RESPONSES = Counter(
+    'sfpy_responses_total',
+    u"Ответы API по кодам, error - ошибка сети", ['endpoint', 'status'])
+RETRIES = Counter(
+    'sfpy_retries_total', u"Повторные запросы к API", ['endpoint'])
+RECEIVED_BYTES = Counter(
+    'sfpy_received_bytes_total',
+    u"Получено байт по сети (до распаковки)", ['endpoint'])
+TURN_DURATION = Histogram(
+    'sfpy_turn_duration_seconds', u"Длительность хода", ['account'],
+    buckets=METRICS_DURATION_BUCKETS)
+TURNS = Counter(
+    'sfpy_turns_total', u"Ходы по результату", ['account', 'result'])
+MISSIONS_STARTED = Counter(
+    'sfpy_missions_started_total', u"Запущенные миссии по типам",
+    ['category'])
+PROGRESSES_FINISHED = Counter(
+    'sfpy_progresses_finished_total', u"Завершенные прогрессы")
+FOLLOWERS = Gauge(
+    'sfpy_followers', u"Адепты по состоянию", ['account', 'state'])
+FOLLOWER_UTILISATION = Gauge(
+    'sfpy_follower_utilisation',
+    u"Доля занятых адептов после хода", ['account'])
+
+
+def record_attempt(endpoint, duration, response):
+    u"""
+    Учитывает одну попытку запроса к API
+
+    :param duration: длительность попытки, seconds
+    :param response: requests.Response или None при ошибке сети
+    """
+    REQUEST_LATENCY.observe(duration, endpoint=endpoint)
+    if response is None:
+        RESPONSES.inc(endpoint=endpoint, status='error')
+        return
+    RESPONSES.inc(endpoint=endpoint, status=response.status_code)
+    RECEIVED_BYTES.inc(response_size(response)[0], endpoint=endpoint)
+
+
+def record_followers(account, follower_manager):
+    u"""
+    Обновляет метрики адептов аккаунта
+    """
+    total = len(follower_manager.followers)
+    free = len(follower_manager.free_followers())
+    FOLLOWERS.set(free, account=account, state='free')
+    FOLLOWERS.set(total - free, account=account, state='busy')
+    FOLLOWER_UTILISATION.set(
+        round((total - free) / total, 4) if total else 0, account=account)
+
+
+class MetricsExporter:
+    u"""
+    Публикует метрики реестра по http на 127.0.0.1:port и/или записывает их
+    в файл (атомарно, через временный файл)
+    """
+    def __init__(self, port=None, path=None, registry=REGISTRY, logger=None):
+        self.port = port
+        self.path = path
+        self.registry = registry
+        self.logger = logger or logging.getLogger(LOGGER_NAME)
+        self.server = None
+
+    def start(self):
+        if not self.port or self.server is not None:
+            return
+        registry = self.registry
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            self.server = http.server.ThreadingHTTPServer(
+                ('127.0.0.1', self.port), Handler)
+        except OSError as e:
+            self.logger.error(u"Не удалось открыть порт метрик {}: {}".format(
+                self.port, e))
+            return
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever,
+                         name='sf-metrics', daemon=True).start()
+        self.logger.info(u"Метрики доступны на http://127.0.0.1:{}/".format(
+            self.port))
+
+    def dump(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(self.registry.render())
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            self.logger.warning(u"Не удалось записать метрики: {}".format(e))
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter(config, logger=None):
+    u"""
+    Возвращает запущенный экспортер метрик процесса (один на процесс)
+
+    :param config: settings.Config
+    """
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = MetricsExporter(config.metrics_port,
+                                        config.metrics_file, logger=logger)
+            _exporter.start()
+        return _exporter
@@ -0,0 +1,278 @@
+# -*- coding: UTF-8 -*-
+u"""
+Профилирование ходов работающего клиента. Профилирование включается
+параметром Enabled секции [Profile] или переключается сигналом SIGUSR2 без
+перезапуска (supervisor.py передает сигнал рабочим процессам).
+
+Для каждого хода при включенном профилировании в каталог профилей
+записываются файлы <время>-<pid>-<аккаунт>:
+    .txt  - длительность фаз хода (обновление состояния, планирование,
+            запросы к API и т.д.), количество проходов обработки, самые
+            затратные функции по cProfile и, если включено, прирост
+            выделенной памяти по tracemalloc
+    .prof - данные cProfile для pstats/snakeviz
+Хранятся только последние Keep файлов каждого типа.
+
+cProfile учитывает все функции потока, поэтому в асинхронном клиенте
+профиль хода может включать работу других аккаунтов, а одновременно
+профилируется только один ход; длительность фаз учитывается для всех.
+"""
+import collections
+import contextlib
+import io
+import logging
+import os
+import signal
+import threading
+import time
+
+from .settings import LOGGER_NAME, PROFILE_STATS_LINES, \
+    PROFILE_MEMORY_LINES, PROFILE_TRACEMALLOC_FRAMES
+
+# сигнал переключения профилирования, на Windows недоступен
+PROFILE_SIGNAL = getattr(signal, 'SIGUSR2', None)
+
+# импортируются при включении профилирования (см. _import_profilers): при
+# выключенном профилировании не замедляют запуск клиента
+cProfile = pstats = tracemalloc = None
+# выделения памяти самим профилировщиком не учитываются
+_MEMORY_FILTERS = []
+
+
+def _import_profilers():
+    global cProfile, pstats, tracemalloc
+    if cProfile is not None:
+        return
+    import cProfile as cprofile_module
+    import pstats as pstats_module
+    import tracemalloc as tracemalloc_module
+    modules = (cprofile_module, pstats_module, tracemalloc_module)
+    _MEMORY_FILTERS[:] = [
+        tracemalloc_module.Filter(False, path)
+        for path in [module.__file__ for module in modules] + [__file__]]
+    cProfile, pstats, tracemalloc = modules
+
+
+class NullTurnProfile:
+    u"""
+    Профиль хода при выключенном профилировании: ничего не измеряет
+    """
+    _phase = contextlib.nullcontext()
+
+    def phase(self, name):
+        return self._phase
+
+    def count(self, name, value=1):
+        pass
+
+    def finish(self):
+        pass
+
+NULL_PROFILE = NullTurnProfile()
+
+
+class TurnProfile:
+    u"""
+    Профиль одного хода: длительность фаз, счетчики, данные cProfile и
+    tracemalloc
+    """
+    def __init__(self, profiler, account, profile=None):
+        self.profiler = profiler
+        self.account = account
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.phases = collections.OrderedDict()
+        self.counters = collections.OrderedDict()
+        self.profile = profile
+        self.snapshot = (tracemalloc.take_snapshot()
+                         if tracemalloc.is_tracing() else None)
+        if self.profile is not None:
+            self.profile.enable()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        u"""
+        Учитывает время выполнения блока в фазе name. Фазы могут быть
+        вложенными, время вложенной фазы входит во время внешней
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            total, calls = self.phases.get(name, (0.0, 0))
+            self.phases[name] = (total + elapsed, calls + 1)
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def finish(self):
+        duration = time.perf_counter() - self._start
+        if self.profile is not None:
+            self.profile.disable()
+        self.profiler.save(self, duration)
+
+    def report(self, duration):
+        u"""
+        :return: текст отчета о ходе
+        """
+        out = io.StringIO()
+        out.write(u"Аккаунт: {}\nНачало хода: {}\nДлительность: "
+                  u"{:.3f} с\n\n".format(
+                      self.account, time.strftime(
+                          '%Y-%m-%d %H:%M:%S',
+                          time.localtime(self.started)), duration))
+        out.write(u"Фазы (секунд, вызовов):\n")
+        for name, (total, calls) in self.phases.items():
+            out.write(u"  {:<28} {:>9.4f} {:>6}\n".format(name, total, calls))
+        if self.counters:
+            out.write(u"\nСчетчики:\n")
+            for name, value in self.counters.items():
+                out.write(u"  {:<28} {:>9}\n".format(name, value))
+        if self.snapshot is not None:
+            out.write(u"\nПамять (прирост за ход):\n")
+            stats = tracemalloc.take_snapshot().filter_traces(
+                _MEMORY_FILTERS).compare_to(
+                    self.snapshot.filter_traces(_MEMORY_FILTERS), 'lineno')
+            for stat in stats[:PROFILE_MEMORY_LINES]:
+                out.write(u"  {}\n".format(stat))
+            current, peak = tracemalloc.get_traced_memory()
+            out.write(u"  отслеживается {:.1f} КБ, пик {:.1f} КБ\n".format(
+                current / 1024.0, peak / 1024.0))
+        if self.profile is not None:
+            out.write(u"\ncProfile:\n")
+            stats = pstats.Stats(self.profile, stream=out)
+            stats.sort_stats('cumulative').print_stats(PROFILE_STATS_LINES)
+        return out.getvalue()
+
+
+class Profiler:
+    u"""
+    Профилировщик процесса, общий для всех аккаунтов
+
+    :param directory: каталог профилей
+    :param keep: сколько последних профилей хранить
+    :param trace_memory: учитывать выделение памяти через tracemalloc
+    :param enabled: профилирование включено при запуске
+    """
+    def __init__(self, directory, keep, trace_memory=False, enabled=False,
+                 logger=None):
+        self.directory = directory
+        self.keep = keep
+        self.trace_memory = trace_memory
+        self.enabled = False
+        self.logger = logger or logging.getLogger(LOGGER_NAME)
+        self._capturing = False
+        self._lock = threading.Lock()
+        if enabled:
+            self.enable()
+
+    def enable(self):
+        _import_profilers()
+        self.enabled = True
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+        self.logger.info(u"Профилирование ходов включено, каталог {}".format(
+            self.directory))
+
+    def disable(self):
+        self.enabled = False
+        if (self.trace_memory and tracemalloc is not None and
+                tracemalloc.is_tracing()):
+            tracemalloc.stop()
+        self.logger.info(u"Профилирование ходов выключено")
+
+    def toggle(self, *args):
+        u"""
+        Переключает профилирование, используется как обработчик сигнала
+        """
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    def install_signal_handler(self):
+        if (PROFILE_SIGNAL is not None and
+                threading.current_thread() is threading.main_thread()):
+            signal.signal(PROFILE_SIGNAL, self.toggle)
+
+    def begin_turn(self, account):
+        u"""
+        :param account: имя аккаунта
+        :return: TurnProfile или NULL_PROFILE, если профилирование выключено
+        """
+        if not self.enabled:
+            return NULL_PROFILE
+        profile = None
+        with self._lock:
+            if not self._capturing:
+                self._capturing = True
+                profile = cProfile.Profile()
+        return TurnProfile(self, account, profile)
+
+    def save(self, turn, duration):
+        u"""
+        Записывает отчет о ходе и данные cProfile в каталог профилей
+        """
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            name = '{}-{}-{}'.format(
+                time.strftime('%Y%m%d-%H%M%S', time.localtime(turn.started)),
+                os.getpid(), turn.account)
+            path = os.path.join(self.directory, name)
+            with open(path + '.txt', 'w') as f:
+                f.write(turn.report(duration))
+            if turn.profile is not None:
+                turn.profile.dump_stats(path + '.prof')
+            self.rotate()
+            self.logger.info(u"Профиль хода записан: {}.txt".format(path))
+        except OSError as e:
+            self.logger.warning(u"Не удалось записать профиль хода: "
+                                u"{}".format(e))
+        finally:
+            if turn.profile is not None:
+                with self._lock:
+                    self._capturing = False
+
+    def rotate(self):
+        u"""
+        Удаляет старые профили, оставляя keep последних каждого типа
+        """
+        for suffix in ('.txt', '.prof'):
+            files = sorted(
+                (os.path.join(self.directory, name)
+                 for name in os.listdir(self.directory)
+                 if name.endswith(suffix)), key=_mtime)
+            for path in files[:-self.keep]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # удален другим процессом
+                    pass
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler(config, logger=None):
+    u"""
+    Возвращает профилировщик процесса (один на процесс). При первом вызове
+    из главного потока устанавливает обработчик сигнала переключения
+
+    :param config: settings.Config
+    """
+    global _profiler
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = Profiler(config.profile_dir, config.profile_keep,
+                                 config.profile_memory,
+                                 config.profile_enabled, logger)
+            _profiler.install_signal_handler()
+        return _profiler
@@ -0,0 +1,191 @@
+# -*- coding: UTF-8 -*-
+u"""
+Ограничение частоты запросов к серверу (token bucket). Ограничения задаются
+для каждого аккаунта и общее для всех процессов клиента на машине; общее
+ограничение хранится в файле, доступ к которому синхронизируется через
+flock.
+
+Запрос резервирует токен сразу, даже если токенов нет: баланс уходит в
+минус, и вызывающий код ждет, пока бакет его восполнит. Поэтому следующие
+запросы автоматически встают в очередь за уже зарезервированными.
+
+Приоритеты реализованы через резерв: запрос с низким приоритетом
+выполняется, только если после него в бакете останется часть токенов для
+более важных запросов. Завершение прогрессов не ждет резерва, запуск миссий
+оставляет четверть бакета, обновление данных HeroBag - половину. Приоритет
+ограничивает только то, насколько запрос может опустошить бакет, и не
+меняет очередь: запрос с высоким приоритетом, пришедший после уже
+зарезервированных запросов с низким, ждет, пока бакет восполнит и их
+токены.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from .settings import LOGGER_NAME, RATE_LIMIT_BURST_SECONDS
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# доля бакета, которая остается для запросов с более высоким приоритетом;
+# порядок уже зарезервированных запросов не меняется
+PRIORITY_RESERVE = {
+    PRIORITY_HIGH: 0.0,
+    PRIORITY_NORMAL: 0.25,
+    PRIORITY_LOW: 0.5,
+}
+
+
+class TokenBucket:
+    u"""
+    Бакет в памяти процесса, общий для всех потоков
+
+    :param rate: запросов в секунду
+    :param burst: емкость бакета
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, rate * RATE_LIMIT_BURST_SECONDS))
+        self._lock = threading.Lock()
+        self._state = (self.burst, None)
+
+    def _take(self, state, priority, now):
+        u"""
+        Резервирует токен
+
+        :param state: tuple (tokens, updated) - баланс и время его расчета
+        :return: tuple (новое состояние, время ожидания)
+        """
+        tokens, updated = state
+        if updated is not None:
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        required = 1 + self.burst * PRIORITY_RESERVE[priority]
+        wait = max(0.0, (required - tokens) / self.rate)
+        return (tokens - 1, now), wait
+
+    def reserve(self, priority=PRIORITY_NORMAL, now=None):
+        u"""
+        :return: сколько секунд подождать перед запросом
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._state, wait = self._take(self._state, priority, now)
+        return wait
+
+
+class FileTokenBucket(TokenBucket):
+    u"""
+    Бакет, общий для нескольких процессов: состояние хранится в файле и
+    изменяется под эксклюзивной блокировкой flock. Используется время
+    time.time(), одинаковое для всех процессов машины. Если файл недоступен
+    (нет прав, другой владелец), бакет работает только внутри процесса.
+    """
+    def __init__(self, path, rate, burst=None, logger=None):
+        super().__init__(rate, burst)
+        self.path = path
+        self.logger = logger or logging.getLogger(LOGGER_NAME)
+        self.shared = True
+
+    def reserve(self, priority=PRIORITY_NORMAL, now=None):
+        now = time.time() if now is None else now
+        if self.shared:
+            with self._lock:
+                try:
+                    return self._reserve_shared(priority, now)
+                except OSError as e:
+                    self.logger.warning(
+                        u"Файл общего ограничения запросов {} недоступен: "
+                        u"{}, ограничение действует только внутри "
+                        u"процесса".format(self.path, e))
+                    self.shared = False
+        return super().reserve(priority, now)
+
+    def _reserve_shared(self, priority, now):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, 0o700, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            state = self._read(fd)
+            state, wait = self._take(state, priority, now)
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, json.dumps(state).encode('ascii'))
+        finally:
+            os.close(fd)
+        return wait
+
+    def _read(self, fd):
+        data = os.read(fd, 256)
+        try:
+            tokens, updated = json.loads(data.decode('ascii'))
+            return float(tokens), float(updated)
+        except (ValueError, TypeError):
+            # новый или поврежденный файл
+            return self.burst, None
+
+
+class RateLimiter:
+    u"""
+    Набор бакетов, которые должны пропустить запрос: ожидание перед
+    запросом - максимальное из ожиданий всех бакетов
+    """
+    def __init__(self, buckets):
+        self.buckets = [b for b in buckets if b is not None]
+
+    def reserve(self, priority=PRIORITY_NORMAL):
+        u"""
+        :return: сколько секунд подождать перед запросом
+        """
+        now = time.time()
+        return max([b.reserve(priority, now) for b in self.buckets],
+                   default=0.0)
+
+_global_buckets = {}
+_global_lock = threading.Lock()
+
+
+def get_global_bucket(config, logger=None):
+    u"""
+    Возвращает общий бакет для всех аккаунтов процесса. Если задан файл
+    состояния и ОС поддерживает flock, бакет общий и для других процессов.
+    """
+    if not config.rate_limit_global:
+        return None
+    key = (config.rate_limit_file, config.rate_limit_global)
+    with _global_lock:
+        if key not in _global_buckets:
+            if config.rate_limit_file and fcntl is not None:
+                bucket = FileTokenBucket(config.rate_limit_file,
+                                         config.rate_limit_global,
+                                         logger=logger)
+            else:
+                if config.rate_limit_file:
+                    (logger or logging.getLogger(LOGGER_NAME)).warning(
+                        u"flock недоступен, общее ограничение запросов "
+                        u"действует только внутри процесса")
+                bucket = TokenBucket(config.rate_limit_global)
+            _global_buckets[key] = bucket
+        return _global_buckets[key]
+
+
+def create_rate_limiter(config, logger=None):
+    u"""
+    Создает ограничитель запросов для одного аккаунта: собственный бакет
+    аккаунта и общий бакет процесса/машины
+
+    :param config: settings.Config
+    :return: RateLimiter
+    """
+    account_bucket = (TokenBucket(config.rate_limit_account)
+                      if config.rate_limit_account else None)
+    return RateLimiter([account_bucket, get_global_bucket(config, logger)])
@@ -0,0 +1,385 @@
+# -*- coding: UTF-8 -*-
+u"""
+Запись запросов к API и ответов сервера в журнал и воспроизведение записи
+вместо сервера, см. секцию [Recording] конфига.
+
+Журнал дописывается в конец: каждая запись - json одной строкой, сжатая
+отдельным gzip-блоком и записанная одним вызовом write (O_APPEND), поэтому
+в один журнал могут писать несколько процессов, а неполная запись после
+аварийного завершения пропускается при чтении. Журнал читается и обычными
+средствами: zcat record.gz | jq .
+
+Поля записи:
+    time     - время начала запроса, unix time
+    elapsed  - длительность запроса, секунд
+    account  - хеш логина аккаунта (см. account_key)
+    endpoint - имя операции (см. metrics.py)
+    method, url - запрос, csrf_token в url заменяется на REDACTED
+    status, headers, body - ответ; тело, не являющееся текстом utf-8,
+               записывается в body_base64
+    error    - timeout или connection, если ответ не получен
+
+Логин, пароль и csrf_token аккаунта в теле ответа также заменяются на
+REDACTED. Cookies и заголовки запроса не записываются.
+
+Воспроизведение: ReplayAdapter подключается к requests.Session вместо
+сетевого транспорта и отвечает на запросы к API записанными ответами по
+порядку (отдельная очередь для каждого пути url) - сразу или с исходными
+интервалами между запросами (Speed). На запросы, которых нет в записи
+(страница портала, аутентификация), отвечает пустой страницей с cookie
+csrf_token. Когда записанные ответы закончились, выбрасывается
+ReplayFinished.
+"""
+import base64
+import collections
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.parse
+import zlib
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.cookies import cookiejar_from_dict
+from requests.exceptions import ConnectionError, Timeout
+from requests.structures import CaseInsensitiveDict
+
+from .settings import LOGGER_NAME, RECORDING_COMPRESS_LEVEL, \
+    RECORDING_READ_CHUNK
+
+REDACTED = 'REDACTED'
+# параметры url, значения которых не записываются
+REDACTED_PARAMS = ('csrf_token', 'login', 'password')
+# записываемые заголовки ответа: их использует клиент
+RECORDED_HEADERS = ('Content-Type', 'Retry-After')
+
+ERROR_TIMEOUT = 'timeout'
+ERROR_CONNECTION = 'connection'
+
+GZIP_MAGIC = b'\x1f\x8b'
+# zlib.decompressobj: формат gzip
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class ReplayFinished(Exception):
+    u"""
+    Записанные ответы закончились
+    """
+
+
+def account_key(account):
+    u"""
+    :param account: settings.Account
+    :return: идентификатор аккаунта в записи, логин не сохраняется
+    """
+    return hashlib.sha1(
+        account.login.lower().encode('utf-8')).hexdigest()[:12]
+
+
+def redact_url(url):
+    parts = urllib.parse.urlsplit(url)
+    if not parts.query:
+        return url
+    query = [(name, REDACTED if name.lower() in REDACTED_PARAMS else value)
+             for name, value in urllib.parse.parse_qsl(
+                 parts.query, keep_blank_values=True)]
+    return urllib.parse.urlunsplit(
+        parts._replace(query=urllib.parse.urlencode(query)))
+
+
+def redact_text(text, secrets):
+    for secret in secrets:
+        if secret:
+            text = text.replace(secret, REDACTED)
+    return text
+
+
+def make_record(account, endpoint, url, params, elapsed, response=None,
+                error=None, secrets=()):
+    u"""
+    :param account: settings.Account
+    :param url: url запроса
+    :param params: параметры запроса
+    :param response: requests.Response или None при ошибке сети
+    :param error: исключение requests при ошибке сети
+    :param secrets: дополнительные строки, которые нужно скрыть
+    :return: dict запись журнала
+    """
+    record = collections.OrderedDict([
+        ('time', round(time.time() - elapsed, 3)),
+        ('elapsed', round(elapsed, 4)),
+        ('account', account_key(account)),
+        ('endpoint', endpoint),
+        ('method', 'GET'),
+    ])
+    if response is None:
+        record['url'] = redact_url(requests.Request(
+            'GET', url, params=params).prepare().url)
+        record['error'] = (ERROR_TIMEOUT if isinstance(error, Timeout)
+                           else ERROR_CONNECTION)
+        return record
+    secrets = [account.login, account.password] + list(secrets)
+    record['method'] = response.request.method
+    record['url'] = redact_url(response.url)
+    record['status'] = response.status_code
+    record['headers'] = {name: response.headers[name]
+                         for name in RECORDED_HEADERS
+                         if name in response.headers}
+    content = response.content or b''
+    try:
+        record['body'] = redact_text(content.decode('utf-8'), secrets)
+    except UnicodeDecodeError:
+        record['body_base64'] = base64.b64encode(content).decode('ascii')
+    return record
+
+
+def encode_record(record, compress_level=RECORDING_COMPRESS_LEVEL):
+    u"""
+    :return: bytes, gzip-блок с записью
+    """
+    line = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress((line + '\n').encode('utf-8')) + \
+        compressor.flush()
+
+
+def _read_member(data, pos):
+    u"""
+    Распаковывает gzip-блок, начинающийся с позиции pos
+
+    :return: tuple (распакованные данные, позиция следующего блока)
+    :raise ValueError: блок поврежден или неполный
+    """
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    parts = []
+    try:
+        while not decompressor.eof and pos < len(data):
+            chunk = data[pos:pos + RECORDING_READ_CHUNK]
+            parts.append(decompressor.decompress(chunk))
+            pos += len(chunk)
+    except zlib.error as e:
+        raise ValueError(str(e))
+    if not decompressor.eof:
+        raise ValueError(u"неполный gzip-блок")
+    return b''.join(parts), pos - len(decompressor.unused_data)
+
+
+def read_records(path, logger=None):
+    u"""
+    Читает записи журнала. Поврежденные блоки пропускаются до начала
+    следующего блока
+
+    :return: generator of dicts
+    """
+    logger = logger or logging.getLogger(LOGGER_NAME)
+    with open(path, 'rb') as f:
+        data = memoryview(f.read())
+    pos = 0
+    while pos < len(data):
+        try:
+            lines, next_pos = _read_member(data, pos)
+        except ValueError as e:
+            logger.warning(u"Поврежденная запись в журнале {} (позиция "
+                           u"{}): {}".format(path, pos, e))
+            next_pos = bytes(data[pos + 1:]).find(GZIP_MAGIC)
+            if next_pos < 0:
+                return
+            pos += 1 + next_pos
+            continue
+        pos = next_pos
+        for line in lines.splitlines():
+            if line.strip():
+                yield json.loads(line.decode('utf-8'))
+
+
+class Recorder:
+    u"""
+    Дописывает запросы к API в журнал path. Используется из потоков
+    executor'а асинхронного клиента
+    """
+    def __init__(self, path, compress_level=RECORDING_COMPRESS_LEVEL,
+                 logger=None):
+        self.path = path
+        self.compress_level = compress_level
+        self.logger = logger or logging.getLogger(LOGGER_NAME)
+        self.records = 0
+        self._failed = False
+        self._lock = threading.Lock()
+
+    def record(self, account, endpoint, url, params, elapsed, response=None,
+               error=None, secrets=()):
+        u"""
+        Записывает одну попытку запроса, параметры - как у make_record
+        """
+        data = encode_record(
+            make_record(account, endpoint, url, params, elapsed, response,
+                        error, secrets), self.compress_level)
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                         0o600)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            if not self._failed:
+                self.logger.warning(u"Не удалось записать запрос в журнал "
+                                    u"{}: {}".format(self.path, e))
+            self._failed = True
+            return
+        with self._lock:
+            self.records += 1
+            self._failed = False
+
+
+def _build_response(request, record):
+    response = requests.Response()
+    response.request = request
+    response.url = request.url
+    response.status_code = record['status']
+    response.reason = 'Replayed'
+    response.headers = CaseInsensitiveDict(record.get('headers') or {})
+    if 'body_base64' in record:
+        response._content = base64.b64decode(record['body_base64'])
+    else:
+        response._content = record.get('body', '').encode('utf-8')
+    response.encoding = 'utf-8'
+    return response
+
+
+class ReplayAdapter(BaseAdapter):
+    u"""
+    Транспорт requests, отвечающий записанными ответами
+
+    :param records: записи одного аккаунта в порядке записи
+    :param speed: 0 - отвечать сразу, иначе соблюдать интервалы между
+        запросами из записи, ускоренные в speed раз
+    """
+    def __init__(self, records, speed=0):
+        super().__init__()
+        self.speed = speed
+        self.queues = collections.defaultdict(collections.deque)
+        for record in records:
+            self.queues[self._key(record['method'], record['url'])].append(
+                record)
+        self.first_time = records[0]['time'] if records else 0
+        self.started = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(method, url):
+        return method, urllib.parse.urlsplit(url).path
+
+    def send(self, request, **kwargs):
+        key = self._key(request.method, request.url)
+        with self._lock:
+            if self.started is None:
+                self.started = time.monotonic()
+            if key not in self.queues:
+                return self._page(request)
+            if not self.queues[key]:
+                raise ReplayFinished(request.url)
+            record = self.queues[key].popleft()
+        self._wait(record)
+        if 'error' in record:
+            error = (Timeout if record['error'] == ERROR_TIMEOUT
+                     else ConnectionError)
+            raise error(u"Ошибка из записи", request=request)
+        return _build_response(request, record)
+
+    def _wait(self, record):
+        if not self.speed:
+            return
+        delay = (self.started + (record['time'] - self.first_time) /
+                 self.speed - time.monotonic())
+        if delay > 0:
+            time.sleep(delay)
+
+    def _page(self, request):
+        response = _build_response(request, {
+            'status': 200, 'headers': {'Content-Type': 'text/html'}})
+        response.cookies = cookiejar_from_dict({'csrf_token': REDACTED})
+        return response
+
+    def close(self):
+        pass
+
+
+class Recording:
+    u"""
+    Запись, загруженная для воспроизведения
+    """
+    def __init__(self, records, speed=0, logger=None):
+        self.records = list(records)
+        self.speed = speed
+        self.logger = logger or logging.getLogger(LOGGER_NAME)
+
+    @classmethod
+    def load(cls, path, speed=0, logger=None):
+        return cls(read_records(path, logger), speed, logger)
+
+    def for_account(self, account):
+        u"""
+        :return: записи аккаунта или все записи, если аккаунта нет в записи
+        """
+        key = account_key(account)
+        records = [r for r in self.records if r['account'] == key]
+        if records:
+            return records
+        self.logger.warning(u"В записи нет запросов аккаунта {}, "
+                            u"воспроизводятся все запросы".format(
+                                account.name))
+        return list(self.records)
+
+    def mount(self, session, account):
+        u"""
+        Подключает воспроизведение к requests.Session вместо сети
+        """
+        adapter = ReplayAdapter(self.for_account(account), self.speed)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return adapter
+
+_recorder = None
+_recording = None
+_lock = threading.Lock()
+
+
+def get_recorder(config, logger=None):
+    u"""
+    Возвращает журнал запросов процесса или None, если запись выключена
+
+    :param config: settings.Config
+    """
+    global _recorder
+    if not config.record_file:
+        return None
+    with _lock:
+        if _recorder is None or _recorder.path != config.record_file:
+            _recorder = Recorder(config.record_file, logger=logger)
+            (logger or logging.getLogger(LOGGER_NAME)).info(
+                u"Запросы к API записываются в {}".format(config.record_file))
+        return _recorder
+
+
+def get_recording(config, logger=None):
+    u"""
+    Возвращает запись для воспроизведения (читается один раз на процесс)
+    или None, если воспроизведение выключено
+
+    :param config: settings.Config
+    """
+    global _recording
+    if not config.replay_file:
+        return None
+    with _lock:
+        if _recording is None:
+            _recording = Recording.load(config.replay_file,
+                                        config.replay_speed, logger)
+            (logger or logging.getLogger(LOGGER_NAME)).info(
+                u"Воспроизводится запись {}, запросов: {}".format(
+                    config.replay_file, len(_recording.records)))
+        return _recording
@@ -0,0 +1,282 @@
+# -*- coding: UTF-8 -*-
+u"""
+Общая политика повторных запросов для auth.py и gameapi.py: экспоненциальная
+задержка с decorrelated jitter, учет заголовка Retry-After, ограничение
+общего времени на запрос и circuit breaker, который приостанавливает запросы
+к недоступному серверу для всех аккаунтов процесса.
+
+Политика только вычисляет задержки, ожидание (time.sleep или asyncio.sleep)
+выполняет вызывающий код, поэтому она одинаково работает в синхронном и
+асинхронном клиенте:
+
+    retry = API_POLICY.begin()
+    while True:
+        delay = retry.wait_time()
+        if delay:
+            time.sleep(delay)
+            continue
+        try:
+            response, error = request(), None
+        except (Timeout, ConnectionError) as e:
+            response, error = None, e
+        delay = retry.check(response, error)
+        if delay is None:
+            return response
+        time.sleep(delay)
+"""
+import datetime
+import email.utils
+import random
+import threading
+import time
+
+from requests.exceptions import RequestException
+
+from .settings import RETRY_BASE_DELAY_SECONDS, RETRY_MAX_DELAY_SECONDS, \
+    API_REQUEST_DEADLINE_SECONDS, HERO_BAG_RETRY_MAX_DELAY_SECONDS, \
+    AUTH_RETRY_BASE_DELAY_SECONDS, AUTH_RETRY_MAX_DELAY_SECONDS, \
+    CIRCUIT_BREAKER_FAILURES, CIRCUIT_BREAKER_RESET_SECONDS
+
+# ответы, после которых запрос имеет смысл повторить
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+ERROR_STATUSES = range(400, 600)
+
+
+class RetryError(RequestException):
+    u"""
+    Запрос не удался за отведенное политикой время
+    """
+    pass
+
+
+def get_retry_after(response):
+    u"""
+    Разбирает заголовок Retry-After: количество секунд или дату
+
+    :return: seconds, float или None
+    """
+    if response is None:
+        return None
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return max(0.0, (date - now).total_seconds())
+
+
+class CircuitBreaker:
+    u"""
+    После failure_threshold ошибок подряд переходит в состояние "открыт":
+    запросы не выполняются reset_timeout секунд. Затем пропускается один
+    пробный запрос (состояние "полуоткрыт"): при успехе breaker закрывается,
+    при ошибке снова открывается. Один объект используется всеми
+    аккаунтами процесса, в том числе из потоков executor'а.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, failure_threshold=CIRCUIT_BREAKER_FAILURES,
+                 reset_timeout=CIRCUIT_BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probe_at = None
+        self._lock = threading.Lock()
+
+    def wait_time(self, now=None):
+        u"""
+        :return: сколько секунд ждать до следующей попытки, 0 - запрос
+            можно выполнять
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0
+            if self.state == self.OPEN:
+                remaining = self.opened_at + self.reset_timeout - now
+                if remaining > 0:
+                    return remaining
+                self.state = self.HALF_OPEN
+                self._probe_at = now
+                return 0
+            # полуоткрыт: пробный запрос уже выполняется; если он завис
+            # дольше reset_timeout, разрешаем новую пробу
+            if now - self._probe_at > self.reset_timeout:
+                self._probe_at = now
+                return 0
+            return self.reset_timeout - (now - self._probe_at)
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self, now=None):
+        u"""
+        :return: True, если после этой ошибки breaker открылся
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.failures += 1
+            if (self.state == self.HALF_OPEN or
+                    self.failures >= self.failure_threshold):
+                opened = self.state != self.OPEN
+                self.state = self.OPEN
+                self.opened_at = now
+                return opened
+            return False
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    u"""
+    Возвращает общий для процесса circuit breaker с указанным именем
+    """
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+class RetryPolicy:
+    u"""
+    Параметры повторных запросов к одной группе адресов
+
+    :param base_delay: минимальная задержка перед повтором
+    :param max_delay: максимальная задержка перед повтором
+    :param deadline: общее время на запрос со всеми повторами, None - без
+        ограничения
+    :param statuses: коды ответа, после которых запрос повторяется
+    :param breaker: имя circuit breaker'а (см. get_breaker) или None
+    """
+    def __init__(self, base_delay=RETRY_BASE_DELAY_SECONDS,
+                 max_delay=RETRY_MAX_DELAY_SECONDS, deadline=None,
+                 statuses=RETRY_STATUSES, breaker=None):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.statuses = statuses
+        self.breaker = breaker
+
+    def begin(self):
+        u"""
+        :return: Retry, состояние повторов для одного запроса
+        """
+        return Retry(self)
+
+
+class Retry:
+    u"""
+    Состояние повторов одного запроса
+    """
+    def __init__(self, policy, clock=time.monotonic, rnd=random):
+        self.policy = policy
+        self.clock = clock
+        self.rnd = rnd
+        self.breaker = get_breaker(policy.breaker) if policy.breaker else None
+        self.started = clock()
+        self.attempts = 0
+        self.delay = policy.base_delay
+
+    def elapsed(self):
+        return self.clock() - self.started
+
+    def _check_deadline(self, delay, error=None, response=None):
+        deadline = self.policy.deadline
+        if deadline is not None and self.elapsed() + delay > deadline:
+            raise RetryError(
+                u"Запрос не выполнен за {} секунд, попыток: {}{}".format(
+                    deadline, self.attempts,
+                    u", последняя ошибка: {}".format(error) if error else ''),
+                response=response)
+
+    def wait_time(self):
+        u"""
+        Время ожидания перед попыткой из-за открытого circuit breaker'а
+
+        :raise RetryError: ожидание выходит за deadline
+        """
+        if self.breaker is None:
+            return 0
+        delay = self.breaker.wait_time()
+        if delay:
+            # небольшой разброс, чтобы аккаунты не возобновили запросы
+            # одновременно
+            delay += self.rnd.uniform(0, self.policy.base_delay)
+            self._check_deadline(delay)
+        return delay
+
+    def next_delay(self, retry_after=None):
+        u"""
+        Следующая задержка по схеме decorrelated jitter:
+        delay = min(max_delay, random(base_delay, delay * 3)), но не меньше
+        значения Retry-After
+        """
+        self.delay = min(self.policy.max_delay, self.rnd.uniform(
+            self.policy.base_delay, self.delay * 3))
+        if retry_after is not None:
+            return max(self.delay, min(retry_after, self.policy.max_delay))
+        return self.delay
+
+    def failure(self, error=None, response=None):
+        u"""
+        Учитывает неудачную попытку
+
+        :return: задержка перед следующей попыткой, seconds
+        :raise RetryError: следующая попытка выходит за deadline
+        """
+        self.attempts += 1
+        if self.breaker is not None:
+            self.breaker.record_failure()
+        delay = self.next_delay(get_retry_after(response))
+        self._check_deadline(delay, error, response)
+        return delay
+
+    def success(self):
+        self.attempts += 1
+        if self.breaker is not None:
+            self.breaker.record_success()
+
+    def check(self, response=None, error=None):
+        u"""
+        Проверяет результат попытки
+
+        :param response: requests.Response или None
+        :param error: исключение, которое нужно повторить, или None
+        :return: None, если запрос выполнен, иначе задержка перед
+            следующей попыткой
+        :raise RetryError: следующая попытка выходит за deadline
+        """
+        if error is None and response.status_code not in \
+                self.policy.statuses:
+            self.success()
+            return None
+        return self.failure(error, response)
+
+# действия с миссиями и прогрессами: после API_REQUEST_DEADLINE_SECONDS
+# действие считается неудачным
+API_POLICY = RetryPolicy(deadline=API_REQUEST_DEADLINE_SECONDS,
+                         breaker='portal')
+# данные HeroBag нужны для работы, повторяются без ограничения по времени
+# при любом ответе с ошибкой
+HERO_BAG_POLICY = RetryPolicy(max_delay=HERO_BAG_RETRY_MAX_DELAY_SECONDS,
+                              statuses=ERROR_STATUSES, breaker='portal')
+AUTH_POLICY = RetryPolicy(base_delay=AUTH_RETRY_BASE_DELAY_SECONDS,
+                          max_delay=AUTH_RETRY_MAX_DELAY_SECONDS,
+                          breaker='auth')
@@ -0,0 +1,73 @@
+# -*- coding: UTF-8 -*-
+import datetime
+import heapq
+import logging
+import random
+
+from .settings import LOGGER_NAME, MAX_IDLE_MINUTES, \
+    MIN_REQUEST_DELAY_SECONDS, DEADLINE_DELAY_SECONDS, \
+    DEADLINE_JITTER_SECONDS, MAX_OVERDUE_SECONDS
+
+
+class Scheduler:
+    u"""
+    Планировщик запросов к серверу. Хранит очередь с приоритетом из времени
+    окончания текущих прогрессов и вычисляет задержку так, чтобы клиент
+    проснулся сразу после ближайшего из них. Если ближайших событий нет,
+    используется периодический опрос раз в idle_minutes.
+
+    :param idle_minutes: интервал опроса без ближайших событий, минут
+    """
+    def __init__(self, idle_minutes=MAX_IDLE_MINUTES):
+        self.logger = logging.getLogger(LOGGER_NAME)
+        self.idle_minutes = idle_minutes
+        self.deadlines = []
+
+    def update(self, end_times):
+        u"""
+        Заменяет очередь событий новым набором времен окончания прогрессов
+
+        :param end_times: iterable of datetime
+        """
+        self.deadlines = list(end_times)
+        heapq.heapify(self.deadlines)
+
+    def next_deadline(self, now=None):
+        u"""
+        Возвращает ближайшее время окончания прогресса. Прогрессы, которые
+        сервер так и не завершил спустя MAX_OVERDUE_SECONDS, из очереди
+        удаляются, чтобы не опрашивать сервер слишком часто.
+
+        :return: datetime or None
+        """
+        now = now or datetime.datetime.now()
+        overdue = now - datetime.timedelta(seconds=MAX_OVERDUE_SECONDS)
+        while self.deadlines and self.deadlines[0] < overdue:
+            heapq.heappop(self.deadlines)
+        if self.deadlines:
+            return self.deadlines[0]
+        return None
+
+    def next_delay(self, now=None):
+        u"""
+        Вычисляет время до следующего запроса: чуть позже ближайшего
+        окончания прогресса со случайным смещением, но не реже, чем раз в
+        idle_minutes (+- 25%)
+
+        :return: seconds, int
+        """
+        now = now or datetime.datetime.now()
+        idle_delay = self._get_idle_delay()
+        deadline = self.next_deadline(now)
+        if deadline is None:
+            return idle_delay
+        seconds = (deadline - now).total_seconds() + DEADLINE_DELAY_SECONDS
+        seconds += random.uniform(0, DEADLINE_JITTER_SECONDS)
+        seconds = max(seconds, MIN_REQUEST_DELAY_SECONDS)
+        return int(min(seconds, idle_delay))
+
+    def _get_idle_delay(self):
+        seconds = int(self.idle_minutes * 60)
+        delay_range_start = seconds - int(seconds * 0.25)
+        delay_range_end = seconds + int(seconds * 0.25)
+        return random.randint(delay_range_start, delay_range_end)
@@ -0,0 +1,269 @@
+# -*- coding: UTF-8 -*-
+u"""
+Оценка миссий по правилам из секции [Scoring] конфига. Правило - вес
+признака миссии, оценка миссии - сумма признаков, умноженных на веса.
+Если правила заданы, доступные миссии обрабатываются по убыванию оценки
+(см. Game.get_pass_data), а MissionPriority задает только категории
+миссий, которые клиент запускает.
+
+Признаки:
+    experience           - опыт за миссию
+    experience_per_slot  - опыт на одного адепта
+    experience_per_hour  - опыт за час выполнения
+    duration             - длительность, часов
+    slots                - количество мест
+    difficulty           - сложность
+    price                - сумма стоимости во всех валютах
+    free                 - 1, если миссия бесплатна
+    success              - 1, если сервер показывает успешный исход
+    profession           - доля мест, которые могут занять свободные адепты
+                           подходящих профессий (0..1)
+    type.<missionType>   - 1 для миссий этого типа, например type.case
+    category.<категория> - 1 для миссий категории (см. Mission.category)
+
+Например, ивентовые миссии вперед, затем по опыту в час с учетом
+длительности:
+
+    [Scoring]
+    category.case = 1000000
+    experience_per_hour = 1
+    duration = -20
+
+Правила разбираются один раз на процесс (см. get_scoring). Если
+установлен NumPy, признаки всех миссий считаются массивами, совпадение
+профессий миссий со свободными адептами - через количество свободных
+адептов по профессиям, без перебора пар миссия-адепт; без NumPy те же
+формулы считаются в цикле с тем же результатом.
+"""
+import threading
+
+# импортируется при создании ScoringEngine (см. _import_numpy): без правил
+# оценки NumPy не нужен и не замедляет запуск клиента
+numpy = None
+
+FEATURES = ('experience', 'experience_per_slot', 'experience_per_hour',
+            'duration', 'slots', 'difficulty', 'price', 'free', 'success',
+            'profession')
+TYPE_PREFIX = 'type.'
+CATEGORY_PREFIX = 'category.'
+CATEGORIES = ('case', 'mining', 'battle', 'cult', 'invasion', 'other')
+
+
+class ScoringRules:
+    u"""
+    Разобранные правила оценки
+
+    :param rules: iterable of tuples (признак, вес)
+    :raise RuntimeError: неизвестный признак
+    """
+    def __init__(self, rules):
+        self.weights = []
+        self.type_weights = {}
+        self.category_weights = {}
+        for name, weight in rules:
+            name = name.strip().lower()
+            weight = float(weight)
+            if name.startswith(TYPE_PREFIX):
+                self.type_weights[name[len(TYPE_PREFIX):]] = weight
+            elif name.startswith(CATEGORY_PREFIX):
+                category = name[len(CATEGORY_PREFIX):]
+                if category not in CATEGORIES:
+                    raise RuntimeError(
+                        u"Неизвестная категория миссий в правилах оценки: "
+                        u"{}".format(category))
+                self.category_weights[category] = weight
+            elif name in FEATURES:
+                self.weights.append((name, weight))
+            else:
+                raise RuntimeError(
+                    u"Неизвестный признак в правилах оценки: {}".format(name))
+        # признаки суммируются в порядке FEATURES
+        self.weights.sort(key=lambda item: FEATURES.index(item[0]))
+
+    def label_weight(self, mission):
+        u"""
+        :return: сумма весов типа и категории миссии
+        """
+        return (self.type_weights.get(mission.mission_type.lower(), 0.0) +
+                self.category_weights.get(mission.category(), 0.0))
+
+
+def _price(mission):
+    return sum(c['amount'] for c in mission.price['currencies'])
+
+
+def _matched(mission, counts):
+    return sum(counts.get(p, 0) for p in set(mission.get_profession_ids()))
+
+
+def _import_numpy():
+    u"""
+    :return: True, если NumPy установлен
+    """
+    global numpy
+    if numpy is None:
+        try:
+            import numpy as module
+        except ImportError:
+            return False
+        numpy = module
+    return True
+
+
+class ScoringEngine:
+    u"""
+    Вычисляет оценки миссий по правилам
+
+    :param rules: ScoringRules
+    :param use_numpy: считать массивами NumPy (если NumPy установлен), по
+        умолчанию - да
+    """
+    def __init__(self, rules, use_numpy=None):
+        self.rules = rules
+        if use_numpy or use_numpy is None:
+            use_numpy = _import_numpy()
+        self.use_numpy = use_numpy
+
+    def score(self, missions, follower_manager):
+        u"""
+        :param missions: list of Mission
+        :param follower_manager: FollowerManager, для признака profession
+        :return: list of float, оценки в порядке missions
+        """
+        if not missions:
+            return []
+        if self.use_numpy:
+            return self._score_numpy(missions, follower_manager).tolist()
+        return self._score_python(missions, follower_manager)
+
+    def sort(self, missions, follower_manager):
+        u"""
+        :return: миссии по убыванию оценки, при равной оценке - в исходном
+            порядке
+        """
+        if not missions:
+            return missions
+        if self.use_numpy:
+            scores = self._score_numpy(missions, follower_manager)
+            order = numpy.argsort(-scores, kind='stable').tolist()
+        else:
+            scores = self._score_python(missions, follower_manager)
+            order = sorted(range(len(missions)), key=lambda i: -scores[i])
+        return [missions[i] for i in order]
+
+    def _score_python(self, missions, follower_manager):
+        weights = self.rules.weights
+        counts = (follower_manager.free_profession_counts()
+                  if any(name == 'profession' for name, _ in weights)
+                  else None)
+        labels = self.rules.type_weights or self.rules.category_weights
+        scores = []
+        for mission in missions:
+            experience = float(mission.experience)
+            duration = float(mission.duration)
+            slots = float(mission.slot_count)
+            score = 0.0
+            for name, weight in weights:
+                if name == 'experience':
+                    value = experience
+                elif name == 'experience_per_slot':
+                    value = experience / max(slots, 1.0)
+                elif name == 'experience_per_hour':
+                    value = experience * 3600.0 / max(duration, 1.0)
+                elif name == 'duration':
+                    value = duration / 3600.0
+                elif name == 'slots':
+                    value = slots
+                elif name == 'difficulty':
+                    value = float(mission.difficulty)
+                elif name == 'price':
+                    value = float(_price(mission))
+                elif name == 'free':
+                    value = float(mission.is_free())
+                elif name == 'success':
+                    value = float(bool(mission.is_success))
+                else:
+                    value = (min(float(_matched(mission, counts)), slots) /
+                             max(slots, 1.0))
+                score += weight * value
+            if labels:
+                score += self.rules.label_weight(mission)
+            scores.append(score)
+        return scores
+
+    def _score_numpy(self, missions, follower_manager):
+        count = len(missions)
+
+        def column(values):
+            return numpy.fromiter(values, dtype=float, count=count)
+
+        experience = column(m.experience for m in missions)
+        duration = column(m.duration for m in missions)
+        slots = column(m.slot_count for m in missions)
+        columns = {
+            'experience': lambda: experience,
+            'experience_per_slot':
+                lambda: experience / numpy.maximum(slots, 1.0),
+            'experience_per_hour':
+                lambda: experience * 3600.0 / numpy.maximum(duration, 1.0),
+            'duration': lambda: duration / 3600.0,
+            'slots': lambda: slots,
+            'difficulty': lambda: column(m.difficulty for m in missions),
+            'price': lambda: column(_price(m) for m in missions),
+            'free': lambda: column(m.is_free() for m in missions),
+            'success': lambda: column(bool(m.is_success) for m in missions),
+            'profession':
+                lambda: self._profession_numpy(missions, follower_manager,
+                                               slots),
+        }
+        scores = numpy.zeros(count)
+        for name, weight in self.rules.weights:
+            scores += weight * columns[name]()
+        if self.rules.type_weights or self.rules.category_weights:
+            scores += column(self.rules.label_weight(m) for m in missions)
+        return scores
+
+    @staticmethod
+    def _profession_numpy(missions, follower_manager, slots):
+        u"""
+        Доля мест миссий, которые могут занять свободные адепты подходящих
+        профессий: матрица миссии x профессии, умноженная на количество
+        свободных адептов по профессиям
+        """
+        counts = follower_manager.free_profession_counts()
+        index = {profession: i for i, profession in enumerate(counts)}
+        rows, cols = [], []
+        for row, mission in enumerate(missions):
+            for profession in set(mission.get_profession_ids()):
+                col = index.get(profession)
+                if col is not None:
+                    rows.append(row)
+                    cols.append(col)
+        free = numpy.fromiter(counts.values(), dtype=float,
+                              count=len(counts))
+        matched = numpy.bincount(
+            numpy.array(rows, dtype=numpy.intp),
+            weights=free[numpy.array(cols, dtype=numpy.intp)],
+            minlength=len(missions))
+        return numpy.minimum(matched, slots) / numpy.maximum(slots, 1.0)
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_scoring(config):
+    u"""
+    Возвращает ScoringEngine для правил из настроек (правила разбираются
+    один раз на процесс) или None, если правила не заданы
+
+    :param config: settings.Config
+    """
+    if not config.scoring_rules:
+        return None
+    with _engines_lock:
+        engine = _engines.get(config.scoring_rules)
+        if engine is None:
+            engine = _engines[config.scoring_rules] = ScoringEngine(
+                ScoringRules(config.scoring_rules))
+        return engine
@@ -0,0 +1,113 @@
+# -*- coding: UTF-8 -*-
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+
+from .settings import LOGGER_NAME, SESSION_CACHE_MAX_AGE_HOURS
+
+
+class SessionCache:
+    u"""
+    Хранит на диске состояние авторизованных сессий (cookies, csrf_token и
+    ссылки на операции API), чтобы после перезапуска клиент не проходил
+    аутентификацию заново. Для каждого аккаунта - отдельный файл, доступный
+    только владельцу; запись атомарная (временный файл + os.replace), поэтому
+    файл не окажется поврежденным при падении процесса во время записи.
+    Возраст сессии считается по времени изменения файла: пока сессия
+    используется, время обновляется каждый ход, даже если состояние не
+    изменилось.
+    """
+    def __init__(self, directory,
+                 max_age_hours=SESSION_CACHE_MAX_AGE_HOURS, logger=None):
+        u"""
+        :param directory: каталог для файлов сессий (Config.session_cache_dir),
+            пустое значение отключает сохранение
+        """
+        self.directory = directory
+        self.max_age = max_age_hours * 3600
+        self.logger = logger or logging.getLogger(LOGGER_NAME)
+        self._saved = {}
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def get_path(self, account):
+        name = re.sub(r'[^\w.@-]', '_', account.name)
+        return os.path.join(self.directory, '{}.json'.format(name))
+
+    def load(self, account):
+        u"""
+        Возвращает сохраненное состояние сессии аккаунта или None, если его
+        нет, оно устарело или сохранено для другого логина
+
+        :return: dict (см. Client.dump_state)
+        """
+        if not self.enabled:
+            return None
+        path = self.get_path(account)
+        try:
+            with open(path) as f:
+                modified = os.fstat(f.fileno()).st_mtime
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            self.logger.warning(
+                u"Не удалось прочитать сохраненную сессию {}: {}".format(
+                    path, e))
+            return None
+        if data.get('login') != account.login:
+            return None
+        if time.time() - modified > self.max_age:
+            self.logger.info(u"Сохраненная сессия устарела")
+            return None
+        return data.get('state')
+
+    def save(self, account, state):
+        u"""
+        Сохраняет состояние сессии, если оно изменилось с последней записи,
+        иначе только обновляет время изменения файла
+        """
+        if not self.enabled:
+            return
+        path = self.get_path(account)
+        if self._saved.get(account.name) == state:
+            try:
+                os.utime(path)
+                return
+            except OSError:
+                # файл удален или недоступен - записываем заново
+                pass
+        data = {'login': account.login, 'saved': time.time(), 'state': state}
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            # mkstemp создает файл с правами 0600
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory,
+                                            suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(data, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            self.logger.warning(
+                u"Не удалось сохранить сессию {}: {}".format(path, e))
+            return
+        self._saved[account.name] = state
+
+    def delete(self, account):
+        if not self.enabled:
+            return
+        self._saved.pop(account.name, None)
+        try:
+            os.unlink(self.get_path(account))
+        except FileNotFoundError:
+            pass
@@ -1,39 +1,321 @@
 # -*- coding: UTF-8 -*-
 import argparse
+import collections
 import configparser
+import copy
 import os
 
 
 CONFIG_FILE = 'sfpy.conf'
 ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
 
-parser = argparse.ArgumentParser()
-parser.add_argument('--config-file', default=CONFIG_FILE,
-                    type=argparse.FileType('r'))
-args = parser.parse_args()
+ACCOUNT_SECTION_PREFIX = 'Account '
+
+Account = collections.namedtuple(
+    'Account', ['name', 'page', 'login', 'domain', 'password', 'user_agent',
+                'check_url'])
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config-file', default=CONFIG_FILE,
+                        type=argparse.FileType('r'))
+    parser.add_argument('--workers', type=int, default=None,
+                        help=u"количество процессов для supervisor.py")
+    return parser
+
+
+def _get_account(conf, section, name):
+    u"""
+    Читает данные аккаунта из секции конфига. Незаполненные параметры берутся
+    из секции [Auth]
+    """
+    def get(option):
+        return conf.get(section, option,
+                        fallback=conf.get('Auth', option, fallback=None))
+
+    account = Account(name=name or get('Login'), page=get('Page'),
+                      login=get('Login'), domain=get('Domain'),
+                      password=get('Password'), user_agent=get('UserAgent'),
+                      check_url=get('Check_URL'))
+    if not all([account.login, account.domain, account.password,
+                account.page]):
+        raise RuntimeError(
+            u"Не указаны данные для подключения: {}".format(section))
+    return account
+
+
+def get_accounts(conf):
+    u"""
+    Возвращает список аккаунтов из конфига. Каждый аккаунт описывается
+    секцией вида [Account имя], если таких секций нет - используется
+    единственный аккаунт из секции [Auth]
+
+    :return: list of Account
+    """
+    accounts = [
+        _get_account(conf, section, section[len(ACCOUNT_SECTION_PREFIX):])
+        for section in conf.sections()
+        if section.startswith(ACCOUNT_SECTION_PREFIX)
+    ]
+    if not accounts:
+        accounts.append(_get_account(conf, 'Auth', None))
+    return accounts
+
+
+def get_mission_priority(value):
+    u"""
+    Разбирает порядок категорий миссий из строки через запятую, категории
+    не из MISSION_PRIORITY не допускаются
+
+    :return: tuple или None, если порядок не задан
+    """
+    if not value:
+        return None
+    priority = tuple(c.strip().lower() for c in value.split(',')
+                     if c.strip())
+    unknown = set(priority) - set(MISSION_PRIORITY)
+    if unknown:
+        raise RuntimeError(u"Неизвестные категории миссий: {}".format(
+            ', '.join(sorted(unknown))))
+    return priority
+
+
+class Config:
+    u"""
+    Настройки, зависящие от командной строки и конфигурационного файла.
+    Создается один раз при запуске (см. Config.from_args) и передается в
+    Client/MultiClient/Supervisor; объект можно передать в рабочий процесс.
+    """
+    def __init__(self, conf, workers=None):
+        self.accounts = get_accounts(conf)
+        # url healthchecks для аккаунтов без собственного Check_URL
+        self.check_url = conf.get('Admin', 'Check_URL', fallback=None)
+        # адреса портала и сервера аутентификации
+        self.portal_url = conf.get(
+            'Server', 'Portal', fallback=PORTAL_URL).rstrip('/')
+        self.auth_url = conf.get('Server', 'Auth', fallback=AUTH_URL)
+        # дополнительный получатель heartbeat: file:///path или unix:///path
+        self.heartbeat = conf.get('Admin', 'Heartbeat', fallback=None)
+        # каталог для сохранения сессий между перезапусками, пустое
+        # значение отключает сохранение
+        self.session_cache_dir = conf.get(
+            'Auth', 'SessionCacheDir',
+            fallback=os.path.join(ROOT, '.sessions'))
+        # стратегия распределения адептов по миссиям: greedy (по
+        # умолчанию), assignment или lookahead
+        self.planner = conf.get('Game', 'Planner', fallback='greedy')
+        # горизонт планирования стратегии lookahead, минут
+        self.lookahead_horizon = conf.getint(
+            'Game', 'LookaheadHorizon', fallback=LOOKAHEAD_HORIZON_MINUTES)
+        # интервал опроса сервера, если нет ближайших прогрессов, минут
+        self.idle_minutes = conf.getfloat(
+            'Game', 'IdleMinutes', fallback=MAX_IDLE_MINUTES)
+        # как часто загружать состояние, если его можно спрогнозировать,
+        # секунд (0 - каждый ход)
+        self.sync_interval = conf.getint(
+            'Game', 'SyncInterval', fallback=STATE_SYNC_INTERVAL_SECONDS)
+        # порядок категорий миссий по приоритету, через запятую
+        self.mission_priority = get_mission_priority(
+            conf.get('Game', 'MissionPriority', fallback=None))
+        # правила оценки миссий (см. scoring.py): признак = вес
+        self.scoring_rules = tuple(
+            (name, conf.getfloat('Scoring', name))
+            for name in conf.options('Scoring')
+        ) if conf.has_section('Scoring') else ()
+        # ограничение запросов в секунду для аккаунта и общее для всех
+        # процессов клиента (0 - без ограничения, по умолчанию), файл с
+        # состоянием общего ограничения
+        self.rate_limit_account = conf.getfloat(
+            'RateLimit', 'Account', fallback=0.0)
+        self.rate_limit_global = conf.getfloat(
+            'RateLimit', 'Global', fallback=0.0)
+        self.rate_limit_file = os.path.expanduser(conf.get(
+            'RateLimit', 'StateFile', fallback=os.path.join(
+                os.environ.get('XDG_CACHE_HOME') or '~/.cache', 'sfpy',
+                'ratelimit.json')))
+        # HTTP: количество пулов соединений (по хостам), соединений в пуле,
+        # таймауты установки соединения и чтения ответа, секунд
+        self.http_pool_connections = conf.getint(
+            'HTTP', 'PoolConnections', fallback=HTTP_POOL_CONNECTIONS)
+        self.http_pool_maxsize = conf.getint(
+            'HTTP', 'PoolMaxSize', fallback=HTTP_POOL_MAXSIZE)
+        self.http_timeout = (
+            conf.getfloat('HTTP', 'ConnectTimeout',
+                          fallback=HTTP_CONNECT_TIMEOUT_SECONDS),
+            conf.getfloat('HTTP', 'ReadTimeout',
+                          fallback=HTTP_READ_TIMEOUT_SECONDS))
+        # метрики: порт http на 127.0.0.1 и/или файл, который обновляется
+        # после каждого хода (пустые значения отключают экспорт)
+        self.metrics_port = conf.getint('Metrics', 'Port', fallback=None)
+        self.metrics_file = conf.get('Metrics', 'File', fallback=None)
+        # профилирование ходов (см. profiling.py): включено при запуске,
+        # каталог профилей, количество хранимых профилей и учет памяти
+        self.profile_enabled = conf.getboolean(
+            'Profile', 'Enabled', fallback=False)
+        self.profile_dir = conf.get(
+            'Profile', 'Directory', fallback=os.path.join(ROOT, 'profiles'))
+        self.profile_keep = max(1, conf.getint(
+            'Profile', 'Keep', fallback=PROFILE_KEEP_FILES))
+        self.profile_memory = conf.getboolean(
+            'Profile', 'Tracemalloc', fallback=False)
+        # запись запросов к API в журнал и воспроизведение журнала вместо
+        # сервера (см. recording.py); Speed - ускорение относительно
+        # исходных интервалов между запросами, 0 - без ожидания
+        self.record_file = conf.get('Recording', 'Record', fallback=None)
+        self.replay_file = conf.get('Recording', 'Replay', fallback=None)
+        self.replay_speed = conf.getfloat('Recording', 'Speed', fallback=0.0)
+        if self.replay_file:
+            # при воспроизведении сохраненные сессии не используются и не
+            # перезаписываются, ограничение частоты запросов не нужно;
+            # время прогрессов в записи не совпадает с текущим, поэтому
+            # состояние загружается каждый ход
+            self.session_cache_dir = ''
+            self.rate_limit_account = self.rate_limit_global = 0
+            self.sync_interval = 0
+        self.workers = workers
+
+    def for_worker(self, worker_id):
+        u"""
+        Копия настроек для рабочего процесса supervisor.py: у каждого
+        процесса свой порт (Port + номер процесса) и файл метрик
+        """
+        config = copy.copy(self)
+        if self.metrics_port:
+            config.metrics_port = self.metrics_port + worker_id
+        if self.metrics_file:
+            config.metrics_file = '{}.{}'.format(self.metrics_file, worker_id)
+        return config
+
+    @classmethod
+    def from_file(cls, config_file, workers=None):
+        u"""
+        :param config_file: путь к файлу или открытый файл
+        """
+        conf = configparser.ConfigParser()
+        if isinstance(config_file, str):
+            with open(config_file) as f:
+                conf.read_file(f)
+        else:
+            conf.read_file(config_file)
+        return cls(conf, workers)
+
+    @classmethod
+    def from_args(cls, argv=None):
+        args = get_parser().parse_args(argv)
+        with args.config_file:
+            return cls.from_file(args.config_file, args.workers)
+
+_config = None
 
 
 def get_config():
-    conf = configparser.ConfigParser()
-    conf.read_file(args.config_file)
-    return conf
+    u"""
+    Возвращает настройки процесса. Если они не были заданы через
+    set_config, читаются из командной строки при первом обращении
+    """
+    global _config
+    if _config is None:
+        _config = Config.from_args()
+    return _config
 
-config = get_config()
 
-PAGE = config.get('Auth', 'Page')
-USERNAME = config.get('Auth', 'Login')
-DOMAIN = config.get('Auth', 'Domain')
-PASSWORD = config.get('Auth', 'Password')
-USER_AGENT = config.get('Auth', 'UserAgent', fallback=None)
+def set_config(config):
+    global _config
+    _config = config
+    return config
 
 LOGGER_NAME = 'sf-logger'
-CHECK_URL = config.get('Admin', 'Check_URL', fallback=None)
 
-NEXT_REQUEST_DELAY_MINUTES = 6
-AUTH_RETRY_DELAY_SECONDS = 60
+# максимальное время простоя между запросами, если нет ближайших прогрессов
+# (по умолчанию, см. параметр IdleMinutes секции [Game]): как и прежний
+# интервал опроса, чтобы новые миссии не ждали дольше
+MAX_IDLE_MINUTES = 6
+# задержка после окончания прогресса и случайное смещение к ней
+DEADLINE_DELAY_SECONDS = 5
+DEADLINE_JITTER_SECONDS = 25
+MIN_REQUEST_DELAY_SECONDS = 20
+# прогрессы, не завершенные сервером спустя это время, не учитываются
+MAX_OVERDUE_SECONDS = 600
+# повторные запросы: начальная и максимальная задержка (decorrelated
+# jitter) и общее время на запрос к API, после которого действие считается
+# неудачным; данные HeroBag и аутентификация повторяются без ограничения
+RETRY_BASE_DELAY_SECONDS = 1
+RETRY_MAX_DELAY_SECONDS = 60
+API_REQUEST_DEADLINE_SECONDS = 120
+HERO_BAG_RETRY_MAX_DELAY_SECONDS = 300
+AUTH_RETRY_BASE_DELAY_SECONDS = 5
+AUTH_RETRY_MAX_DELAY_SECONDS = 300
+# после CIRCUIT_BREAKER_FAILURES ошибок подряд запросы к серверу
+# приостанавливаются на CIRCUIT_BREAKER_RESET_SECONDS для всех аккаунтов
+CIRCUIT_BREAKER_FAILURES = 5
+CIRCUIT_BREAKER_RESET_SECONDS = 30
+# HTTP по умолчанию (см. секцию [HTTP]): количество пулов соединений (по
+# хостам) и соединений в пуле, таймауты установки соединения и чтения ответа
+HTTP_POOL_CONNECTIONS = 4
+HTTP_POOL_MAXSIZE = 8
+HTTP_CONNECT_TIMEOUT_SECONDS = 5
+HTTP_READ_TIMEOUT_SECONDS = 20
+# heartbeat: таймаут запроса к healthchecks и размер очереди событий
+HEALTHCHECK_TIMEOUT_SECONDS = 10
+HEARTBEAT_QUEUE_SIZE = 100
+# емкость бакетов ограничения запросов: сколько секунд лимита можно
+# израсходовать разом
+RATE_LIMIT_BURST_SECONDS = 5
+# границы интервалов гистограмм метрик: длительность запроса к API и хода
+METRICS_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20)
+METRICS_DURATION_BUCKETS = (1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# профилирование ходов: количество хранимых профилей по умолчанию,
+# строк cProfile и tracemalloc в отчете и глубина стека tracemalloc
+PROFILE_KEEP_FILES = 20
+PROFILE_STATS_LINES = 40
+PROFILE_MEMORY_LINES = 20
+PROFILE_TRACEMALLOC_FRAMES = 1
+# журнал запросов к API (см. recording.py): степень сжатия gzip и размер
+# блока при чтении журнала
+RECORDING_COMPRESS_LEVEL = 6
+RECORDING_READ_CHUNK = 1024 * 1024
+# срок, после которого сохраненная сессия не используется
+SESSION_CACHE_MAX_AGE_HOURS = 72
+# задержка перед перезапуском аккаунта, завершившегося с ошибкой
+ACCOUNT_RESTART_DELAY_SECONDS = 60
 
-HERO_BAG_URL = 'https://portal.sf.mail.ru/cult/HeroBag:loadData'
+# перезапуск рабочих процессов supervisor.py: начальная и максимальная
+# задержка, количество перезапусков, после которого аккаунты процесса
+# передаются другим процессам, и время работы, после которого счетчик
+# перезапусков сбрасывается
+WORKER_RESTART_DELAY_SECONDS = 5
+WORKER_MAX_RESTART_DELAY_SECONDS = 300
+WORKER_MAX_RESTARTS = 5
+WORKER_STABLE_SECONDS = 600
+WORKER_STATUS_INTERVAL_SECONDS = 60
 
+# бонус за подходящую профессию относительно максимальной эффективности и
+# количество кандидатов на одно место миссии при глобальном распределении
+ASSIGNMENT_PROFESSION_BONUS = 0.5
+ASSIGNMENT_CANDIDATE_FACTOR = 4
+# горизонт планирования стратегии lookahead (минут), количество
+# рассматриваемых моментов освобождения адептов и минимальный
+# относительный выигрыш, при котором миссия откладывается
+LOOKAHEAD_HORIZON_MINUTES = 60
+LOOKAHEAD_MAX_RELEASES = 8
+LOOKAHEAD_MIN_GAIN = 0.1
+# категории миссий в порядке приоритета по умолчанию, для каждой у
+# MissionManager есть метод <категория>_missions
+MISSION_PRIORITY = ('case', 'mining', 'invasion', 'cult')
+# ограничения на количество проходов обработки и запросов к API за ход
+MAX_PROCESS_PASSES = 10
+MAX_ACTIONS_PER_TURN = 100
+# количество одновременных запросов при завершении прогрессов
+FINISH_PROGRESS_CONCURRENCY = 4
+# как часто загружать состояние (HeroBag), если его можно спрогнозировать
+# по ответам на действия, секунд
+STATE_SYNC_INTERVAL_SECONDS = 600
 
-if not all([USERNAME, DOMAIN, PASSWORD, PAGE]):
-    raise RuntimeError(u"Не указаны данные для подключения")
+# адреса портала и сервера аутентификации по умолчанию (задаются в секции
+# [Server], например, для benchmarks/mockportal.py) и пути на портале
+PORTAL_URL = 'https://portal.sf.mail.ru'
+AUTH_URL = 'https://auth.mail.ru/cgi-bin/auth'
+PORTAL_PAGE_PATH = '/skyforgenews'
+MISSIONS_PAGE_PATH = '/cult/missions'
+HERO_BAG_PATH = '/cult/HeroBag:loadData'
@@ -1,39 +1,333 @@
 # -*- coding: UTF-8 -*-
+import asyncio
+import concurrent.futures
 import logging
+import threading
 import time
-import random
 
-from .settings import LOGGER_NAME, NEXT_REQUEST_DELAY_MINUTES
-from .auth import Session
-from .gamedata import Game
+from .settings import LOGGER_NAME, ACCOUNT_RESTART_DELAY_SECONDS, \
+    get_config
+from .assignment import get_planner
+from .auth import Session, AsyncSession, AuthError
+from .gamedata import Game, AsyncGame
+from .heartbeat import Heartbeat, TurnReporter
+from .logger import get_logger
+from .metrics import get_exporter, record_followers
+from .profiling import NULL_PROFILE, get_profiler
+from .ratelimit import create_rate_limiter
+from .recording import ReplayFinished
+from .scheduler import Scheduler
+from .scoring import get_scoring
+from .sessioncache import SessionCache
+from .transport import format_stats
 
 
 class Client:
-    def __init__(self):
-        self.session = Session()
+    def __init__(self, config=None):
+        u"""
+        :param config: settings.Config, по умолчанию - настройки из
+            командной строки
+        """
+        self.config = config or get_config()
         self.logger = logging.getLogger(LOGGER_NAME)
-        self.game = Game()
+        self.session = Session(
+            self.config.accounts[0], self.logger,
+            create_rate_limiter(self.config, self.logger), self.config)
+        self.game = Game(self.logger,
+                         get_planner(self.config.planner, self.config),
+                         self.config.mission_priority,
+                         get_scoring(self.config),
+                         self.config.sync_interval)
+        self.scheduler = Scheduler(self.config.idle_minutes)
+        self.session_cache = SessionCache(self.config.session_cache_dir,
+                                          logger=self.logger)
+        self.turn_reporter = TurnReporter(
+            Heartbeat.from_config(self.config, self.logger),
+            self.session.account.name)
+        self.metrics = get_exporter(self.config, self.logger)
+        self.profiler = get_profiler(self.config, self.logger)
 
     def run(self):
         self.logger.info(u"Запускается консольный клиент SkyForge")
-        self.session.start()
-        self.game.start(self.session)
+        if not self.restore_session(
+                self.session_cache.load(self.session.account)):
+            self.session.start()
+        self.play(self.game.start, self.session)
+        self.save_session()
+        self.log_transport_stats()
+        self.export_metrics()
         while True:
             next_request_delay = self._get_next_request_time()
             self.logger.info(u"До следующего запроса {} "
                              u"секунд".format(next_request_delay))
             time.sleep(next_request_delay)
-            self.game.turn()
+            self.play(self.game.turn)
+            self.save_session()
+            self.log_transport_stats()
+            self.export_metrics()
 
-    @staticmethod
-    def _get_next_request_time():
+    def play(self, func, *args):
         u"""
-        Вычисляет время до следующего запроса. Выбирается случайное число в
-        диапазоне +- 25% от заданного в настройках
+        Выполняет ход и отправляет в heartbeat его начало, результат и
+        длительность. Если включено профилирование, записывает профиль хода
+        """
+        self.turn_reporter.start()
+        self.game.profile = self.profiler.begin_turn(self.session.account.name)
+        try:
+            func(*args)
+        except Exception as e:
+            self.turn_reporter.fail(e)
+            raise
+        finally:
+            self.finish_profile()
+        self.turn_reporter.success()
+
+    def finish_profile(self):
+        profile, self.game.profile = self.game.profile, NULL_PROFILE
+        profile.finish()
+
+    def restore_session(self, state):
+        u"""
+        Восстанавливает сессию и ссылки API из сохраненного состояния (см.
+        dump_state). Отдельной проверки сессии нет: ее проверяет первый
+        запрос HeroBag, который нужен для загрузки данных в любом случае, а
+        при ошибке авторизации APIManager выполнит полную аутентификацию.
+
+        :return: True, если сессия восстановлена
+        """
+        if not state or not state['cookies'].get('csrf_token'):
+            return False
+        self.logger.info(u"Используем сохраненную сессию")
+        self.session.load_state(state)
+        self.game.api.urls.load(state.get('links'))
+        return True
+
+    def dump_state(self):
+        u"""
+        :return: dict состояние сессии (см. Session.dump_state) вместе со
+            ссылками на операции API
+        """
+        state = self.session.dump_state()
+        state['links'] = self.game.api.urls.dump()
+        return state
+
+    def save_session(self):
+        self.session_cache.save(self.session.account, self.dump_state())
+
+    def log_transport_stats(self):
+        u"""
+        Выводит статистику транспорта за ход и сбрасывает ее
+        """
+        self.logger.info(u"За ход: {}".format(
+            format_stats(self.session.transport_stats.pop())))
+
+    def export_metrics(self):
+        u"""
+        Обновляет метрики адептов после хода и записывает метрики в файл
+        """
+        record_followers(self.session.account.name,
+                         self.game.follower_manager)
+        self.metrics.dump()
+
+    def _get_next_request_time(self):
+        u"""
+        Вычисляет время до следующего запроса по ближайшему окончанию
+        прогресса, см. Scheduler.next_delay
 
         :return: seconds, int
         """
-        seconds = NEXT_REQUEST_DELAY_MINUTES * 60
-        delay_range_start = seconds - int(seconds * 0.25)
-        delay_range_end = seconds + int(seconds * 0.25)
-        return random.randint(delay_range_start, delay_range_end)
+        self.scheduler.update(self.game.progress_manager.get_end_times())
+        return self.scheduler.next_delay()
+
+
+class AsyncClient(Client):
+    u"""
+    Клиент для одного аккаунта, работающий в общем event loop. Если передано
+    сохраненное состояние сессии (см. Client.dump_state) или оно есть в
+    кэше на диске, аутентификация пропускается; при ошибке авторизации
+    сессия будет создана заново.
+    """
+    def __init__(self, account, executor, session_state=None, on_turn=None,
+                 session_cache=None, config=None, heartbeat=None):
+        self.config = config or get_config()
+        self.account = account
+        self.logger = get_logger(LOGGER_NAME, account.name)
+        self.session = AsyncSession(
+            account, executor, self.logger,
+            create_rate_limiter(self.config, self.logger), self.config)
+        self.game = AsyncGame(self.logger,
+                              get_planner(self.config.planner, self.config),
+                              self.config.mission_priority,
+                              get_scoring(self.config),
+                              self.config.sync_interval)
+        self.scheduler = Scheduler(self.config.idle_minutes)
+        self.session_state = session_state
+        self.on_turn = on_turn
+        self.session_cache = session_cache or SessionCache(
+            self.config.session_cache_dir, logger=self.logger)
+        self.turn_reporter = TurnReporter(
+            heartbeat or Heartbeat.from_config(self.config, self.logger),
+            account.name)
+        self.metrics = get_exporter(self.config, self.logger)
+        self.profiler = get_profiler(self.config, self.logger)
+
+    async def run(self):
+        self.logger.info(u"Запускается клиент для аккаунта {}".format(
+            self.account.login))
+        if not self.restore_session(
+                self.session_state or self.session_cache.load(self.account)):
+            await self.session.start()
+        await self.play(self.game.start, self.session)
+        self.save_session()
+        self.log_transport_stats()
+        self.export_metrics()
+        self._report_turn()
+        while True:
+            next_request_delay = self._get_next_request_time()
+            self.logger.info(u"До следующего запроса {} "
+                             u"секунд".format(next_request_delay))
+            await asyncio.sleep(next_request_delay)
+            await self.play(self.game.turn)
+            self.save_session()
+            self.log_transport_stats()
+            self.export_metrics()
+            self._report_turn()
+
+    async def play(self, func, *args):
+        self.turn_reporter.start()
+        self.game.profile = self.profiler.begin_turn(self.account.name)
+        try:
+            await func(*args)
+        except Exception as e:
+            self.turn_reporter.fail(e)
+            raise
+        finally:
+            self.finish_profile()
+        self.turn_reporter.success()
+
+    def _report_turn(self):
+        if self.on_turn:
+            self.on_turn(self)
+
+
+class MultiClient:
+    u"""
+    Запускает клиенты для нескольких аккаунтов в одном процессе. Ошибка
+    в одном аккаунте не останавливает остальные: клиент перезапускается
+    через ACCOUNT_RESTART_DELAY_SECONDS, а при неверных учетных данных
+    аккаунт отключается.
+
+    При запуске из supervisor.py состояние аккаунтов отправляется в
+    status_queue, а новые аккаунты принимаются из command_queue.
+    """
+    STATUS_OK = 'ok'
+    STATUS_ERROR = 'error'
+    STATUS_DISABLED = 'disabled'
+
+    COMMAND_ADD = 'add'
+    COMMAND_STOP = 'stop'
+
+    def __init__(self, accounts=None, session_states=None,
+                 status_queue=None, command_queue=None, config=None):
+        self.config = config or get_config()
+        self.accounts = list(accounts or self.config.accounts)
+        self.session_states = dict(session_states or {})
+        self.status_queue = status_queue
+        self.command_queue = command_queue
+        self.logger = logging.getLogger(LOGGER_NAME)
+        # supervisor может передать аккаунты упавшего процесса (COMMAND_ADD),
+        # поэтому пул рассчитан на все аккаунты из настроек; потоки
+        # создаются по мере необходимости
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(len(self.accounts),
+                            len(self.config.accounts)) * 2)
+        self.session_cache = SessionCache(self.config.session_cache_dir,
+                                          logger=self.logger)
+        self.heartbeat = Heartbeat.from_config(self.config, self.logger)
+        self.tasks = {}
+
+    def run(self):
+        self.logger.info(u"Запускается консольный клиент SkyForge, "
+                         u"аккаунтов: {}".format(len(self.accounts)))
+        try:
+            asyncio.run(self.run_all())
+        finally:
+            self.executor.shutdown(wait=False)
+
+    async def run_all(self):
+        for account in self.accounts:
+            self.add_account(account, self.session_states.get(account.name))
+        if self.command_queue is not None:
+            await self.process_commands()
+        else:
+            await asyncio.gather(*self.tasks.values())
+
+    def add_account(self, account, session_state=None):
+        self.tasks[account.name] = asyncio.ensure_future(
+            self.run_account(account, session_state))
+
+    async def process_commands(self):
+        u"""
+        Читает команды supervisor'а в отдельном daemon-потоке, чтобы
+        заблокированное чтение очереди не мешало завершению процесса
+        """
+        loop = asyncio.get_event_loop()
+        commands = asyncio.Queue()
+
+        def read_commands():
+            while True:
+                item = self.command_queue.get()
+                loop.call_soon_threadsafe(commands.put_nowait, item)
+
+        threading.Thread(target=read_commands, daemon=True).start()
+        while True:
+            command, args = await commands.get()
+            if command == self.COMMAND_ADD:
+                account, session_state = args
+                self.logger.info(u"Получен аккаунт {}".format(account.name))
+                self.add_account(account, session_state)
+            elif command == self.COMMAND_STOP:
+                for task in self.tasks.values():
+                    task.cancel()
+                return
+
+    async def run_account(self, account, session_state=None):
+        while True:
+            client = AsyncClient(account, self.executor, session_state,
+                                 on_turn=self.report_turn,
+                                 session_cache=self.session_cache,
+                                 config=self.config,
+                                 heartbeat=self.heartbeat)
+            try:
+                await client.run()
+            except AuthError:
+                client.logger.critical(u"Ошибка аутентификации на сервере, "
+                                       u"аккаунт отключен")
+                self.session_cache.delete(account)
+                self.report(account, self.STATUS_DISABLED)
+                return
+            except ReplayFinished:
+                client.logger.info(u"Запись воспроизведена")
+                return
+            except Exception as e:
+                client.logger.exception(
+                    u"Ошибка в работе клиента, перезапуск через {} "
+                    u"секунд".format(ACCOUNT_RESTART_DELAY_SECONDS))
+                self.report(account, self.STATUS_ERROR, error=repr(e))
+            session_state = client.dump_state()
+            await asyncio.sleep(ACCOUNT_RESTART_DELAY_SECONDS)
+
+    def report_turn(self, client):
+        self.report(client.account, self.STATUS_OK,
+                    session_state=client.dump_state())
+
+    def report(self, account, status, session_state=None, error=None):
+        if self.status_queue is None:
+            return
+        self.status_queue.put({
+            'account': account.name,
+            'status': status,
+            'session_state': session_state,
+            'error': error,
+            'time': time.time(),
+        })
@@ -0,0 +1,220 @@
+# -*- coding: UTF-8 -*-
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+
+from .settings import LOGGER_NAME, get_config, set_config, \
+    WORKER_RESTART_DELAY_SECONDS, WORKER_MAX_RESTART_DELAY_SECONDS, \
+    WORKER_MAX_RESTARTS, WORKER_STABLE_SECONDS, \
+    WORKER_STATUS_INTERVAL_SECONDS
+from .logger import configure_logger
+from .profiling import PROFILE_SIGNAL
+from .sfclient import MultiClient
+
+
+def run_worker(worker_id, accounts, session_states, status_queue,
+               command_queue, config):
+    u"""
+    Точка входа рабочего процесса: запускает MultiClient для своей части
+    аккаунтов
+    """
+    configure_logger(LOGGER_NAME)
+    if PROFILE_SIGNAL is not None:
+        # обработчик supervisor'а унаследован при fork, до создания
+        # клиента сигнал профилирования игнорируется
+        signal.signal(PROFILE_SIGNAL, signal.SIG_IGN)
+    config = set_config(config.for_worker(worker_id))
+    client = MultiClient(accounts, session_states, status_queue,
+                         command_queue, config)
+    try:
+        client.run()
+    except KeyboardInterrupt:
+        pass
+
+
+class Worker:
+    def __init__(self, worker_id, accounts):
+        self.id = worker_id
+        self.accounts = list(accounts)
+        self.process = None
+        self.command_queue = None
+        self.started_at = None
+        self.restarts = 0
+        self.restart_at = None
+        self.retired = False
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+
+class Supervisor:
+    u"""
+    Распределяет аккаунты по нескольким рабочим процессам, каждый из которых
+    обслуживает свою часть аккаунтов в собственном event loop (MultiClient).
+
+    Упавший процесс перезапускается с экспоненциально растущей задержкой,
+    аккаунты при этом получают последнее известное состояние сессии и не
+    проходят повторную аутентификацию. Если процесс падает больше
+    WORKER_MAX_RESTARTS раз подряд, его аккаунты передаются наименее
+    загруженным из работающих процессов.
+    """
+    def __init__(self, config=None, accounts=None, workers=None):
+        self.config = config or get_config()
+        self.logger = logging.getLogger(LOGGER_NAME)
+        self.accounts = {a.name: a for a in (accounts or
+                                             self.config.accounts)}
+        workers = workers or self.config.workers or os.cpu_count() or 1
+        workers = max(1, min(workers, len(self.accounts)))
+        names = list(self.accounts)
+        self.workers = [
+            Worker(i, [self.accounts[n] for n in names[i::workers]])
+            for i in range(workers)
+        ]
+        self.status_queue = multiprocessing.Queue()
+        self.statuses = {}
+        self.session_states = {}
+        self.last_status_log = time.time()
+
+    def run(self):
+        self.logger.info(u"Запускается supervisor: аккаунтов {}, "
+                         u"процессов {}".format(len(self.accounts),
+                                                len(self.workers)))
+        if PROFILE_SIGNAL is not None:
+            signal.signal(PROFILE_SIGNAL, self.forward_signal)
+        for worker in self.workers:
+            self.start_worker(worker)
+        try:
+            while True:
+                self.collect_statuses(timeout=1)
+                self.check_workers()
+                if (time.time() - self.last_status_log >
+                        WORKER_STATUS_INTERVAL_SECONDS):
+                    self.log_status()
+        finally:
+            self.stop()
+
+    def start_worker(self, worker):
+        session_states = {a.name: self.session_states.get(a.name)
+                          for a in worker.accounts}
+        worker.command_queue = multiprocessing.Queue()
+        worker.process = multiprocessing.Process(
+            target=run_worker, name='sf-worker-{}'.format(worker.id),
+            args=(worker.id, worker.accounts, session_states,
+                  self.status_queue, worker.command_queue, self.config))
+        worker.process.start()
+        worker.started_at = time.time()
+        worker.restart_at = None
+        self.logger.info(u"Запущен процесс {} (pid {}), аккаунты: {}".format(
+            worker.id, worker.process.pid,
+            ', '.join(a.name for a in worker.accounts)))
+
+    def forward_signal(self, signum, frame):
+        u"""
+        Передает сигнал (переключение профилирования) рабочим процессам
+        """
+        for worker in self.workers:
+            if worker.is_alive():
+                os.kill(worker.process.pid, signum)
+
+    def stop(self):
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.command_queue.put((MultiClient.COMMAND_STOP, None))
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.join(timeout=5)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+
+    def collect_statuses(self, timeout):
+        u"""
+        Принимает сообщения о состоянии аккаунтов от рабочих процессов и
+        запоминает последнее состояние сессии каждого аккаунта
+        """
+        try:
+            status = self.status_queue.get(timeout=timeout)
+        except queue.Empty:
+            return
+        while status is not None:
+            self.statuses[status['account']] = status
+            if status['session_state']:
+                self.session_states[status['account']] = \
+                    status['session_state']
+            try:
+                status = self.status_queue.get_nowait()
+            except queue.Empty:
+                status = None
+
+    def check_workers(self):
+        now = time.time()
+        for worker in self.workers:
+            if worker.retired or worker.is_alive():
+                continue
+            if worker.restart_at is None:
+                self._schedule_restart(worker, now)
+            elif now >= worker.restart_at:
+                self.start_worker(worker)
+
+    def _schedule_restart(self, worker, now):
+        if now - worker.started_at > WORKER_STABLE_SECONDS:
+            worker.restarts = 0
+        worker.restarts += 1
+        self.logger.error(u"Процесс {} завершился с кодом {}".format(
+            worker.id, worker.process.exitcode))
+        if worker.restarts > WORKER_MAX_RESTARTS:
+            self.retire(worker)
+            return
+        delay = min(
+            WORKER_RESTART_DELAY_SECONDS * 2 ** (worker.restarts - 1),
+            WORKER_MAX_RESTART_DELAY_SECONDS)
+        self.logger.info(u"Перезапуск процесса {} через {} секунд".format(
+            worker.id, delay))
+        worker.restart_at = now + delay
+
+    def retire(self, worker):
+        u"""
+        Отключает постоянно падающий процесс и передает его аккаунты вместе
+        с состоянием сессий работающим процессам
+        """
+        worker.retired = True
+        alive = [w for w in self.workers if w.is_alive()]
+        if not alive:
+            self.logger.critical(
+                u"Процесс {} отключен, нет работающих процессов для "
+                u"аккаунтов: {}".format(
+                    worker.id, ', '.join(a.name for a in worker.accounts)))
+            return
+        for account in worker.accounts:
+            target = min(alive, key=lambda w: len(w.accounts))
+            self.logger.warning(u"Аккаунт {} передается процессу {}".format(
+                account.name, target.id))
+            target.accounts.append(account)
+            target.command_queue.put((
+                MultiClient.COMMAND_ADD,
+                (account, self.session_states.get(account.name))))
+        worker.accounts = []
+
+    def log_status(self):
+        self.last_status_log = time.time()
+        for worker in self.workers:
+            if worker.retired:
+                state = u"отключен"
+            elif worker.is_alive():
+                state = u"работает, pid {}".format(worker.process.pid)
+            else:
+                state = u"ожидает перезапуска"
+            self.logger.info(u"Процесс {}: {}, перезапусков {}".format(
+                worker.id, state, worker.restarts))
+            for account in worker.accounts:
+                status = self.statuses.get(account.name)
+                if status is None:
+                    self.logger.info(u"  {}: нет данных".format(account.name))
+                    continue
+                self.logger.info(u"  {}: {}, {} секунд назад{}".format(
+                    account.name, status['status'],
+                    int(self.last_status_log - status['time']),
+                    u", {}".format(status['error']) if status['error']
+                    else u""))
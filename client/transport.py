@@ -0,0 +1,130 @@
+# -*- coding: UTF-8 -*-
+u"""
+Настройка HTTP-транспорта: пул keep-alive соединений, сжатие ответов и
+учет новых соединений (для https - TLS handshake) и полученных байт.
+"""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from .settings import HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE
+
+DEFAULT_HEADERS = {
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive',
+}
+
+
+class TransportStats:
+    u"""
+    Счетчики транспорта сессии: запросы, новые соединения, байты по сети
+    (до распаковки) и после распаковки. Обновляются из потоков executor'а.
+    """
+    FIELDS = ('requests', 'connections', 'wire_bytes', 'content_bytes')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            for field in self.FIELDS:
+                setattr(self, field, 0)
+
+    def add(self, **values):
+        with self._lock:
+            for field, value in values.items():
+                setattr(self, field, getattr(self, field) + value)
+
+    def pop(self):
+        u"""
+        Возвращает и сбрасывает накопленные значения
+
+        :return: dict
+        """
+        with self._lock:
+            values = {field: getattr(self, field) for field in self.FIELDS}
+            for field in self.FIELDS:
+                setattr(self, field, 0)
+        return values
+
+    def on_response(self, response, **kwargs):
+        u"""
+        Hook requests: учитывает размер ответа. Тело читается здесь же,
+        requests все равно читает его целиком
+        """
+        wire, content = response_size(response)
+        self.add(requests=1, wire_bytes=wire, content_bytes=content)
+
+
+def response_size(response):
+    u"""
+    :return: tuple (байт по сети, байт после распаковки)
+    """
+    content = len(response.content or b'')
+    try:
+        wire = response.raw.tell()
+    except (AttributeError, ValueError):
+        wire = 0
+    return wire or content, content
+
+
+def _counting_pool(base, stats):
+    class CountingPool(base):
+        def _new_conn(self):
+            stats.add(connections=1)
+            return super()._new_conn()
+    return CountingPool
+
+
+class PooledAdapter(HTTPAdapter):
+    u"""
+    HTTPAdapter с настраиваемым пулом соединений и учетом новых соединений
+    """
+    def __init__(self, stats, pool_connections=HTTP_POOL_CONNECTIONS,
+                 pool_maxsize=HTTP_POOL_MAXSIZE):
+        self.stats = stats
+        # повторы выполняет retry.py
+        super().__init__(pool_connections=pool_connections,
+                         pool_maxsize=pool_maxsize, max_retries=0)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting_pool(HTTPConnectionPool, self.stats),
+            'https': _counting_pool(HTTPSConnectionPool, self.stats),
+        }
+
+
+def create_http_session(stats, pool_connections=HTTP_POOL_CONNECTIONS,
+                        pool_maxsize=HTTP_POOL_MAXSIZE):
+    u"""
+    Создает requests.Session с пулом keep-alive соединений и сжатием
+
+    :param stats: TransportStats
+    :param pool_connections: количество пулов соединений (по хостам)
+    :param pool_maxsize: соединений в пуле
+    :return: requests.Session
+    """
+    session = requests.Session()
+    adapter = PooledAdapter(stats, pool_connections, pool_maxsize)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update(DEFAULT_HEADERS)
+    session.hooks['response'].append(stats.on_response)
+    return session
+
+
+def format_stats(values):
+    u"""
+    :param values: dict из TransportStats.pop
+    :return: строка для лога
+    """
+    return (u"запросов {requests}, новых соединений {connections}, "
+            u"получено {wire:.1f} КБ ({content:.1f} КБ после "
+            u"распаковки)").format(
+        requests=values['requests'], connections=values['connections'],
+        wire=values['wire_bytes'] / 1024.0,
+        content=values['content_bytes'] / 1024.0)
@@ -1,13 +1,19 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
-from client import sfclient, settings, logger
+from client import sfclient, settings, logger, recording
 
 
 if __name__ == '__main__':
     log = logger.configure_logger(settings.LOGGER_NAME)
+    config = settings.set_config(settings.Config.from_args())
 
-    client = sfclient.Client()
+    if len(config.accounts) > 1:
+        client = sfclient.MultiClient(config=config)
+    else:
+        client = sfclient.Client(config)
     try:
         client.run()
+    except recording.ReplayFinished:
+        log.info(u"Запись воспроизведена")
     except KeyboardInterrupt:
         log.info(u"Завершение работы клиента")
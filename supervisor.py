@@ -0,0 +1,15 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+from client import settings, logger
+from client.supervisor import Supervisor
+
+
+if __name__ == '__main__':
+    log = logger.configure_logger(settings.LOGGER_NAME)
+    config = settings.set_config(settings.Config.from_args())
+
+    supervisor = Supervisor(config)
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        log.info(u"Завершение работы клиента")
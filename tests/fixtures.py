@@ -0,0 +1,100 @@
+# -*- coding: UTF-8 -*-
+u"""
+Данные для тестов: настройки и данные HeroBag:loadData (адепты, миссии и
+прогрессы) с явно заданными полями
+"""
+import configparser
+
+from client.gamedata import FollowerManager, MissionManager, Resources
+from client.settings import Config
+
+MINING = u"Добыча ресурсов"
+INVASION = u"Вторжение"
+CULT = u"Развитие культа"
+
+CONFIG = u"""
+[Auth]
+Page=http://127.0.0.1/skyforgenews
+Login=user
+Domain=mail.ru
+Password=secret
+SessionCacheDir=
+[Server]
+Portal=http://127.0.0.1
+Auth=http://127.0.0.1/cgi-bin/auth
+"""
+
+
+def config(extra=u""):
+    u"""
+    :param extra: дополнительные секции конфига
+    :return: settings.Config
+    """
+    conf = configparser.ConfigParser()
+    conf.read_string(CONFIG + extra)
+    return Config(conf)
+
+
+def follower(id_, efficiency=100, profession=1, busy=False):
+    return {
+        'id': id_,
+        'efficiency': efficiency,
+        'inProgress': busy,
+        'profession': {'id': profession},
+    }
+
+
+def mission(id_, slots=1, professions=(1,), experience=100, price=0,
+            duration=600, quality=CULT, case=False, busy=False):
+    return {
+        'id': id_,
+        'name': u"Миссия {}".format(id_),
+        'inProgress': busy,
+        'isSuccess': True,
+        'difficulty': 1,
+        'duration': duration,
+        'experience': experience,
+        'price': {
+            'currencies': [{'id': 1, 'amount': price}] if price else [],
+            'resources': [],
+        },
+        'professions': [{'id': p} for p in professions],
+        'slotCount': slots,
+        'missionQualityName': quality,
+        'missionType': 'Case' if case else 'Normal',
+    }
+
+
+def progress(id_, mission_id, end_ms, start_ms=0, finished=False):
+    return {
+        'id': id_,
+        'finished': finished,
+        'startTime': start_ms,
+        'endTime': end_ms,
+        'type': 'FUSE',
+        'fuseData': {'missionId': mission_id},
+    }
+
+
+def hero_bag(followers=(), missions=(), progresses=(), wallet=None):
+    return {
+        'wallet': {'1': 1000} if wallet is None else wallet,
+        'followers': list(followers),
+        'missions': list(missions),
+        'progresses': list(progresses),
+        'finishProgressOperationLink': '/cult/HeroBag:finishProgress',
+        'fuseOperationLink': '/cult/HeroBag:fuse',
+    }
+
+
+def managers(data):
+    u"""
+    :return: tuple (MissionManager, FollowerManager, Resources)
+    """
+    mission_manager = MissionManager()
+    mission_manager.update_many(data['missions'])
+    follower_manager = FollowerManager()
+    follower_manager.update_many(data['followers'])
+    resources = Resources()
+    resources.add(data)
+    return mission_manager, follower_manager, resources
@@ -0,0 +1,85 @@
+# -*- coding: UTF-8 -*-
+import unittest
+
+from client.assignment import AssignmentPlanner, GreedyPlanner, \
+    LookaheadPlanner
+
+from tests import fixtures
+
+
+def plan(planner, data):
+    mission_manager, follower_manager, resources = fixtures.managers(data)
+    missions = sorted(mission_manager.missions.values(), key=lambda m: m.id)
+    return [(mission.id, sorted(f.id for f in followers))
+            for mission, followers in planner.plan(
+                missions, follower_manager, resources)]
+
+
+class GreedyPlannerTest(unittest.TestCase):
+    def test_team_does_not_exceed_slot_count(self):
+        data = fixtures.hero_bag(
+            [fixtures.follower(i, profession=1) for i in range(1, 6)],
+            [fixtures.mission(10, slots=2, professions=(1,)),
+             fixtures.mission(11, slots=3, professions=(2,))])
+        self.assertEqual(plan(GreedyPlanner(), data),
+                         [(10, [1, 2]), (11, [3, 4, 5])])
+
+    def test_fills_missing_slots_with_efficient_followers(self):
+        data = fixtures.hero_bag(
+            [fixtures.follower(1, efficiency=10, profession=1),
+             fixtures.follower(2, efficiency=50, profession=2),
+             fixtures.follower(3, efficiency=90, profession=3)],
+            [fixtures.mission(10, slots=2, professions=(1,))])
+        self.assertEqual(plan(GreedyPlanner(), data), [(10, [1, 3])])
+
+    def test_skips_unaffordable_mission(self):
+        data = fixtures.hero_bag(
+            [fixtures.follower(1), fixtures.follower(2)],
+            [fixtures.mission(10, price=2000), fixtures.mission(11)])
+        self.assertEqual(plan(GreedyPlanner(), data), [(11, [1])])
+
+
+class AssignmentPlannerTest(unittest.TestCase):
+    def test_strong_follower_goes_to_richest_mission(self):
+        data = fixtures.hero_bag(
+            [fixtures.follower(1, efficiency=10),
+             fixtures.follower(2, efficiency=900)],
+            [fixtures.mission(10, experience=50),
+             fixtures.mission(11, experience=500)])
+        self.assertEqual(plan(AssignmentPlanner(), data),
+                         [(10, [1]), (11, [2])])
+
+    def test_no_free_followers(self):
+        data = fixtures.hero_bag(
+            [fixtures.follower(1, busy=True)], [fixtures.mission(10)])
+        mission_manager, follower_manager, _ = fixtures.managers(data)
+        self.assertEqual(AssignmentPlanner().assign(
+            list(mission_manager.missions.values()), follower_manager), [])
+
+
+class LookaheadPlannerTest(unittest.TestCase):
+    def setUp(self):
+        data = fixtures.hero_bag(
+            [fixtures.follower(1, efficiency=10),
+             fixtures.follower(2, efficiency=1000, busy=True)],
+            [fixtures.mission(10, experience=500, duration=3600)])
+        self.missions, self.follower_manager, self.resources = \
+            fixtures.managers(data)
+        self.releases = [(60, [self.follower_manager.get(2)])]
+
+    def plan(self, planner):
+        return planner.plan(list(self.missions.missions.values()),
+                            self.follower_manager, self.resources,
+                            self.releases)
+
+    def test_holds_mission_for_strong_follower(self):
+        self.assertEqual(self.plan(LookaheadPlanner()), [])
+
+    def test_release_beyond_horizon_is_ignored(self):
+        result = self.plan(LookaheadPlanner(horizon=30))
+        self.assertEqual([(m.id, [f.id for f in team])
+                          for m, team in result], [(10, [1])])
+
+
+if __name__ == '__main__':
+    unittest.main()
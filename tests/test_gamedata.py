@@ -0,0 +1,134 @@
+# -*- coding: UTF-8 -*-
+import sys
+import unittest
+from unittest import mock
+
+from client.assignment import GreedyPlanner
+from client.gamedata import Game, Mission, MissionManager, \
+    ProgressManager, merge_updates
+
+from tests import fixtures
+
+
+class EntityManagerTest(unittest.TestCase):
+    def test_empty_price_is_shared_and_immutable(self):
+        first = Mission.from_data(fixtures.mission(1))
+        second = Mission.from_data(fixtures.mission(2))
+        self.assertIs(first.price, second.price)
+        with self.assertRaises(TypeError):
+            first.price['currencies'] = [{'id': 1, 'amount': 10}]
+
+    def test_price_change_marks_mission_dirty(self):
+        manager = MissionManager()
+        manager.update_many([fixtures.mission(1)])
+        manager.pop_changes()
+        manager.update_many([fixtures.mission(1)])
+        self.assertEqual(manager.pop_changes(), set())
+        manager.update_many([fixtures.mission(1, price=10)])
+        self.assertEqual(manager.pop_changes(), {1})
+        manager.update_many([fixtures.mission(1)])
+        self.assertEqual(manager.pop_changes(), {1})
+        self.assertTrue(manager.get(1).is_free())
+
+    def test_progress_mission_change_marks_progress_dirty(self):
+        manager = ProgressManager()
+        manager.update_many([fixtures.progress(1, 10, 1000)])
+        manager.pop_changes()
+        manager.update_many([fixtures.progress(1, 11, 1000)])
+        self.assertEqual(manager.pop_changes(), {1})
+        self.assertEqual(manager.get(1).mission_id, 11)
+
+
+class GameTest(unittest.TestCase):
+    def test_default_planner_does_not_read_config(self):
+        with mock.patch.object(sys, 'argv', ['test', '--unknown']):
+            game = Game()
+        self.assertIsInstance(game.planner, GreedyPlanner)
+
+
+FOLLOWERS = range(1, 7)
+MISSIONS = (101, 102)
+END_MS = 600 * 1000
+
+
+def snapshot(running, slots=2, wallet=None, finished=False):
+    u"""
+    Данные HeroBag с запущенными миссиями
+
+    :param running: dict {progress id: (mission id, follower ids)}
+    """
+    busy_followers = {i for _, ids in running.values() for i in ids}
+    busy_missions = {mission_id for mission_id, _ in running.values()}
+    return fixtures.hero_bag(
+        followers=[fixtures.follower(i, busy=i in busy_followers)
+                   for i in FOLLOWERS],
+        missions=[fixtures.mission(i, slots=slots, busy=i in busy_missions)
+                  for i in MISSIONS],
+        progresses=[fixtures.progress(progress_id, mission_id, END_MS,
+                                      finished=finished)
+                    for progress_id, (mission_id, _) in running.items()],
+        wallet=wallet)
+
+
+class MergeUpdatesTest(unittest.TestCase):
+    def setUp(self):
+        # ответы на завершение прогрессов 1 и 2 в порядке обработки
+        # сервером: каждый освобождает адептов и пополняет кошелек
+        self.responses = [
+            snapshot({2: (102, (3, 4))}, wallet={'1': 1100}, finished=True),
+            snapshot({}, wallet={'1': 1200}),
+        ]
+
+    def assert_final(self, merged):
+        self.assertEqual(merged['progresses'], [])
+        self.assertFalse(any(f['inProgress'] for f in merged['followers']))
+        self.assertFalse(any(m['inProgress'] for m in merged['missions']))
+        self.assertEqual(merged['wallet'], {'1': 1200})
+
+    def test_server_order(self):
+        self.assert_final(merge_updates(self.responses))
+
+    def test_reversed_order(self):
+        self.assert_final(merge_updates(self.responses[::-1]))
+
+
+class StateProjectorTest(unittest.TestCase):
+    def setUp(self):
+        self.data = snapshot({1: (101, (1,))}, slots=1)
+        self.end_ms = END_MS
+        self.game = Game(planner=GreedyPlanner())
+        self.game.clock = lambda: self.end_ms / 1000.0
+
+    def test_projects_finished_progress(self):
+        self.game.update_state(self.data)
+        self.assertTrue(self.game.project_state())
+        self.assertTrue(all(
+            p.is_finished()
+            for p in self.game.progress_manager.progresses.values()))
+
+    def test_idle_turn_is_not_projected(self):
+        self.game.update_state(self.data)
+        self.end_ms -= 1
+        self.assertFalse(self.game.project_state())
+
+    def test_busy_mission_without_progress(self):
+        self.data['missions'][-1]['inProgress'] = True
+        self.game.update_state(self.data)
+        self.assertFalse(self.game.project_state())
+
+    def test_busy_follower_without_progress(self):
+        self.data['followers'][-1]['inProgress'] = True
+        self.game.update_state(self.data)
+        self.assertFalse(self.game.project_state())
+
+    def test_merged_batch_is_not_synced(self):
+        self.game.update_state(self.data)
+        self.game._handle_batch_results(
+            [(self.game.api.STATUS_SUCCESS, {
+                'operationResult': {'actionFailCause': 'None'},
+                'updateData': self.data}) for _ in range(2)])
+        self.assertFalse(self.game.project_state())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# -*- coding: UTF-8 -*-
+import configparser
+import json
+import unittest
+
+from client.heartbeat import Heartbeat, HealthchecksSink
+from client.settings import Config
+
+
+class RecordingSession:
+    def __init__(self):
+        self.posts = []
+
+    def post(self, url, data, timeout):
+        self.posts.append((url, json.loads(data.decode('utf-8'))))
+
+
+class HealthchecksSinkTest(unittest.TestCase):
+    def setUp(self):
+        self.sink = HealthchecksSink('https://hc.example/check/')
+        self.sink.session = RecordingSession()
+
+    def send(self, event, account):
+        self.sink.send({'event': event, 'account': account})
+        return self.sink.session.posts[-1][0]
+
+    def test_success_of_one_account_does_not_hide_failure(self):
+        self.assertEqual(self.send(Heartbeat.FAIL, 'first'),
+                         'https://hc.example/check/fail')
+        self.assertEqual(self.send(Heartbeat.START, 'second'),
+                         'https://hc.example/check/start')
+        self.assertEqual(self.send(Heartbeat.SUCCESS, 'second'),
+                         'https://hc.example/check/fail')
+        self.assertEqual(self.sink.session.posts[-1][1]['failed'],
+                         ['first'])
+        self.assertEqual(self.send(Heartbeat.SUCCESS, 'first'),
+                         'https://hc.example/check')
+
+
+class HeartbeatFromConfigTest(unittest.TestCase):
+    def test_account_check_url(self):
+        conf = configparser.ConfigParser()
+        conf.read_string(u"""
+[Auth]
+Domain=example
+Page=1
+Password=secret
+[Account first]
+Login=first
+Check_URL=https://hc.example/first
+[Account second]
+Login=second
+[Admin]
+Check_URL=https://hc.example/shared
+""")
+        heartbeat = Heartbeat.from_config(Config(conf))
+        self.assertEqual(heartbeat.sinks, [])
+        self.assertEqual(heartbeat.checks['first'].url,
+                         'https://hc.example/first')
+        self.assertEqual(heartbeat.checks[None].url,
+                         'https://hc.example/shared')
+        self.assertNotIn('second', heartbeat.checks)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+# -*- coding: UTF-8 -*-
+import logging
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from client.metrics import Counter, Gauge, Histogram, MetricsExporter, \
+    Registry
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        counter = Counter('requests_total', u"Запросы", ['endpoint'],
+                          registry=self.registry)
+        counter.inc(endpoint='start')
+        counter.inc(2, endpoint='start')
+        counter.inc(endpoint='fi"n\\')
+        self.assertEqual(self.registry.render(), (
+            u'# HELP requests_total Запросы\n'
+            u'# TYPE requests_total counter\n'
+            u'requests_total{endpoint="fi\\"n\\\\"} 1\n'
+            u'requests_total{endpoint="start"} 3\n'))
+
+    def test_gauge(self):
+        gauge = Gauge('utilisation', u"Доля", registry=self.registry)
+        gauge.set(0.5)
+        gauge.set(1.0)
+        self.assertEqual(gauge.render()[2:], ['utilisation 1'])
+
+    def test_histogram(self):
+        histogram = Histogram('latency', u"Длительность", ['endpoint'],
+                              registry=self.registry, buckets=(1, 0.1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, endpoint='get')
+        self.assertEqual(histogram.render()[2:], [
+            'latency_bucket{endpoint="get",le="0.1"} 2',
+            'latency_bucket{endpoint="get",le="1"} 3',
+            'latency_bucket{endpoint="get",le="+Inf"} 4',
+            'latency_sum{endpoint="get"} 3.65',
+            'latency_count{endpoint="get"} 4',
+        ])
+
+
+class MetricsExporterTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.path = os.path.join(self.directory, 'sfpy.prom')
+        self.registry = Registry()
+        Counter('turns_total', u"Ходы", registry=self.registry).inc()
+        self.exporter = MetricsExporter(path=self.path,
+                                        registry=self.registry,
+                                        logger=logging.getLogger('test'))
+
+    def test_dump(self):
+        self.exporter.dump()
+        with open(self.path) as f:
+            self.assertEqual(f.read(), self.registry.render())
+        self.assertEqual(os.listdir(self.directory), ['sfpy.prom'])
+
+    def test_failed_dump_removes_tmp_file(self):
+        with mock.patch('client.metrics.os.replace',
+                        side_effect=OSError('denied')), \
+                self.assertLogs('test', logging.WARNING):
+            self.exporter.dump()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_disabled(self):
+        MetricsExporter(registry=self.registry).dump()
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+# -*- coding: UTF-8 -*-
+import unittest
+
+from benchmarks import payloads
+from benchmarks.mockportal import GameState
+from client.assignment import GreedyPlanner
+
+from tests import fixtures
+
+
+class FuseTest(unittest.TestCase):
+    def setUp(self):
+        self.state = GameState(fixtures.hero_bag(
+            [fixtures.follower(i) for i in range(1, 4)],
+            [fixtures.mission(10, slots=2)]))
+
+    def test_rejects_over_full_team(self):
+        self.assertEqual(self.state.fuse(10, [1, 2, 3], 0),
+                         'WrongFollowersCount')
+        self.assertFalse(self.state.missions[10]['inProgress'])
+
+    def test_accepts_team_up_to_slot_count(self):
+        self.assertIsNone(self.state.fuse(10, [1, 2], 0))
+        self.assertTrue(self.state.followers[1]['inProgress'])
+        self.assertFalse(self.state.followers[3]['inProgress'])
+
+
+class GreedyPlanAcceptedTest(unittest.TestCase):
+    def test_greedy_plan_is_accepted(self):
+        state = GameState(payloads.hero_bag(followers=200, missions=40,
+                                            busy=0.0))
+        mission_manager, follower_manager, resources = fixtures.managers(
+            state.snapshot(0))
+        plan = GreedyPlanner().plan(
+            list(mission_manager.missions.values()), follower_manager,
+            resources)
+        self.assertTrue(plan)
+        for mission, followers in plan:
+            self.assertIsNone(state.fuse(
+                mission.id, [f.id for f in followers], 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+# -*- coding: UTF-8 -*-
+import logging
+import os
+import tempfile
+import unittest
+
+from client.ratelimit import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW, \
+    PRIORITY_RESERVE, FileTokenBucket, RateLimiter, TokenBucket, \
+    create_rate_limiter
+
+from tests import fixtures
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=2, burst=2)
+        self.assertEqual(bucket.reserve(PRIORITY_HIGH, now=0), 0)
+        self.assertEqual(bucket.reserve(PRIORITY_HIGH, now=0), 0)
+        # баланс уходит в минус, следующие запросы встают в очередь
+        self.assertEqual(bucket.reserve(PRIORITY_HIGH, now=0), 0.5)
+        self.assertEqual(bucket.reserve(PRIORITY_HIGH, now=0), 1.0)
+
+    def test_refill_is_capped_by_burst(self):
+        bucket = TokenBucket(rate=1, burst=2)
+        bucket.reserve(PRIORITY_HIGH, now=0)
+        for _ in range(2):
+            self.assertEqual(bucket.reserve(PRIORITY_HIGH, now=100), 0)
+        self.assertEqual(bucket.reserve(PRIORITY_HIGH, now=100), 1.0)
+
+    def test_priority_reserve(self):
+        waits = {}
+        for priority in PRIORITY_RESERVE:
+            bucket = TokenBucket(rate=1, burst=4)
+            bucket.reserve(PRIORITY_HIGH, now=0)
+            bucket.reserve(PRIORITY_HIGH, now=0)
+            waits[priority] = bucket.reserve(priority, now=0)
+        # в бакете 2 токена: низкий приоритет оставляет половину бакета,
+        # обычный - четверть
+        self.assertEqual(waits, {PRIORITY_HIGH: 0.0, PRIORITY_NORMAL: 0.0,
+                                 PRIORITY_LOW: 1.0})
+
+
+class FileTokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.path = os.path.join(self.directory, 'sfpy', 'ratelimit.json')
+
+    def test_state_is_shared(self):
+        first = FileTokenBucket(self.path, rate=1, burst=1)
+        second = FileTokenBucket(self.path, rate=1, burst=1)
+        self.assertEqual(first.reserve(PRIORITY_HIGH, now=0), 0)
+        self.assertEqual(second.reserve(PRIORITY_HIGH, now=0), 1.0)
+        self.assertTrue(second.shared)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+    def test_falls_back_to_process_bucket(self):
+        # вместо каталога для файла состояния - обычный файл
+        blocker = os.path.join(self.directory, 'blocker')
+        open(blocker, 'w').close()
+        bucket = FileTokenBucket(os.path.join(blocker, 'ratelimit.json'),
+                                 rate=1, burst=1,
+                                 logger=logging.getLogger('test'))
+        with self.assertLogs('test', logging.WARNING):
+            self.assertEqual(bucket.reserve(PRIORITY_HIGH, now=0), 0)
+        self.assertFalse(bucket.shared)
+        self.assertEqual(bucket.reserve(PRIORITY_HIGH, now=0), 1.0)
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_waits_for_slowest_bucket(self):
+        fast, slow = TokenBucket(rate=10, burst=1), TokenBucket(rate=1,
+                                                                burst=1)
+        limiter = RateLimiter([fast, None, slow])
+        limiter.reserve(PRIORITY_HIGH)
+        self.assertAlmostEqual(limiter.reserve(PRIORITY_HIGH), 1.0,
+                               places=2)
+
+    def test_disabled_by_default(self):
+        limiter = create_rate_limiter(fixtures.config())
+        self.assertEqual(limiter.buckets, [])
+        self.assertEqual(limiter.reserve(), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
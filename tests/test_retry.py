@@ -0,0 +1,205 @@
+# -*- coding: UTF-8 -*-
+import asyncio
+import concurrent.futures
+import email.utils
+import time
+import unittest
+from unittest import mock
+
+from client.auth import AsyncSession, Session
+from client.retry import CircuitBreaker, Retry, RetryError, RetryPolicy, \
+    get_retry_after
+
+from tests import fixtures
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, headers=None, content=b'{}'):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = content
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class MinRandom:
+    u"""
+    Вместо случайного значения возвращает нижнюю границу интервала
+    """
+    @staticmethod
+    def uniform(a, b):
+        return a
+
+
+class GetRetryAfterTest(unittest.TestCase):
+    def test_seconds(self):
+        self.assertEqual(get_retry_after(
+            FakeResponse(429, {'Retry-After': '7'})), 7.0)
+
+    def test_http_date(self):
+        value = email.utils.formatdate(time.time() + 60, usegmt=True)
+        delay = get_retry_after(FakeResponse(503, {'Retry-After': value}))
+        self.assertTrue(55 <= delay <= 60, delay)
+
+    def test_missing_or_invalid(self):
+        self.assertIsNone(get_retry_after(None))
+        self.assertIsNone(get_retry_after(FakeResponse(503)))
+        self.assertIsNone(get_retry_after(
+            FakeResponse(503, {'Retry-After': 'soon'})))
+
+
+class RetryTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+
+    def begin(self, **kwargs):
+        return Retry(RetryPolicy(**kwargs), clock=self.clock,
+                     rnd=MinRandom())
+
+    def test_success(self):
+        retry = self.begin()
+        self.assertIsNone(retry.check(FakeResponse(200)))
+        self.assertEqual(retry.attempts, 1)
+
+    def test_retry_status_and_network_error(self):
+        retry = self.begin(base_delay=2, max_delay=10)
+        self.assertEqual(retry.check(FakeResponse(503)), 2)
+        self.assertEqual(retry.check(None, ConnectionError()), 2)
+        self.assertEqual(retry.attempts, 2)
+
+    def test_other_status_is_not_retried(self):
+        self.assertIsNone(self.begin().check(FakeResponse(404)))
+
+    def test_retry_after_is_respected_up_to_max_delay(self):
+        retry = self.begin(base_delay=1, max_delay=30)
+        self.assertEqual(retry.check(
+            FakeResponse(429, {'Retry-After': '12'})), 12)
+        self.assertEqual(retry.check(
+            FakeResponse(429, {'Retry-After': '600'})), 30)
+
+    def test_delay_is_bounded(self):
+        retry = Retry(RetryPolicy(base_delay=1, max_delay=5),
+                      clock=self.clock)
+        for _ in range(20):
+            self.assertTrue(1 <= retry.failure() <= 5)
+
+    def test_deadline(self):
+        retry = self.begin(base_delay=2, deadline=5)
+        retry.check(FakeResponse(503))
+        self.clock.now = 4
+        with self.assertRaises(RetryError):
+            retry.check(FakeResponse(503))
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker('test', failure_threshold=2,
+                                      reset_timeout=10)
+
+    def test_opens_after_threshold(self):
+        self.assertFalse(self.breaker.record_failure(now=0))
+        self.assertEqual(self.breaker.wait_time(now=0), 0)
+        self.assertTrue(self.breaker.record_failure(now=0))
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.wait_time(now=4), 6)
+
+    def test_probe_success_closes(self):
+        self.breaker.record_failure(now=0)
+        self.breaker.record_failure(now=0)
+        self.assertEqual(self.breaker.wait_time(now=10), 0)
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        # пока идет пробный запрос, остальные ждут
+        self.assertEqual(self.breaker.wait_time(now=12), 8)
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.wait_time(now=12), 0)
+
+    def test_probe_failure_reopens(self):
+        self.breaker.record_failure(now=0)
+        self.breaker.record_failure(now=0)
+        self.breaker.wait_time(now=10)
+        self.assertTrue(self.breaker.record_failure(now=11))
+        self.assertEqual(self.breaker.wait_time(now=11), 10)
+
+
+class SessionGetTest(unittest.TestCase):
+    def setUp(self):
+        self.session = Session(config=fixtures.config())
+        self.session.cookies = {'csrf_token': 'token'}
+        self.responses = []
+        self.requests = []
+        self.session.session = mock.Mock()
+        self.session.session.get.side_effect = self.get
+        self.policy = RetryPolicy(base_delay=1, max_delay=5)
+        sleep = mock.patch('client.auth.time.sleep')
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def get(self, url, **kwargs):
+        self.requests.append(kwargs['params'])
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def test_retries_until_success(self):
+        from requests.exceptions import ConnectionError
+        self.responses = [FakeResponse(503), ConnectionError('down'),
+                          FakeResponse(200)]
+        response = self.session.get('http://127.0.0.1/api',
+                                    policy=self.policy)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual(self.sleep.call_count, 2)
+
+    def test_waits_for_retry_after(self):
+        self.responses = [FakeResponse(429, {'Retry-After': '4'}),
+                          FakeResponse(200)]
+        self.session.get('http://127.0.0.1/api', policy=self.policy)
+        self.sleep.assert_called_once_with(4)
+
+    def test_caller_params_are_not_modified(self):
+        self.responses = [FakeResponse(503), FakeResponse(200)]
+        params = {'progressId': 1}
+        self.session.get('http://127.0.0.1/api', policy=self.policy,
+                         params=params)
+        self.assertEqual(params, {'progressId': 1})
+        self.assertEqual(self.requests, [
+            {'progressId': 1, 'csrf_token': 'token'}] * 2)
+
+    def test_gives_up_after_deadline(self):
+        self.responses = [FakeResponse(503)] * 10
+        with mock.patch.object(Retry, 'elapsed', return_value=10):
+            with self.assertRaises(RetryError):
+                self.session.get('http://127.0.0.1/api', policy=RetryPolicy(
+                    base_delay=1, max_delay=1, deadline=5))
+        self.assertEqual(len(self.requests), 1)
+
+
+class AsyncSessionGetTest(unittest.TestCase):
+    def test_retries_until_success(self):
+        executor = concurrent.futures.ThreadPoolExecutor(1)
+        self.addCleanup(executor.shutdown)
+        config = fixtures.config()
+        session = AsyncSession(config.accounts[0], executor, config=config)
+        session.cookies = {'csrf_token': 'token'}
+        session.session = mock.Mock()
+        session.session.get.side_effect = [FakeResponse(503),
+                                           FakeResponse(200)]
+        sleep = mock.AsyncMock()
+        with mock.patch('client.auth.asyncio.sleep', sleep):
+            response = asyncio.run(session.get(
+                'http://127.0.0.1/api',
+                policy=RetryPolicy(base_delay=1, max_delay=1)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(session.session.get.call_count, 2)
+        sleep.assert_awaited_once_with(1)
+
+
+if __name__ == '__main__':
+    unittest.main()
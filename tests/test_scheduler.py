@@ -0,0 +1,62 @@
+# -*- coding: UTF-8 -*-
+import datetime
+import unittest
+from unittest import mock
+
+from client.scheduler import Scheduler
+from client.settings import DEADLINE_DELAY_SECONDS, \
+    DEADLINE_JITTER_SECONDS, MAX_OVERDUE_SECONDS, MIN_REQUEST_DELAY_SECONDS
+
+NOW = datetime.datetime(2026, 1, 1, 12, 0, 0)
+
+
+def after(seconds):
+    return NOW + datetime.timedelta(seconds=seconds)
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        # без случайного смещения: минимальные значения диапазонов
+        patcher = mock.patch('client.scheduler.random')
+        self.random = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.random.uniform.side_effect = lambda a, b: a
+        self.random.randint.side_effect = lambda a, b: a
+        self.scheduler = Scheduler(idle_minutes=20)
+
+    def test_idle_delay_without_deadlines(self):
+        self.assertEqual(self.scheduler.next_delay(NOW), 15 * 60)
+        self.random.randint.assert_called_with(15 * 60, 25 * 60)
+
+    def test_wakes_up_after_nearest_deadline(self):
+        self.scheduler.update([after(600), after(120), after(300)])
+        self.assertEqual(self.scheduler.next_deadline(NOW), after(120))
+        self.assertEqual(self.scheduler.next_delay(NOW),
+                         120 + DEADLINE_DELAY_SECONDS)
+        self.random.uniform.assert_called_with(0, DEADLINE_JITTER_SECONDS)
+
+    def test_delay_is_capped_by_idle_delay(self):
+        self.scheduler.update([after(3600)])
+        self.assertEqual(self.scheduler.next_delay(NOW), 15 * 60)
+
+    def test_min_delay(self):
+        self.scheduler.update([after(-60)])
+        self.assertEqual(self.scheduler.next_delay(NOW),
+                         MIN_REQUEST_DELAY_SECONDS)
+
+    def test_overdue_deadlines_are_dropped(self):
+        self.scheduler.update([after(-MAX_OVERDUE_SECONDS - 1), after(60)])
+        self.assertEqual(self.scheduler.next_deadline(NOW), after(60))
+        self.assertEqual(len(self.scheduler.deadlines), 1)
+        self.scheduler.update([after(-MAX_OVERDUE_SECONDS - 1)])
+        self.assertIsNone(self.scheduler.next_deadline(NOW))
+        self.assertEqual(self.scheduler.next_delay(NOW), 15 * 60)
+
+    def test_update_replaces_deadlines(self):
+        self.scheduler.update([after(60)])
+        self.scheduler.update([after(300)])
+        self.assertEqual(self.scheduler.next_deadline(NOW), after(300))
+
+
+if __name__ == '__main__':
+    unittest.main()
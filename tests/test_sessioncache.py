@@ -0,0 +1,87 @@
+# -*- coding: UTF-8 -*-
+import logging
+import os
+import tempfile
+import time
+import unittest
+
+from client.sessioncache import SessionCache
+from client.settings import Account
+
+ACCOUNT = Account('main', 'http://sf.mail.ru/', 'user@mail.ru', 'mail.ru',
+                  'secret', 'agent', 'http://sf.mail.ru/')
+STATE = {'cookies': {'sid': '1'}, 'csrf_token': 'token', 'urls': {}}
+
+
+class SessionCacheTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = os.path.join(directory.name, 'sessions')
+        self.cache = SessionCache(self.directory, max_age_hours=1,
+                                  logger=logging.getLogger('test'))
+
+    def test_roundtrip(self):
+        self.assertIsNone(self.cache.load(ACCOUNT))
+        self.cache.save(ACCOUNT, STATE)
+        path = self.cache.get_path(ACCOUNT)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+        self.assertEqual(os.listdir(self.directory), ['main.json'])
+        cache = SessionCache(self.directory, max_age_hours=1)
+        self.assertEqual(cache.load(ACCOUNT), STATE)
+
+    def test_other_login(self):
+        self.cache.save(ACCOUNT, STATE)
+        other = ACCOUNT._replace(login='other@mail.ru')
+        self.assertIsNone(self.cache.load(other))
+
+    def test_expired_by_mtime(self):
+        self.cache.save(ACCOUNT, STATE)
+        path = self.cache.get_path(ACCOUNT)
+        old = time.time() - 2 * 3600
+        os.utime(path, (old, old))
+        with self.assertLogs('test', logging.INFO):
+            self.assertIsNone(self.cache.load(ACCOUNT))
+
+    def test_unchanged_state_touches_file(self):
+        self.cache.save(ACCOUNT, STATE)
+        path = self.cache.get_path(ACCOUNT)
+        old = time.time() - 2 * 3600
+        os.utime(path, (old, old))
+        inode = os.stat(path).st_ino
+        self.cache.save(ACCOUNT, dict(STATE))
+        self.assertEqual(os.stat(path).st_ino, inode)
+        self.assertEqual(self.cache.load(ACCOUNT), STATE)
+
+    def test_rewrites_deleted_file(self):
+        self.cache.save(ACCOUNT, STATE)
+        os.unlink(self.cache.get_path(ACCOUNT))
+        self.cache.save(ACCOUNT, STATE)
+        self.assertEqual(self.cache.load(ACCOUNT), STATE)
+
+    def test_corrupted_file(self):
+        os.makedirs(self.directory)
+        with open(self.cache.get_path(ACCOUNT), 'w') as f:
+            f.write('{')
+        with self.assertLogs('test', logging.WARNING):
+            self.assertIsNone(self.cache.load(ACCOUNT))
+
+    def test_delete(self):
+        self.cache.save(ACCOUNT, STATE)
+        self.cache.delete(ACCOUNT)
+        self.assertIsNone(self.cache.load(ACCOUNT))
+        self.cache.delete(ACCOUNT)
+        # после удаления то же состояние записывается заново
+        self.cache.save(ACCOUNT, STATE)
+        self.assertEqual(self.cache.load(ACCOUNT), STATE)
+
+    def test_disabled(self):
+        cache = SessionCache('')
+        self.assertFalse(cache.enabled)
+        cache.save(ACCOUNT, STATE)
+        self.assertIsNone(cache.load(ACCOUNT))
+        cache.delete(ACCOUNT)
+
+
+if __name__ == '__main__':
+    unittest.main()